@@ -16,6 +16,8 @@ from pathlib import Path
 import sys
 import os
 
+from FastaReader import FastaReader
+
 tsv_path=Path(sys.argv[1]) #directory containing tsv tables with busco results
 tsv_path=tsv_path.glob('*')
 faa_path=Path(sys.argv[2]) #directory containing protein sequences for all species
@@ -102,18 +104,20 @@ inner values as sequences"""
 
 faa_dict=dict()
 for faa_file in faa_path:
-    with open(faa_file, 'r') as faa:
-        #Find species name
-        name=os.path.basename(faa_file)
-        species=name[0:2]
-        faa_dict[species]=dict()
-        
-        for line in faa:
-            if line.startswith(">"):
-                gene_id=line.strip("\n").strip(">").split("\t")[0]
-                line=next(faa)
-                sequence=line.strip("\n")
-                faa_dict[species][gene_id]=sequence
+    #Skip index files samtools faidx may have written next to the fasta files.
+    if faa_file.suffix in (".fai", ".gzi"):
+        continue
+    #Find species name
+    name=os.path.basename(faa_file)
+    species=name[0:2]
+    faa_dict[species]=dict()
+    if species not in Busco_dict:
+        continue
+    #Only the genes of the BUSCOs are kept, fetched over the .fai index of the file if
+    #it can have one, otherwise read in one pass. No index is written next to the file.
+    with FastaReader(str(faa_file)) as faa:
+        for gene_id, sequence in faa.sequences(Busco_dict[species].values()).items():
+            faa_dict[species][gene_id]=sequence.decode()
 
 
                 
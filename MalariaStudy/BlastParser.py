@@ -7,147 +7,160 @@ author: Mirjam Karlsson-Müller
 
 function: Takes a blast output file (from a swissprot database blast) and with the help of
 the swissprot database file, a taxonomy database file and a gff parsed fasta file identifies the scaffolds
-that contain bird genes. These are then excluded from the filtered genome file.
+that contain bird genes (or genes of any other excluded clade). These are then excluded from the filtered genome file.
 """
 
-import sys
+import argparse
+import os
 
-blast_out=sys.argv[1] #Blast output file
-fna_file=sys.argv[2] #gffParse amino acid sequence file
-genome_file=sys.argv[3] #filtered genome fasta file
-tax_dat=sys.argv[4] #taxonomy database, in our case: taxonomy.dat
-prot_dat=sys.argv[5] #swissprot database, in our case: uniprot_sprot.dat
-out_fasta=sys.argv[6] #output fasta file, removed bird scaffolds.
+from BlastReader import read_shards
+from FastaReader import FastaReader
+from ScaffoldScore import gene_locations, score_scaffolds, write_table
+from TaxonomyClades import TaxonomyClades
+from UniprotIndex import UniprotIndex
 
 """Run with:
 
 python BlastParser.py Blast/Ht_blastout.txt gffParse_output/gffParse.faa 
 genome_files/Haemoproteus_genome2_filtered.fasta taxonomy.dat uniprot_sprot.dat 
 Ht_without_birdscaff.fasta    
+
+The blast output can be the pairwise report, tabular (-outfmt 6 or 7) or XML
+(-outfmt 5), the format is detected. Output of a query split into several
+shards is given comma separated (Ht_1.tsv,Ht_2.tsv), the shards are read in
+parallel.
+
+By default scaffolds with bird genes are removed. Other clades, f.e. human or
+bacterial contamination as well, are given by name or taxid with --exclude:
+
+python BlastParser.py ... Ht_without_birdscaff.fasta --exclude Aves 9606 Bacteria
+
+A single contaminant gene removes a scaffold by default. To only remove scaffolds
+dominated by contamination, f.e. at least 2 bird genes making up half of the genes
+with a hit:
+
+python BlastParser.py ... Ht_without_birdscaff.fasta --min-hits 2 --min-fraction 0.5
+
+The counts and the decision of every scaffold are written to a table
+(Ht_without_birdscaff_scaffolds.tsv, or --table).
 """
 
-#%%
-"1. Retrieve top hit for each query, save in dictionary with query ID and hit."
 
-with open(blast_out, 'r') as blast:
-    result=True
+def main(argv=None):
+    "Runs the steps below on the files given on the command line (or in argv)."
+    parser=argparse.ArgumentParser(prog="BlastParser", description="Removes scaffolds with genes of excluded clades.")
+    parser.add_argument('blast_out', help='Blast output file(s), comma separated shards')
+    parser.add_argument('fna_file', help='gffParse amino acid sequence file')
+    parser.add_argument('genome_file', help='filtered genome fasta file')
+    parser.add_argument('tax_dat', help='taxonomy database, in our case: taxonomy.dat (or nodes.dmp)')
+    parser.add_argument('prot_dat', help='swissprot database, in our case: uniprot_sprot.dat')
+    parser.add_argument('out_fasta', help='output fasta file, removed bird scaffolds.')
+    parser.add_argument('--exclude', nargs='+', default=["Aves"],
+                        help='Clades (scientific names or taxids) whose hits mark a scaffold as contamination. Default: Aves')
+    parser.add_argument('--min-hits', type=int, default=1,
+                        help='Least number of genes with top hit in an excluded clade to remove a scaffold. Default: 1')
+    parser.add_argument('--min-fraction', type=float, default=0.0,
+                        help='Least fraction of contaminant genes among the genes with a hit. Default: 0')
+    parser.add_argument('--min-bitscore-fraction', type=float, default=0.0,
+                        help='Least share of the contaminant genes in the bit score of a scaffold. Default: 0')
+    parser.add_argument('--keep-geneless', action='store_true',
+                        help='Keep scaffolds without any predicted gene, by default they are removed.')
+    parser.add_argument('--table', help='Per scaffold scores and decisions. Default: <out_fasta>_scaffolds.tsv')
+    args=parser.parse_args(argv)
+
+    blast_out=args.blast_out.split(",") #Blast output file(s), comma separated shards
+    fna_file=args.fna_file #gffParse amino acid sequence file
+    genome_file=args.genome_file #filtered genome fasta file
+    tax_dat=args.tax_dat #taxonomy database, in our case: taxonomy.dat
+    prot_dat=args.prot_dat #swissprot database, in our case: uniprot_sprot.dat
+    out_fasta=args.out_fasta #output fasta file, removed bird scaffolds.
+
+    #%%
+    "1. Retrieve top hit for each query, save in dictionary with hit and the queries it is top hit of."
+
+    #Top hits by e-value, then bit score. Equally good hits are all kept.
+    top_hits=read_shards(blast_out)
     blast_dic=dict()
-    for line in blast:
-        if line.startswith("Query="):
-            #new query
-            Query=line.strip("\n").split(" ")[1]
-            result=False
-        if line.startswith(">"):
-            if result==False:
-                #this is top hit. We extract the accession number, as it is unique.
-                hit=line.strip("\n").split("|")[1]
-                result=True
-                blast_dic[hit]=[Query]
-
-#%%
-"2. Check what species the accession number (AC) of the hit corresponds to with uniprot database. "
-"Make a new dictionary with query as key and species list as value."
-
-uniprot_dic=dict()
-AC_found=False
-pot_ac="Null"
-oc=[]
-
-with open(prot_dat, 'r') as uniprot:
-    for line in uniprot:
-        if line.startswith("AC"):
-            if AC_found==True:
-                if pot_ac in blast_dic:
-                    uniprot_dic[blast_dic[pot_ac]]=oc
-                    oc=[]
-                    AC_found=False
-            #new accession number:
-            pot_ac=line.strip("\n").split(" ")[1    ]
-            AC_found=True    
-        
-        #Making species list.
-        if line.startswith("OC"):
-            l=line.strip("\n").split(" ")[1].split(";")
-            for i in l:
-                oc.append(i.strip(" "))
-        
-            
-
-#%%
-"3. Check if the any of the species in the lists of the previous step is a bird with taxonomy database"
-
-"3a. Make a bird set. yes. its as silly as it sounds."
-
-bird_set=set()
-with open(tax_dat, 'r') as taxonomy:
-        bird_section=False
-        for line in taxonomy:
-            #find bird section.
-            if line.startswith("BLAST NAME"):
-                if "birds" in line:
-                    bird_section=True
-                elif bird_section==True:
-                    break
-            elif line.startswith("SCIENTIFIC NAME") and bird_section==True:
-                bird_set.add(line.strip("\n").split(":")[1])
-
-
-"3b. Are our hits birds? "
-
-def is_this_a_bird(l):
-    "Checks if any of the names specified in a list are birds."
-    for element in l:
-        if element in bird_set:
-            return(True)
-    return(False)
-            
-            
-bird_dic=dict()
-for key in uniprot_dic:
-    if is_this_a_bird(uniprot_dic[key])==True:
-        bird_dic[key]=uniprot_dic(key)
-
-
-#%%
-"4. Read off scaffolds and corresponding query IDs of fasta."
-
-scaffold_dict=dict()
-with open(fna_file,'r') as fasta:
-    for line in fasta:
-        if line.startswith(">"):
-            line_list=line.split("\t")
-            query_id=line_list[0].strip(">")
-            scaffold_info=line_list[2]
-            scaffold_number=scaffold_info[9:22]
-            if scaffold_number in scaffold_dict: 
-                scaffold_dict[scaffold_number].append(query_id)
-            else:
-                scaffold_dict[scaffold_number]=[query_id]
-
-#%%
-"5. Check which scaffolds contain no birds!"
-not_a_bird_scaff=dict()
-for scaffold in scaffold_dict:
-    is_bird=False
-    for query in scaffold_dict[scaffold]:
-        if query in bird_dic.keys():
-            is_bird=True
-    if is_bird==False:
-        not_a_bird_scaff[scaffold]=scaffold_dict[scaffold]
-
-#%%
-"6. Write scaffolds of filtered Ht_file into output file that do not contain birds."
-
-bird_count=0
-with open(out_fasta,'w') as output, open(genome_file, 'r') as genome:
-    for line in genome:
-        if line.startswith(">"):
-            line_list=line.split(" ")
-            scaffold=line_list[0].strip(">")
-            if scaffold in not_a_bird_scaff.keys():
-                output.write(line)
-                line=next(genome)
-                output.write(line)
+    for Query in top_hits:
+        for hit in top_hits[Query]:
+            #We use the accession number of the hit, as it is unique.
+            if hit.accession in blast_dic:
+                blast_dic[hit.accession].append(Query)
             else:
-                bird_count+=1
-    print("The amount of bird scaffolds excluded is: ", bird_count)
+                blast_dic[hit.accession]=[Query]
+
+    #%%
+    "2. Check what species the accession number (AC) of the hit corresponds to with uniprot database. "
+    "Make a new dictionary with query as key and the taxids (OX line) of its top hits as value."
+
+    #The accession index (uniprot_sprot.dat.acidx) is built on the first run. It
+    #holds primary and secondary accessions, so only the entries of our hits are read.
+    uniprot_dic=dict()
+    with UniprotIndex(prot_dat) as uniprot:
+        for hit in blast_dic:
+            entry=uniprot.entry(hit)
+            if entry is None:
+                continue
+            #Making taxid list.
+            for query in blast_dic[hit]:
+                if query in uniprot_dic:
+                    uniprot_dic[query].append(entry["OX"])
+                else:
+                    uniprot_dic[query]=[entry["OX"]]
+
+
+    #%%
+    "3. Check if any of the taxids of the previous step belongs to an excluded clade, with the taxonomy database"
+
+    "3a. Label every taxid of the taxonomy with the excluded clade it is in."
+
+    clades=TaxonomyClades(tax_dat, args.exclude)
+
+
+    "3b. Are our hits birds (or in another excluded clade)? One array lookup per hit."
+
+    bird_dic=dict()
+    for key in uniprot_dic:
+        for taxid in uniprot_dic[key]:
+            clade=clades.clade_of(taxid)
+            if clade is not None:
+                bird_dic[key]=clade
+                break
+    for clade in clades.clades:
+        print("Queries with top hit in {}: {}".format(clade, sum(1 for found in bird_dic.values() if found==clade)))
+
+
+    #%%
+    "4. Find the scaffold and position of every gene from the gffParse headers."
+
+    #The scaffold is the first word of a header that is a scaffold of the genome, so
+    #the join does not depend on the length of the scaffold names.
+    genome=FastaReader(genome_file)
+    locations=gene_locations(fna_file, genome.index)
+    print("Genes placed on scaffolds: {} (genome of {} scaffolds)".format(len(locations), len(genome)))
+
+    #%%
+    "5. Score the scaffolds: contaminant genes, their fraction and bit score, in one pass over the genes."
+
+    bitscores={query: max(hit.bitscore for hit in hits) for query, hits in top_hits.items()}
+    scores=score_scaffolds(locations, bitscores, bird_dic, genome.names(), min_hits=args.min_hits,
+                           min_fraction=args.min_fraction, min_bitscore_fraction=args.min_bitscore_fraction,
+                           keep_geneless=args.keep_geneless)
+    table_file=args.table or os.path.splitext(out_fasta)[0]+"_scaffolds.tsv"
+    not_a_bird_scaff=write_table(scores, table_file)
+    print("Scaffold decisions written to", table_file)
+
+    #%%
+    "6. Write scaffolds of filtered Ht_file into output file that do not contain birds."
+
+    #The scaffolds are found over the .fai index of the genome and copied as they are,
+    #whether their sequence is on one line or wrapped over several.
+    with open(out_fasta,'wb') as output, genome:
+        kept=genome.copy(not_a_bird_scaff, output)
+        bird_count=len(genome)-kept
+        print("The amount of bird scaffolds excluded is: ", bird_count)
+
+
+#The shards are read by worker processes, which import this script again.
+if __name__=='__main__':
+    main()
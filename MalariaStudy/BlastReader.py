@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+date: 18.10.2026
+name: BlastReader.py
+author: Mirjam Karlsson-Müller
+
+function: Reads the hits of BLAST output and keeps the top hits of every
+query, in one streaming pass. Readers are available for tabular output
+(-outfmt 6 and 7), XML (-outfmt 5, parsed incrementally) and the default
+pairwise report; the format is detected from the start of the file. Several
+output files (f.e. of a query split into shards) are read in parallel and
+their top hits merged.
+
+used as:
+from BlastReader import read_shards
+top_hits=read_shards(["Ht_blastout_1.tsv", "Ht_blastout_2.tsv"])
+for query, hits in top_hits.items():
+    print(query, [hit.accession for hit in hits])
+"""
+
+import os
+import re
+import xml.etree.ElementTree as ElementTree
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+#One hit of a query: subject id, its accession (without version), e-value and bit score.
+Hit=namedtuple("Hit", ["query", "subject", "accession", "evalue", "bitscore"])
+
+#Columns of -outfmt 6 without field specification.
+STANDARD_FIELDS=["query acc.ver", "subject acc.ver", "% identity", "alignment length", "mismatches",
+                 "gap opens", "q. start", "q. end", "s. start", "s. end", "evalue", "bit score"]
+
+
+def accession(subject):
+    "Accession of a subject id without version, f.e. P69905 for sp|P69905.2|HBA_HUMAN."
+    parts=subject.split("|")
+    if len(parts)>2 and parts[0] in ("sp", "tr", "ref", "gb", "emb", "dbj", "pdb"):
+        subject=parts[1]
+    return subject.split(".")[0]
+
+
+def read_tabular(path):
+    """
+    Yields the hits of tabular BLAST output, -outfmt 6 or 7. For outfmt 7, the
+    query, subject, e-value and bit score columns are found over the
+    "# Fields:" line, otherwise the standard column order is assumed.
+    """
+    columns=[STANDARD_FIELDS.index(name) for name in ("query acc.ver", "subject acc.ver", "evalue", "bit score")]
+    with open(path, 'r') as blast:
+        for line in blast:
+            if line.startswith("#"):
+                if line.startswith("# Fields:"):
+                    fields=[field.strip() for field in line[len("# Fields:"):].split(",")]
+                    names=(("query id", "query acc.ver", "query acc"), ("subject id", "subject acc.ver", "subject acc"),
+                           ("evalue",), ("bit score",))
+                    columns=[next((i for i, field in enumerate(fields) if field in options), None) for options in names]
+                    for options, column in zip(names, columns):
+                        if column is None:
+                            raise ValueError("{}: no {} column in the # Fields line".format(path, options[0]))
+                continue
+            fields=line.rstrip("\n").split("\t")
+            if len(fields)<=max(columns):
+                continue
+            query, subject, evalue, bitscore=(fields[i] for i in columns)
+            yield Hit(query, subject, accession(subject), float(evalue), float(bitscore))
+
+
+def read_xml(path):
+    """
+    Yields the hits of XML BLAST output, -outfmt 5. The file is parsed
+    incrementally and every iteration (query) is cleared once read, so memory
+    stays bounded. The best HSP of a hit gives its e-value and bit score.
+    """
+    query=None
+    for event, element in ElementTree.iterparse(path, events=("end",)):
+        tag=element.tag
+        if tag=="Iteration_query-def":
+            query=(element.text or "").split(" ")[0]
+        elif tag=="Hit":
+            hsps=[(float(hsp.findtext("Hsp_evalue")), float(hsp.findtext("Hsp_bit-score")))
+                  for hsp in element.iter("Hsp")]
+            if hsps:
+                evalue, bitscore=min(hsps, key=lambda hsp: (hsp[0], -hsp[1]))
+                subject=element.findtext("Hit_id")
+                hit_accession=element.findtext("Hit_accession") or accession(subject)
+                yield Hit(query, subject, hit_accession.split(".")[0], evalue, bitscore)
+            element.clear()
+        elif tag=="Iteration":
+            element.clear()
+
+
+#Score line of an HSP in the pairwise report.
+_SCORE=re.compile(r"Score =\s*([\d.e+-]+) bits.*Expect(?:\(\d+\))? =\s*([\d.e+-]+)")
+
+
+def read_pairwise(path):
+    """
+    Yields the hits of the default pairwise BLAST report, from its "Query="
+    and ">" lines, and the score line of the first HSP of every hit.
+    """
+    query=subject=None
+    with open(path, 'r') as blast:
+        for line in blast:
+            if line.startswith("Query="):
+                query=line[len("Query="):].strip().split(" ")[0]
+                subject=None
+            elif line.startswith(">"):
+                subject=line[1:].strip().split(" ")[0]
+            elif subject is not None and "Score =" in line:
+                match=_SCORE.search(line)
+                if match:
+                    evalue=match.group(2)
+                    #The report writes e-values like e-120 without mantissa.
+                    evalue=float("1"+evalue if evalue.startswith("e") else evalue)
+                    yield Hit(query, subject, accession(subject), evalue, float(match.group(1)))
+                subject=None
+
+
+#Readers by format name, new formats can be added here.
+READERS={"tabular": read_tabular, "xml": read_xml, "pairwise": read_pairwise}
+
+
+def detect_format(path):
+    "Guesses the format of a BLAST output file from its start."
+    with open(path, 'r') as blast:
+        start=blast.read(4096)
+    if start.lstrip().startswith("<?xml"):
+        return "xml"
+    first=next((line for line in start.split("\n") if line.strip()), "")
+    if first.startswith("#") or "\t" in first:
+        return "tabular"
+    return "pairwise"
+
+
+def top_hits(hits, ties=True):
+    """
+    Keeps the best hits of every query: lowest e-value, then highest bit
+    score. Only the current best hits of each query are held, so the hits can
+    come straight from a reader.
+
+    Parameters
+    ----------
+    hits : iterable
+        Hit tuples, in any order.
+    ties : bool
+        keep all hits as good as the best one, otherwise only the first.
+
+    Returns
+    -------
+    best : dictionary
+        query as key, list of its top hits as value.
+
+    """
+    best=dict()
+    for hit in hits:
+        current=best.get(hit.query)
+        if current is None:
+            best[hit.query]=[hit]
+            continue
+        top=current[0]
+        if (hit.evalue, -hit.bitscore)<(top.evalue, -top.bitscore):
+            best[hit.query]=[hit]
+        elif ties and (hit.evalue, hit.bitscore)==(top.evalue, top.bitscore) \
+                and all(hit.accession!=other.accession for other in current):
+            current.append(hit)
+    return best
+
+
+def read_top_hits(path, blast_format=None, ties=True):
+    "Top hits of every query of one BLAST output file, see top_hits."
+    return top_hits(READERS[blast_format or detect_format(path)](path), ties)
+
+
+def merge_top_hits(results, ties=True):
+    "Merges the top hits of several files into one dictionary, as if they were read as one."
+    merged=dict()
+    for result in results:
+        for query, hits in result.items():
+            if query in merged:
+                merged[query]=top_hits(merged[query]+hits, ties)[query]
+            else:
+                merged[query]=hits
+    return merged
+
+
+def read_shards(paths, blast_format=None, ties=True, workers=None):
+    """
+    Reads several BLAST output files, in parallel processes, and merges their
+    top hits.
+
+    Parameters
+    ----------
+    paths : list
+        BLAST output files, all of them in the same format.
+    blast_format : string, optional
+        key of READERS, detected from the first file if not given.
+    ties : bool
+        keep all hits as good as the best one.
+    workers : int, optional
+        number of processes, by default one per file up to the number of CPUs.
+
+    Returns
+    -------
+    best : dictionary
+        query as key, list of its top hits as value.
+
+    """
+    paths=list(paths)
+    blast_format=blast_format or detect_format(paths[0])
+    workers=min(workers or os.cpu_count() or 1, len(paths))
+    if workers<=1:
+        return merge_top_hits((read_top_hits(path, blast_format, ties) for path in paths), ties)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results=pool.map(read_top_hits, paths, [blast_format]*len(paths), [ties]*len(paths))
+        return merge_top_hits(results, ties)
@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+date: 18.10.2026
+name: FastaReader.py
+author: Mirjam Karlsson-Müller
+
+function: Shared fasta access for the MalariaStudy scripts. Reads fasta files
+with sequences over one or several lines, plain, gzip or bgzip compressed. A
+samtools compatible index (.fai, and .gzi for bgzip) is reused if samtools
+faidx already made one, or built in memory (and only saved next to the fasta
+when asked to), so single records of plain and bgzip files can be fetched by
+their id with one seek instead of scanning the whole file, and records can be
+copied to another fasta as raw byte ranges (memory-mapped for plain files),
+without decoding them. Plain gzip files, and files an index can not describe
+(duplicate ids, lines of different lengths), are read in a single streaming
+pass instead.
+
+used as:
+from FastaReader import FastaReader
+genome=FastaReader("genome.fasta")
+genome.fetch("scaffold00001")
+genome.sequences(["scaffold00001", "scaffold00007"])
+for name, sequence in genome:
+    ...
+genome.copy(["scaffold00001", "scaffold00007"], output)
+"""
+
+import bisect
+import gzip
+import mmap
+import os
+import struct
+import zlib
+
+#Largest number of bytes of a bgzip block, compressed or not.
+_BGZF_BLOCK=65536
+
+
+def compression(path):
+    "Returns None for plain files, 'gzip' or 'bgzip' for compressed ones."
+    with open(path, 'rb') as handle:
+        start=handle.read(18)
+    if not start.startswith(b"\x1f\x8b"):
+        return None
+    #bgzip blocks are gzip members with a BC field giving the block size.
+    if len(start)==18 and start[3]&4 and start[12:14]==b"BC":
+        return "bgzip"
+    return "gzip"
+
+
+def open_fasta(path):
+    "Opens a plain or (b)gzip compressed fasta for reading bytes."
+    if compression(path) is None:
+        return open(path, 'rb')
+    return gzip.open(path, 'rb')
+
+
+def read_records(path):
+    """
+    Reads a fasta file one record at a time, for sequences on one or several
+    lines.
+
+    Yields
+    ------
+    name : string
+        id of the record, the header up to the first whitespace.
+    header : string
+        the whole header line, without ">".
+    sequence : bytes
+        sequence without line breaks.
+
+    """
+    with open_fasta(path) as fasta:
+        header=None
+        lines=[]
+        for line in fasta:
+            if line.startswith(b">"):
+                if header is not None:
+                    yield _name(header), header, b"".join(lines)
+                header=line[1:].rstrip(b"\r\n").decode()
+                lines=[]
+            else:
+                lines.append(line.rstrip(b"\r\n"))
+        if header is not None:
+            yield _name(header), header, b"".join(lines)
+
+
+def _name(header):
+    "Id of a record, as used by samtools: the header up to the first whitespace."
+    return header.split(None, 1)[0] if header.strip() else ""
+
+
+def _headers(path):
+    "Yields name and header of every record, in one streaming pass."
+    with open_fasta(path) as fasta:
+        for line in fasta:
+            if line.startswith(b">"):
+                header=line[1:].rstrip(b"\r\n").decode()
+                yield _name(header), header
+
+
+def build_fai(path):
+    """
+    Builds a samtools compatible fasta index.
+
+    Returns
+    -------
+    index : dictionary
+        name as key, (length, offset, linebases, linewidth) as value, in file
+        order: number of bases, offset of the first base in the uncompressed
+        file, bases per line and bytes per line (including the line break).
+
+    Raises
+    ------
+    ValueError
+        if the lines of a record have different lengths (other than the last
+        one), as the offset of a base could not be computed.
+
+    """
+    index=dict()
+    with open_fasta(path) as fasta:
+        offset=0
+        name=None
+        for line in fasta:
+            if line.startswith(b">"):
+                name=_name(line[1:].rstrip(b"\r\n").decode())
+                if name in index:
+                    raise ValueError("{}: duplicate record {}".format(path, name))
+                offset+=len(line)
+                #length, offset, linebases, linewidth, and whether the last (shorter) line was read.
+                record=index[name]=[0, offset, 0, 0, False]
+                continue
+            offset+=len(line)
+            if name is None:
+                continue
+            bases=len(line.rstrip(b"\r\n"))
+            if record[3]==0:
+                record[2]=bases
+                record[3]=len(line)
+            elif record[4] and bases:
+                raise ValueError("{}: different line length in record {}".format(path, name))
+            elif bases!=record[2] or len(line)!=record[3]:
+                if bases>record[2]:
+                    raise ValueError("{}: different line length in record {}".format(path, name))
+                record[4]=True
+            record[0]+=bases
+    return {name: tuple(record[:4]) for name, record in index.items()}
+
+
+def read_fai(fai_file):
+    "Reads a .fai file, see build_fai."
+    index=dict()
+    with open(fai_file, 'r') as fai:
+        for line in fai:
+            fields=line.rstrip("\n").split("\t")
+            index[fields[0]]=tuple(int(field) for field in fields[1:5])
+    return index
+
+
+def write_fai(index, fai_file):
+    "Writes an index made by build_fai as .fai file."
+    with open(fai_file, 'w') as fai:
+        for name, (length, offset, linebases, linewidth) in index.items():
+            fai.write("{}\t{}\t{}\t{}\t{}\n".format(name, length, offset, linebases, linewidth))
+
+
+def build_gzi(path):
+    """
+    Lists the bgzip blocks of a file, like bgzip -r.
+
+    Returns
+    -------
+    blocks : list
+        (compressed offset, uncompressed offset) of every block but the first.
+
+    """
+    blocks=[]
+    compressed=uncompressed=0
+    size=os.path.getsize(path)
+    with open(path, 'rb') as handle:
+        while compressed<size:
+            handle.seek(compressed)
+            header=handle.read(18)
+            if len(header)<18 or header[12:14]!=b"BC":
+                raise ValueError("{} is not bgzip compressed".format(path))
+            block_size=struct.unpack("<H", header[16:18])[0]+1
+            #The uncompressed size of the block is stored in its last four bytes.
+            handle.seek(compressed+block_size-4)
+            block_bases=struct.unpack("<I", handle.read(4))[0]
+            if compressed:
+                blocks.append((compressed, uncompressed))
+            compressed+=block_size
+            uncompressed+=block_bases
+    return blocks
+
+
+def read_gzi(gzi_file):
+    "Reads a .gzi file, see build_gzi."
+    with open(gzi_file, 'rb') as gzi:
+        count=struct.unpack("<Q", gzi.read(8))[0]
+        values=struct.unpack("<{}Q".format(2*count), gzi.read(16*count))
+    return list(zip(values[0::2], values[1::2]))
+
+
+def write_gzi(blocks, gzi_file):
+    "Writes a block list made by build_gzi as .gzi file."
+    with open(gzi_file, 'wb') as gzi:
+        gzi.write(struct.pack("<Q", len(blocks)))
+        for block in blocks:
+            gzi.write(struct.pack("<QQ", *block))
+
+
+def _fresh(index_file, path):
+    "Whether an index file exists and is not older than the file it indexes."
+    return os.path.exists(index_file) and os.path.getmtime(index_file)>=os.path.getmtime(path)
+
+
+class FastaReader:
+    """
+    Random access to the records of a fasta file over its .fai index.
+
+    Parameters
+    ----------
+    path : string
+        plain, gzip or bgzip compressed fasta.
+    save_index : bool
+        write a newly built index next to the fasta (path.fai, path.gzi),
+        where samtools would, so it is reused by later runs. Off by default,
+        reading a file does not add files to its directory.
+
+    Plain files are memory-mapped, bgzip files are read block by block over
+    the .gzi index. Plain gzip files can not be read at an offset, and files
+    with duplicate ids or lines of different lengths have no .fai index: both
+    are only read in one streaming pass (iteration, sequences and copy), fetch
+    raises ValueError for them.
+    """
+
+    def __init__(self, path, save_index=False):
+        self.path=path
+        self.compression=compression(path)
+        #Whether records can be read at an offset; set to False below if not.
+        self.indexed=self.compression!="gzip"
+        fai_file=path+".fai"
+        if not self.indexed:
+            #Offsets into a plain gzip file are of no use, only the names are read.
+            self.index=dict.fromkeys(name for name, header in _headers(path))
+        elif _fresh(fai_file, path):
+            self.index=read_fai(fai_file)
+        else:
+            try:
+                self.index=build_fai(path)
+            except ValueError:
+                #Duplicate ids or uneven lines: names only, read by streaming.
+                self.index=dict.fromkeys(name for name, header in _headers(path))
+                self.indexed=False
+                save_index=False
+            if save_index:
+                try:
+                    write_fai(self.index, fai_file)
+                except OSError:
+                    pass
+        self._blocks=None
+        if self.compression=="bgzip" and self.indexed:
+            gzi_file=path+".gzi"
+            if _fresh(gzi_file, path):
+                blocks=read_gzi(gzi_file)
+            else:
+                blocks=build_gzi(path)
+                if save_index:
+                    try:
+                        write_gzi(blocks, gzi_file)
+                    except OSError:
+                        pass
+            self._blocks=[(0, 0)]+blocks
+            self._starts=[uncompressed for compressed, uncompressed in self._blocks]
+        self._handle=open(path, 'rb')
+        self._map=None
+        if self.compression is None and os.path.getsize(path):
+            self._map=mmap.mmap(self._handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        "Yields (name, sequence) of all records in file order, streaming."
+        for name, header, sequence in read_records(self.path):
+            yield name, sequence
+
+    def names(self):
+        "Ids of all records, in file order."
+        return list(self.index)
+
+    def _check_indexed(self):
+        if self.indexed:
+            return
+        if self.compression=="gzip":
+            raise ValueError("{} is gzip compressed and can not be read at an offset, "
+                             "bgzip it (or read it with sequences or copy)".format(self.path))
+        raise ValueError("{} has duplicate ids or lines of different lengths and no index, "
+                         "read it with sequences or copy".format(self.path))
+
+    def sequences(self, names):
+        """
+        Sequences of the records in names, read over the index, or in one
+        streaming pass for files without one.
+
+        Returns
+        -------
+        sequences : dictionary
+            name as key, sequence (bytes) as value; names not in the file are
+            left out. Of duplicate ids, the last record is kept.
+
+        """
+        wanted=set(names)
+        if self.indexed:
+            return dict((name, self.fetch(name)) for name in self.index if name in wanted)
+        return dict((name, sequence) for name, header, sequence in read_records(self.path) if name in wanted)
+
+    def _read(self, offset, size):
+        "Reads size bytes at an offset of the uncompressed file."
+        if self._map is not None:
+            return self._map[offset:offset+size]
+        if self.compression is None:
+            return b""
+        #bgzip: start at the block holding offset, decompress blocks until size bytes are read.
+        i=bisect.bisect_right(self._starts, offset)-1
+        compressed, uncompressed=self._blocks[i]
+        self._handle.seek(compressed)
+        pieces=[]
+        read=0
+        skip=offset-uncompressed
+        while read<size+skip:
+            header=self._handle.read(18)
+            if len(header)<18:
+                break
+            block_size=struct.unpack("<H", header[16:18])[0]+1
+            data=zlib.decompress(header+self._handle.read(block_size-18), 31)
+            pieces.append(data)
+            read+=len(data)
+        return b"".join(pieces)[skip:skip+size]
+
+    def _span(self, name):
+        "Offset of the first base and number of bytes of the sequence lines of a record."
+        length, offset, linebases, linewidth=self.index[name]
+        if linebases==0:
+            return offset, 0
+        lines, rest=divmod(length, linebases)
+        return offset, lines*linewidth+rest
+
+    def fetch(self, name):
+        """
+        Returns the sequence of a record (bytes, without line breaks), read
+        with a single seek. Raises KeyError if there is no such record, and
+        ValueError for files without index (see the class).
+        """
+        self._check_indexed()
+        offset, size=self._span(name)
+        return self._read(offset, size).translate(None, b"\r\n")
+
+    def _header_start(self, offset):
+        "Offset of the header line of the record whose sequence starts at offset."
+        window=1024
+        while True:
+            start=max(offset-window, 0)
+            data=self._read(start, offset-start)
+            #The header line is the line before offset starting with ">".
+            found=data.rfind(b"\n>", 0, len(data)-1)
+            if found!=-1:
+                return start+found+1
+            if start==0:
+                return 0
+            window*=4
+
+    def raw_range(self, name):
+        "Byte range (start, end) of a record in the uncompressed file, header and line breaks included."
+        self._check_indexed()
+        offset, size=self._span(name)
+        end=offset+size
+        #Take the line break of the last line along.
+        tail=self._read(end, 2)
+        if tail.startswith(b"\r\n"):
+            end+=2
+        elif tail.startswith(b"\n"):
+            end+=1
+        return self._header_start(offset), end
+
+    def copy(self, names, output):
+        """
+        Writes the records in names, in file order, to output (opened for
+        bytes) as they are in the fasta: header, line breaks and case are
+        kept. Plain files are copied straight from the memory map, files
+        without index line by line in one streaming pass.
+
+        Returns
+        -------
+        copied: int
+            number of records written.
+
+        """
+        wanted=set(names)
+        copied=0
+        if not self.indexed:
+            keep=False
+            with open_fasta(self.path) as fasta:
+                for line in fasta:
+                    if line.startswith(b">"):
+                        keep=_name(line[1:].rstrip(b"\r\n").decode()) in wanted
+                        copied+=keep
+                    if keep:
+                        output.write(line)
+            return copied
+        for name in self.index:
+            if name in wanted:
+                start, end=self.raw_range(name)
+                output.write(self._read(start, end-start))
+                copied+=1
+        return copied
@@ -6,62 +6,369 @@ name: Scaffold.py
 author: Mirjam Karlsson-Müller
 """
 
+import argparse
+import math
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+#numpy is optional, it makes counting the bases several times faster.
+try:
+    import numpy
+except ImportError:
+    numpy=None
 """
 run in console with: python Scaffold.py input_file min_scaffold_size gc_content output_file
 
-Input and output files are fastas, the scaffold and gc contents need to be numbers, whereas the gc content furthermore 
+Input and output files are fastas, the scaffold and gc contents need to be numbers, whereas the gc content furthermore
 needs to be a percentage, i.e. a number between 1-100.
+
+The fasta is streamed: each scaffold is read, checked and (if it passes) written
+before the next one is read, so only one scaffold is held in memory at a time.
+
+Optional tables:
+    --composition TABLE    A, C, G, T, N and other counts and GC of every scaffold.
+    --windows TABLE        GC profile of every scaffold in sliding windows, to spot
+                           chimeric scaffolds (f.e. parasite joined to host).
+    --window SIZE          window size in nucleotides. Default: 10000
+    --step STEP            distance between window starts. Default: window size
+
+python Scaffold.py Haemoproteus_tartakovskyi.genome 3000 35 filtered.fasta --windows gc_windows.tsv --window 5000 --step 1000
+
+With --threads N, batches of scaffolds are checked by N processes, the output
+is still written in the order of the input:
+python Scaffold.py assembly.fasta 3000 35 filtered.fasta --threads 32
 """
 
-#inputs. 
-fastafile=sys.argv[1]    
-min_size=int(sys.argv[2])
-gc_content=float(int(sys.argv[3]))
-outfile=sys.argv[4]
-    
+#Bases counted separately, everything else is counted as other.
+BASES=b"ACGTN"
+#Bytes counted at once by numpy, small enough to stay in the CPU cache.
+_CHUNK=256*1024
+#Bytes of scaffolds sent to a worker process at once by --threads.
+_BATCH=4*1024*1024
+
+
+def composition(sequence):
+    """
+    Counts the bases of a nucleotide sequence in one pass over its bytes.
+
+    Parameters
+    ----------
+    sequence : bytes
+        nucleotides, upper case.
+
+    Returns
+    -------
+    counts : tuple
+        number of A, C, G, T, N and of all other characters.
+
+    """
+    if numpy is None:
+        counts=[sequence.count(base) for base in BASES]
+    else:
+        counts=[0]*len(BASES)
+        codes=numpy.frombuffer(sequence, dtype=numpy.uint8)
+        #All bases are counted on one cache sized piece before moving on.
+        for start in range(0, len(codes), _CHUNK):
+            piece=codes[start:start+_CHUNK]
+            for i, base in enumerate(BASES):
+                counts[i]+=int(numpy.count_nonzero(piece==base))
+    return tuple(counts)+(len(sequence)-sum(counts),)
+
+
+def gc_percent(counts):
+    "GC content in percent of A, C, G, T counts (see composition), N and others are left out."
+    total=counts[0]+counts[1]+counts[2]+counts[3]
+    if total==0:
+        return 0.0
+    return round((counts[1]+counts[2])/total *100, 2)
+
 
 def GC(sequence):
     """
-    Returns GC content of a nucleotide sequence. 
+    Returns GC content of a nucleotide sequence.
     Parameters
     ----------
-    sequence : string
-        string of nucleotides.
+    sequence : bytes
+        nucleotides, upper case.
 
     Returns
     -------
     float
-        Percentage of nucleotides being G or C.
-
-    """
-    gc=sequence.count("C")+sequence.count("G")
-    total=gc+sequence.count("A")+sequence.count("T")
-    return round(gc/total *100, 2)
-
-with open(fastafile, 'r') as fasta:
-    sequences=[]
-    current_seq=""
-    headers=[]
-    for line in fasta:
-        if line.startswith(">"):
-            headers.append(line.strip("\n").split(" ")[0])
-            if len(current_seq)>0:
-                sequences.append(current_seq)
-                current_seq=""
-        else:
-            current_seq=current_seq+line.strip("\n").upper()
-            
-fasta=dict()
-for i in range(0,len(headers)-1):
-    fasta[headers[i]]=sequences[i]
-    
-            
-with open(outfile, 'w') as out:
-    for ids in fasta:
-        #Check size:
-        if len(fasta[ids])>=min_size:
-            #check gc content:
-            gc=GC(fasta[ids])
-            if gc<=gc_content:
-                out.write('{}, GC: {}, Length: {}\n{}\n'.format(ids, gc, len(fasta[ids]), fasta[ids])) #write the output file.
\ No newline at end of file
+        Percentage of nucleotides being G or C, 0 if there are no A, C, G or T.
+
+    """
+    return gc_percent(composition(sequence))
+
+
+def windows(sequence, window=10000, step=None):
+    """
+    Base counts of a sequence in sliding windows. The last window is cut at
+    the end of the sequence, and no window starts after it.
+
+    Parameters
+    ----------
+    sequence : bytes
+        nucleotides, upper case.
+    window : int
+        window size.
+    step : int, optional
+        distance between window starts, window size by default.
+
+    Yields
+    ------
+    start, end : int
+        0-based start and end (exclusive) of the window.
+    counts : tuple
+        as returned by composition.
+
+    """
+    step=step or window
+    length=len(sequence)
+    starts=[0]
+    while starts[-1]+window<length and starts[-1]+step<length:
+        starts.append(starts[-1]+step)
+    if numpy is None:
+        for start in starts:
+            yield start, min(start+window, length), composition(sequence[start:start+window])
+        return
+    #Windows and steps are made of blocks of the greatest common divisor of
+    #both. The blocks are counted once, each window is a difference of the
+    #cumulative block counts.
+    block=math.gcd(window, step)
+    codes=numpy.frombuffer(sequence, dtype=numpy.uint8)
+    full=length//block
+    counts=numpy.zeros((full+(length%block>0)+1, len(BASES)+1), dtype=numpy.int64)
+    rows=max(_CHUNK//block, 1)
+    for first in range(0, full, rows):
+        blocks=codes[first*block:min(first+rows, full)*block].reshape(-1, block)
+        for i, base in enumerate(BASES):
+            counts[first+1:first+1+len(blocks), i]=numpy.count_nonzero(blocks==base, axis=1)
+    if length%block:
+        counts[-1, :len(BASES)]=composition(sequence[full*block:])[:len(BASES)]
+    sizes=numpy.full(len(counts), block, dtype=numpy.int64)
+    sizes[0]=0
+    sizes[-1]=length-full*block if length%block else block
+    counts[:, len(BASES)]=sizes-counts[:, :len(BASES)].sum(axis=1)
+    cumulative=numpy.cumsum(counts, axis=0)
+    starts=numpy.asarray(starts, dtype=numpy.int64)
+    ends=numpy.minimum(starts+window, length)
+    totals=cumulative[-(-ends//block)]-cumulative[starts//block]
+    for start, end, total in zip(starts.tolist(), ends.tolist(), totals.tolist()):
+        yield start, end, tuple(total)
+
+
+def _record(data):
+    "Header and sequence of one scaffold, from its text."
+    newline=data.find(b"\n")
+    if newline==-1:
+        newline=len(data)
+    header=data[:newline].rstrip(b"\r").split(b" ")[0]
+    return header, data[newline+1:].translate(None, b"\r\n").upper()
+
+
+def _raw_records(fastafile, block_size=8*1024*1024):
+    """
+    Reads a fasta file one scaffold at a time, as the text of the scaffold
+    (header and sequence lines). The file is read in large blocks, which are
+    cut where a new header starts, the pieces of a scaffold are joined once it
+    ends. Text before the first header is skipped.
+    """
+    with open(fastafile, 'rb') as fasta:
+        parts=[]
+        for block in iter(lambda: fasta.read(block_size), b""):
+            start=0
+            #A header right at the start of the block.
+            if block.startswith(b">") and parts and parts[-1].endswith(b"\n"):
+                data=b"".join(parts)
+                if data.startswith(b">"):
+                    yield data
+                parts=[]
+            cut=block.find(b"\n>")
+            while cut!=-1:
+                parts.append(block[start:cut+1])
+                data=b"".join(parts)
+                if data.startswith(b">"):
+                    yield data
+                parts=[]
+                start=cut+1
+                cut=block.find(b"\n>", start)
+            parts.append(block[start:])
+        #The last scaffold ends with the file.
+        data=b"".join(parts)
+        if data.startswith(b">"):
+            yield data
+
+
+def read_fasta(fastafile, block_size=8*1024*1024):
+    """
+    Reads a fasta file one scaffold at a time. The line breaks of a scaffold
+    are removed in a single pass once it is read, instead of growing a string
+    line by line.
+
+    Parameters
+    ----------
+    fastafile : string
+        path of the fasta file.
+    block_size : int
+        bytes read at once.
+
+    Yields
+    ------
+    header : bytes
+        first word of the header line, including ">".
+    sequence : bytes
+        sequence of the scaffold, upper case, without line breaks.
+
+    """
+    for data in _raw_records(fastafile, block_size):
+        yield _record(data)
+
+
+def _batches(records, size=_BATCH):
+    "Groups scaffold texts into lists of about size bytes."
+    batch=[]
+    filled=0
+    for data in records:
+        batch.append(data)
+        filled+=len(data)
+        if filled>=size:
+            yield batch
+            batch=[]
+            filled=0
+    if batch:
+        yield batch
+
+
+def _filter_records(batch, min_size, gc_content, composition_table=False, windows_table=False, window=10000, step=None):
+    """
+    Checks a batch of scaffolds (texts as read by _raw_records), in the main
+    process or in a worker process of --threads.
+
+    Returns
+    -------
+    fasta : bytes
+        passing scaffolds, as written to the output fasta.
+    table, profile : string
+        rows of the composition and windows tables (empty if not asked for).
+    kept, total : int
+        number of scaffolds passing, and checked.
+
+    """
+    fasta=[]
+    table=[]
+    profile=[]
+    kept=0
+    for data in batch:
+        ids, sequence=_record(data)
+        counts=composition(sequence)
+        gc=gc_percent(counts)
+        #Check size and gc content:
+        passed=len(sequence)>=min_size and gc<=gc_content
+        if passed:
+            kept+=1
+            fasta.append('{}, GC: {}, Length: {}\n'.format(ids.decode(), gc, len(sequence)).encode()) #write the output file.
+            fasta.append(sequence+b"\n")
+        name=ids.decode().lstrip(">")
+        if composition_table:
+            table.append("{}\t{}\t{}\t{}\t{}\n".format(name, len(sequence), "\t".join(map(str, counts)), gc,
+                                                      "yes" if passed else "no"))
+        if windows_table:
+            #Windows are 1-based and inclusive in the table, like in gff files.
+            profile.extend("{}\t{}\t{}\t{}\t{}\n".format(name, start+1, end, "\t".join(map(str, window_counts)),
+                                                        gc_percent(window_counts))
+                           for start, end, window_counts in windows(sequence, window, step))
+    return b"".join(fasta), "".join(table), "".join(profile), kept, len(batch)
+
+
+def _map_ordered(function, batches, threads):
+    """
+    Runs function on every batch in a pool of threads processes and yields
+    the results in input order. At most 2*threads batches are in flight, so
+    memory stays bounded however large the fasta is.
+    """
+    pending=deque()
+    with ProcessPoolExecutor(max_workers=threads) as pool:
+        for batch in batches:
+            if len(pending)>=2*threads:
+                yield pending.popleft().result()
+            pending.append(pool.submit(function, batch))
+        while pending:
+            yield pending.popleft().result()
+
+
+def filter_fasta(fastafile, min_size, gc_content, outfile, composition_file=None, windows_file=None,
+                 window=10000, step=None, threads=1):
+    """
+    Writes all scaffolds of at least min_size nucleotides and a GC content of
+    at most gc_content percent to outfile, as soon as they are read.
+
+    Parameters
+    ----------
+    composition_file : string, optional
+        tab separated table of the base counts and GC of every scaffold.
+    windows_file : string, optional
+        tab separated table of the base counts and GC of every window of every
+        scaffold, see windows.
+    window, step : int
+        size of and distance between the windows.
+    threads : int
+        number of worker processes, 1 checks the scaffolds in this process.
+
+    Returns
+    -------
+    kept, total: int
+        number of scaffolds written, and read.
+
+    """
+    kept=total=0
+    columns="\t".join(chr(base) for base in BASES)+"\tother\tGC"
+    work=partial(_filter_records, min_size=min_size, gc_content=gc_content, composition_table=bool(composition_file),
+                 windows_table=bool(windows_file), window=window, step=step)
+    if threads>1:
+        results=_map_ordered(work, _batches(_raw_records(fastafile)), threads)
+    else:
+        #One scaffold at a time, only one scaffold is held in memory.
+        results=(work([data]) for data in _raw_records(fastafile))
+    with open(outfile, 'wb', buffering=1024*1024) as out:
+        table=open(composition_file, 'w') if composition_file else None
+        profile=open(windows_file, 'w') if windows_file else None
+        if table:
+            table.write("scaffold\tlength\t{}\tkept\n".format(columns))
+        if profile:
+            profile.write("scaffold\tstart\tend\t{}\n".format(columns))
+        for fasta, rows, window_rows, batch_kept, batch_total in results:
+            out.write(fasta)
+            if table:
+                table.write(rows)
+            if profile:
+                profile.write(window_rows)
+            kept+=batch_kept
+            total+=batch_total
+        if table:
+            table.close()
+        if profile:
+            profile.close()
+    return kept, total
+
+
+if __name__=='__main__':
+    #inputs.
+    parser=argparse.ArgumentParser(prog="Scaffold",
+                                   description="Keeps the scaffolds of a fasta above a minimum size and below a GC content.")
+    parser.add_argument('fastafile', help='Input fasta.')
+    parser.add_argument('min_size', type=int, help='Minimum scaffold length.')
+    parser.add_argument('gc_content', type=float, help='Maximum GC content in percent.')
+    parser.add_argument('outfile', help='Output fasta.')
+    parser.add_argument('--composition', default=None, help='Table of A, C, G, T, N, other counts and GC per scaffold.')
+    parser.add_argument('--windows', default=None, help='Table of the GC profile of every scaffold in sliding windows.')
+    parser.add_argument('--window', type=int, default=10000, help='Window size. Default: 10000')
+    parser.add_argument('--step', type=int, default=None, help='Distance between window starts. Default: window size')
+    parser.add_argument('--threads', type=int, default=1, help='Number of processes checking scaffolds. Default: 1')
+    args=parser.parse_args()
+    if args.window<1 or (args.step is not None and args.step<1):
+        parser.error("--window and --step need to be positive.")
+
+    filter_fasta(args.fastafile, args.min_size, args.gc_content, args.outfile, args.composition, args.windows,
+                 args.window, args.step, max(args.threads, 1))
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+date: 18.10.2026
+name: ScaffoldScore.py
+author: Mirjam Karlsson-Müller
+
+function: Scores the scaffolds of a genome for contamination from the genes
+predicted on them. Genes are joined to their scaffold over the scaffold name
+and coordinates in the gene headers (as written by gffParse.pl). Every gene
+then gets the number of its scaffold, and the counts per scaffold (genes,
+genes with a hit, genes whose top hit is in an excluded clade, their bit
+scores) are summed up for all scaffolds at once, with numpy.bincount if numpy
+is installed. A scaffold is excluded when it reaches all thresholds, and every
+decision is written to a table.
+
+used as:
+from ScaffoldScore import gene_locations, score_scaffolds, write_table
+locations=gene_locations("gffParse.faa", genome.index)
+scores=score_scaffolds(locations, bitscores, contaminants, genome.names(), min_hits=2, min_fraction=0.5)
+kept=write_table(scores, "scaffold_scores.tsv")
+"""
+
+import re
+
+#numpy is optional, it sums up the genes of all scaffolds in whole-array operations.
+try:
+    import numpy
+except ImportError:
+    numpy=None
+
+#Words of a header, between the separators of the scaffold name and the coordinates of a gene.
+_TOKENS=re.compile(r"[^\s=:,;|()\[\]]+")
+_COORDINATES=re.compile(r"(\d+)\s*(?:-|\.\.)\s*(\d+)")
+
+
+def gene_locations(fna_file, scaffolds):
+    """
+    Finds the scaffold, start and end of every gene of a gffParse fasta.
+
+    Parameters
+    ----------
+    fna_file : string
+        fasta of the genes, the header names the scaffold of the gene, f.e.
+        ">1_g  ...  scaffold01477:21-1216".
+    scaffolds : dictionary or set
+        names of the scaffolds of the genome (f.e. FastaReader.index), the
+        first word of a header that is one of them is the scaffold.
+
+    Returns
+    -------
+    locations : dictionary
+        gene id (first word of the header) as key, (scaffold, start, end) as
+        value; start and end are None if the header has no coordinates.
+
+    """
+    locations=dict()
+    with open(fna_file, 'r') as fasta:
+        for line in fasta:
+            if not line.startswith(">"):
+                continue
+            header=line[1:].rstrip("\n")
+            gene=header.split(None, 1)[0]
+            rest=header[len(gene):]
+            for match in _TOKENS.finditer(rest):
+                token=match.group()
+                if token in scaffolds:
+                    #The coordinates follow the scaffold name.
+                    coordinates=_COORDINATES.search(rest, match.end())
+                    start, end=(int(coordinates.group(1)), int(coordinates.group(2))) if coordinates else (None, None)
+                    locations[gene]=(token, start, end)
+                    break
+    return locations
+
+
+def _sums(codes, weights, size):
+    "Sum of the weights of every code from 0 to size-1 (count of every code without weights), as list."
+    if numpy is not None:
+        return numpy.bincount(codes, weights=weights, minlength=size).tolist()
+    sums=[0]*size
+    if weights is None:
+        for code in codes:
+            sums[code]+=1
+        return sums
+    for code, weight in zip(codes, weights):
+        sums[code]+=weight
+    return sums
+
+
+def score_scaffolds(locations, bitscores, contaminants, scaffolds=None, min_hits=1, min_fraction=0.0,
+                    min_bitscore_fraction=0.0, keep_geneless=False):
+    """
+    Sums up the hits of the genes per scaffold and decides which scaffolds are
+    contamination.
+
+    Parameters
+    ----------
+    locations : dictionary
+        gene as key, (scaffold, start, end) as value, see gene_locations.
+    bitscores : dictionary
+        gene as key, bit score of its top hit as value, for genes with a hit.
+    contaminants : dictionary
+        gene as key, excluded clade of its top hit as value.
+    scaffolds : list, optional
+        all scaffolds of the genome, in the order of the table. Scaffolds
+        without genes are only scored if they are listed here.
+    min_hits : int
+        least number of contaminant genes of an excluded scaffold.
+    min_fraction : float
+        least fraction of contaminant genes among the genes with a hit.
+    min_bitscore_fraction : float
+        least share of the contaminant genes in the bit score of the scaffold.
+    keep_geneless : bool
+        keep scaffolds without any gene, by default they are excluded.
+
+    Returns
+    -------
+    scores : dictionary
+        columns of the table, one entry per scaffold: scaffold, genes, hits,
+        contaminant_hits, fraction, bitscore, contaminant_bitscore,
+        bitscore_fraction, clades (f.e. "Aves:2"), span (of the contaminant
+        genes, "start-end") and excluded.
+
+    """
+    names=list(scaffolds) if scaffolds is not None else []
+    row=dict((name, i) for i, name in enumerate(names))
+    for scaffold, start, end in locations.values():
+        if scaffold not in row:
+            row[scaffold]=len(names)
+            names.append(scaffold)
+    size=len(names)
+
+    #One entry per gene: row of its scaffold, hit, bit score and contaminant flag.
+    genes=list(locations)
+    codes=[row[scaffold] for scaffold, start, end in locations.values()]
+    hit=[gene in bitscores for gene in genes]
+    bitscore=[bitscores.get(gene, 0.0) for gene in genes]
+    contaminant=[gene in contaminants and gene in bitscores for gene in genes]
+    if numpy is not None:
+        codes=numpy.array(codes, dtype=numpy.int64)
+        hit=numpy.array(hit, dtype=numpy.float64)
+        bitscore=numpy.array(bitscore, dtype=numpy.float64)
+        contaminant=numpy.array(contaminant, dtype=numpy.float64)
+        contaminant_bitscore=bitscore*contaminant
+    else:
+        contaminant_bitscore=[score*flag for score, flag in zip(bitscore, contaminant)]
+    scores={"scaffold": names,
+            "genes": _sums(codes, None, size),
+            "hits": [int(count) for count in _sums(codes, hit, size)],
+            "contaminant_hits": [int(count) for count in _sums(codes, contaminant, size)],
+            "bitscore": _sums(codes, bitscore, size),
+            "contaminant_bitscore": _sums(codes, contaminant_bitscore, size)}
+
+    #Clades and span of the contaminant genes, only for the (few) scaffolds having them.
+    clades=dict()
+    span=dict()
+    for gene, clade in contaminants.items():
+        location=locations.get(gene)
+        if location is None or gene not in bitscores:
+            continue
+        scaffold, start, end=location
+        i=row[scaffold]
+        counts=clades.setdefault(i, dict())
+        counts[clade]=counts.get(clade, 0)+1
+        if start is not None:
+            low, high=min(start, end), max(start, end)
+            span[i]=(low, high) if i not in span else (min(span[i][0], low), max(span[i][1], high))
+    scores["clades"]=[""]*size
+    for i, counts in clades.items():
+        scores["clades"][i]=",".join("{}:{}".format(clade, count) for clade, count in sorted(counts.items()))
+    scores["span"]=[""]*size
+    for i, (low, high) in span.items():
+        scores["span"][i]="{}-{}".format(low, high)
+
+    scores["fraction"]=[contaminant_hits/hits if hits else 0.0
+                        for contaminant_hits, hits in zip(scores["contaminant_hits"], scores["hits"])]
+    scores["bitscore_fraction"]=[contaminant_total/total if total else 0.0
+                                 for contaminant_total, total in zip(scores["contaminant_bitscore"], scores["bitscore"])]
+    scores["excluded"]=[(contaminant_hits>=max(min_hits, 1) and fraction>=min_fraction
+                         and bitscore_fraction>=min_bitscore_fraction) or (gene_count==0 and not keep_geneless)
+                        for contaminant_hits, fraction, bitscore_fraction, gene_count
+                        in zip(scores["contaminant_hits"], scores["fraction"], scores["bitscore_fraction"], scores["genes"])]
+    return scores
+
+
+def write_table(scores, table_file):
+    """
+    Writes the scores and decision of every scaffold (see score_scaffolds) as
+    tab separated table.
+
+    Returns
+    -------
+    kept : list
+        scaffolds that are kept, in the order of the table.
+
+    """
+    kept=[]
+    with open(table_file, 'w') as table:
+        table.write("scaffold\tgenes\tgenes_with_hit\tcontaminant_genes\tcontaminant_fraction\tbitscore\t"
+                    "contaminant_bitscore\tcontaminant_bitscore_fraction\tclades\tcontaminant_span\tdecision\n")
+        for i, scaffold in enumerate(scores["scaffold"]):
+            excluded=scores["excluded"][i]
+            if not excluded:
+                kept.append(scaffold)
+            table.write("{}\t{}\t{}\t{}\t{:.3f}\t{:.1f}\t{:.1f}\t{:.3f}\t{}\t{}\t{}\n".format(
+                scaffold, scores["genes"][i], scores["hits"][i], scores["contaminant_hits"][i], scores["fraction"][i],
+                scores["bitscore"][i], scores["contaminant_bitscore"][i], scores["bitscore_fraction"][i],
+                scores["clades"][i], scores["span"][i], "exclude" if excluded else "keep"))
+    return kept
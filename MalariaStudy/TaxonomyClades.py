@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+date: 18.10.2026
+name: TaxonomyClades.py
+author: Mirjam Karlsson-Müller
+
+function: Clade membership of taxids, for filtering contaminants. The taxonomy
+(EBI taxonomy.dat, or NCBI nodes.dmp) is read once, and every taxid is labelled
+with the excluded clade it belongs to (f.e. Aves for the host bird, Homo
+sapiens, Bacteria), in a byte array indexed by taxid. Looking up the clade of
+a hit is then a single array read, whatever the number of clades.
+
+used as:
+from TaxonomyClades import TaxonomyClades
+clades=TaxonomyClades("taxonomy.dat", ["Aves", "9606", "Bacteria"])
+clades.clade_of(9031)    #"Aves"
+"""
+
+import mmap
+import os
+import re
+from array import array
+
+#Lines of taxonomy.dat needed: taxid, parent taxid and scientific name.
+_DAT_LINES=re.compile(rb"^(ID|PARENT ID|SCIENTIFIC NAME) *: *(.*?)\s*$", re.M)
+#Label of taxids not yet labelled.
+_UNKNOWN=255
+
+
+def read_taxonomy(tax_file):
+    """
+    Reads the parent of every taxid and the scientific names.
+
+    Parameters
+    ----------
+    tax_file : string
+        taxonomy.dat (EBI) or nodes.dmp (NCBI, names are then read from a
+        names.dmp next to it, if there is one).
+
+    Returns
+    -------
+    parent : array
+        parent taxid by taxid, 0 for taxids that do not exist.
+    names : dictionary
+        scientific name as key, taxid as value.
+
+    """
+    parents=dict()
+    names=dict()
+    with open(tax_file, 'rb') as taxonomy:
+        if os.path.getsize(tax_file)==0:
+            return array('I'), names
+        with mmap.mmap(taxonomy.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:200].count(b"\t|\t"):
+                #nodes.dmp: taxid | parent taxid | rank | ...
+                for line in iter(data.readline, b""):
+                    fields=line.split(b"\t|\t", 2)
+                    parents[int(fields[0])]=int(fields[1])
+            else:
+                taxid=None
+                for match in _DAT_LINES.finditer(data):
+                    key, value=match.group(1), match.group(2)
+                    if key==b"ID":
+                        taxid=int(value)
+                    elif key==b"PARENT ID":
+                        parents[taxid]=int(value)
+                    else:
+                        names[value.decode()]=taxid
+    names_file=os.path.join(os.path.dirname(tax_file), "names.dmp")
+    if not names and tax_file.endswith("nodes.dmp") and os.path.exists(names_file):
+        with open(names_file, 'r') as ncbi_names:
+            for line in ncbi_names:
+                fields=line.split("\t|\t")
+                if fields[3].startswith("scientific name"):
+                    names[fields[1]]=int(fields[0])
+    parent=array('I', bytes(4*(max(parents, default=0)+1)))
+    for taxid, parent_taxid in parents.items():
+        parent[taxid]=parent_taxid
+    return parent, names
+
+
+class TaxonomyClades:
+    """
+    Labels of excluded clades for all taxids of a taxonomy.
+
+    Parameters
+    ----------
+    tax_file : string
+        taxonomy.dat or nodes.dmp, see read_taxonomy.
+    clades : list
+        clades given as scientific names or taxids. A taxid below several of
+        them gets the lowest one (f.e. Homo sapiens before Mammalia).
+
+    """
+
+    def __init__(self, tax_file, clades):
+        if len(clades)>=_UNKNOWN:
+            raise ValueError("At most {} clades can be excluded.".format(_UNKNOWN-1))
+        self.parent, names=read_taxonomy(tax_file)
+        self.clades=[]
+        self.taxids=[]
+        for clade in clades:
+            #Only ASCII digits are a taxid, int() would also take f.e. "١٢" or fail on "²".
+            is_taxid=str(clade).isascii() and str(clade).isdigit()
+            taxid=int(clade) if is_taxid else names.get(clade)
+            if taxid is None or taxid>=len(self.parent) or (self.parent[taxid]==0 and taxid!=1):
+                raise ValueError("Clade {} is not in {}.".format(clade, tax_file))
+            #Clades given as taxid are reported with their name.
+            self.clades.append(next((name for name, named in names.items() if named==taxid), str(clade))
+                               if is_taxid else clade)
+            self.taxids.append(taxid)
+        self._label()
+
+    def _label(self):
+        "Labels every taxid with the index of its clade (+1), 0 outside all clades."
+        parent=self.parent
+        label=bytearray([_UNKNOWN])*len(parent)
+        label[0]=0
+        #The lowest clade wins: deeper clades are set first and never overwritten.
+        for i, taxid in sorted(enumerate(self.taxids), key=lambda clade: -self._depth(clade[1])):
+            if label[taxid]==_UNKNOWN:
+                label[taxid]=i+1
+        for taxid in range(1, len(parent)):
+            if label[taxid]!=_UNKNOWN:
+                continue
+            #Walk up to the first labelled ancestor, then label the whole path.
+            path=[]
+            node=taxid
+            while label[node]==_UNKNOWN:
+                path.append(node)
+                up=parent[node]
+                if up==node or up==0:
+                    label[node]=0
+                    path.pop()
+                    break
+                node=up
+            value=label[node]
+            for node in path:
+                label[node]=value
+        self._labels=label
+
+    def _depth(self, taxid):
+        depth=0
+        while self.parent[taxid] not in (taxid, 0):
+            taxid=self.parent[taxid]
+            depth+=1
+        return depth
+
+    def clade_of(self, taxid):
+        "Name of the excluded clade taxid belongs to, None if it is in none (or unknown)."
+        if taxid is None or not 0<taxid<len(self._labels):
+            return None
+        value=self._labels[taxid]
+        return self.clades[value-1] if value else None
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+date: 18.10.2026
+name: UniprotIndex.py
+author: Mirjam Karlsson-Müller
+
+function: Accession index of a UniProt flat file (uniprot_sprot.dat). Every
+accession number of an entry, primary and secondary (all AC lines), is mapped
+to the byte offset of the entry. The index is built once and saved next to the
+flat file as a sorted table (uniprot_sprot.dat.acidx), so later runs look up
+their accessions by binary search in the memory-mapped table, seek to the
+entries and only parse those, instead of reading the whole file.
+
+used as:
+from UniprotIndex import UniprotIndex
+uniprot=UniprotIndex("uniprot_sprot.dat")
+uniprot.entry("P69905")["OX"]
+
+or, to build the index ahead of time:
+python UniprotIndex.py uniprot_sprot.dat
+"""
+
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+
+MAGIC=b"UPACIDX\0"
+#Accessions are 6 or 10 characters long, padded to a fixed width in the table.
+_WIDTH=10
+_RECORD=struct.Struct("<{}sQ".format(_WIDTH))
+#Lines of interest of an entry: start of the entry and accession lines.
+_LINES=re.compile(rb"^(ID|AC)   (.*)$", re.M)
+
+
+def _fingerprint(path):
+    "Size and modification time of the flat file the index was built from."
+    stat=os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def build_index(dat_file, index_file):
+    """
+    Maps every accession number of a UniProt flat file to the offset of its
+    entry and writes the sorted table to index_file.
+
+    Returns
+    -------
+    count: int
+        number of accessions indexed.
+
+    """
+    pairs=[]
+    with open(dat_file, 'rb') as dat:
+        if os.path.getsize(dat_file):
+            with mmap.mmap(dat.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                entry=0
+                for line in _LINES.finditer(data):
+                    if line.group(1)==b"ID":
+                        entry=line.start()
+                    else:
+                        for accession in line.group(2).split(b";"):
+                            accession=accession.strip()
+                            if accession:
+                                pairs.append((accession, entry))
+    pairs.sort()
+    header=json.dumps({"source": _fingerprint(dat_file), "count": len(pairs)}).encode()
+    with open(index_file+".tmp", 'wb') as out:
+        out.write(MAGIC+struct.pack("<I", len(header))+header)
+        out.writelines(_RECORD.pack(accession, offset) for accession, offset in pairs)
+    os.replace(index_file+".tmp", index_file)
+    return len(pairs)
+
+
+def parse_entry(text):
+    """
+    Parses the lines of a UniProt entry the scripts need.
+
+    Returns
+    -------
+    entry : dictionary
+        AC: list of accessions, OS: species name, OC: lineage as list of
+        names, OX: NCBI taxid (int, None if missing).
+
+    """
+    entry={"AC": [], "OS": "", "OC": [], "OX": None}
+    species=[]
+    for line in text.split("\n"):
+        code=line[:2]
+        value=line[5:]
+        if code=="AC":
+            entry["AC"].extend(accession.strip() for accession in value.split(";") if accession.strip())
+        elif code=="OS":
+            species.append(value.strip())
+        elif code=="OC":
+            entry["OC"].extend(name.strip(" .") for name in value.split(";") if name.strip(" ."))
+        elif code=="OX" and entry["OX"] is None:
+            match=re.search(r"NCBI_TaxID=(\d+)", value)
+            if match:
+                entry["OX"]=int(match.group(1))
+        elif code=="//":
+            break
+    entry["OS"]=" ".join(species)
+    return entry
+
+
+class UniprotIndex:
+    """
+    Lookups of UniProt entries by accession number over the index of the
+    flat file, which is built (or rebuilt, if the flat file changed) on first
+    use.
+
+    Parameters
+    ----------
+    dat_file : string
+        UniProt flat file, f.e. uniprot_sprot.dat.
+    index_file : string, optional
+        index of the flat file. Default: dat_file.acidx
+
+    """
+
+    def __init__(self, dat_file, index_file=None):
+        self.dat_file=dat_file
+        self.index_file=index_file or dat_file+".acidx"
+        if not self._current():
+            build_index(dat_file, self.index_file)
+        self._index_handle=open(self.index_file, 'rb')
+        self._index=mmap.mmap(self._index_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        size=struct.unpack("<I", self._index[8:12])[0]
+        self._start=12+size
+        self.count=(len(self._index)-self._start)//_RECORD.size
+        self._dat=open(dat_file, 'rb')
+
+    def _current(self):
+        "Whether the index exists and was built from the flat file as it is now."
+        try:
+            with open(self.index_file, 'rb') as index:
+                if index.read(8)!=MAGIC:
+                    return False
+                size=struct.unpack("<I", index.read(4))[0]
+                header=json.loads(index.read(size))
+        except (OSError, ValueError, struct.error):
+            return False
+        return header.get("source")==_fingerprint(self.dat_file)
+
+    def close(self):
+        self._index.close()
+        self._index_handle.close()
+        self._dat.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _key(self, i):
+        start=self._start+i*_RECORD.size
+        return self._index[start:start+_WIDTH]
+
+    def offset(self, accession):
+        """
+        Byte offset of the entry of an accession (primary or secondary), None
+        if it is not in the flat file. A version suffix (P69905.2) is ignored.
+        """
+        key=accession.split(".")[0].encode().ljust(_WIDTH, b"\0")
+        low, high=0, self.count
+        while low<high:
+            middle=(low+high)//2
+            if self._key(middle)<key:
+                low=middle+1
+            else:
+                high=middle
+        if low<self.count and self._key(low)==key:
+            return _RECORD.unpack_from(self._index, self._start+low*_RECORD.size)[1]
+        return None
+
+    def entry(self, accession):
+        "Parsed entry of an accession (see parse_entry), None if it is not found."
+        offset=self.offset(accession)
+        if offset is None:
+            return None
+        self._dat.seek(offset)
+        lines=[]
+        for line in self._dat:
+            lines.append(line)
+            if line.startswith(b"//"):
+                break
+        return parse_entry(b"".join(lines).decode())
+
+
+if __name__=='__main__':
+    count=build_index(sys.argv[1], sys.argv[1]+".acidx")
+    print("{} accessions indexed in {}.acidx".format(count, sys.argv[1]))
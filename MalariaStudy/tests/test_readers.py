@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Equivalence tests of the readers of the pipeline: FastaReader against a plain
+parse of the same fasta (plain, gzip and bgzip compressed), UniprotIndex
+lookups by primary and secondary accession, and tabular BLAST output.
+"""
+
+import gzip
+import os
+import struct
+import zlib
+
+import pytest
+
+from BlastReader import read_tabular
+from FastaReader import FastaReader
+from UniprotIndex import UniprotIndex
+
+#End of file marker of bgzip, an empty block.
+BGZF_EOF=bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def write_bgzip(data, path, block_size=64):
+    """
+    Writes data as bgzip file, in blocks of block_size uncompressed bytes
+    (small, so that records span several blocks).
+    """
+    with open(path, 'wb') as out:
+        for start in range(0, len(data), block_size):
+            chunk=data[start:start+block_size]
+            compressor=zlib.compressobj(6, zlib.DEFLATED, -15)
+            deflated=compressor.compress(chunk)+compressor.flush()
+            out.write(b"\x1f\x8b\x08\x04\0\0\0\0\0\xff"+struct.pack("<H", 6)+b"BC"
+                      +struct.pack("<HH", 2, 18+len(deflated)+8-1)+deflated
+                      +struct.pack("<II", zlib.crc32(chunk), len(chunk)))
+        out.write(BGZF_EOF)
+
+
+#Records on one line, wrapped, with a last short line and empty.
+FASTA=(b">scaffold1 first scaffold\nACGTACGTAC\nGTACGTACGT\nACG\n"
+       b">scaffold2\nTTTTGGGGCC\n"
+       b">scaffold3 len=25\nNNNNNacgtn\nACGTACGTAC\nGGGGG\n"
+       b">scaffold4\n"
+       b">scaffold5 last\nCCCCCCCCCC\nAAAAAAAAAA\nTTTTTTTTTT\nGGGGGGGGGG\nC\n")
+
+
+def plain_parse(data):
+    "Name, header and sequence of every record, parsed the simple way."
+    records=[]
+    for chunk in data.split(b">")[1:]:
+        lines=chunk.split(b"\n")
+        header=lines[0].decode()
+        records.append((header.split()[0], header, b"".join(lines[1:])))
+    return records
+
+
+@pytest.fixture(params=["plain", "gzip", "bgzip"])
+def fasta(request, tmp_path):
+    "Path of FASTA, plain or compressed."
+    path=str(tmp_path/"genome.fa")
+    if request.param=="gzip":
+        path+=".gz"
+        with gzip.open(path, 'wb') as out:
+            out.write(FASTA)
+    elif request.param=="bgzip":
+        path+=".gz"
+        write_bgzip(FASTA, path)
+    else:
+        with open(path, 'wb') as out:
+            out.write(FASTA)
+    return path
+
+
+def test_fasta_equals_plain_parse(fasta, tmp_path):
+    "Iteration, sequences, fetch and copy give the records of a plain parse."
+    records=plain_parse(FASTA)
+    with FastaReader(fasta) as reader:
+        assert reader.names()==[name for name, header, sequence in records]
+        assert list(reader)==[(name, sequence) for name, header, sequence in records]
+        assert reader.sequences(["scaffold3", "scaffold5", "missing"])=={"scaffold3": records[2][2],
+                                                                          "scaffold5": records[4][2]}
+        if reader.indexed:
+            for name, header, sequence in records:
+                assert reader.fetch(name)==sequence
+        else:
+            with pytest.raises(ValueError):
+                reader.fetch("scaffold1")
+        with open(str(tmp_path/"copy.fa"), 'wb') as output:
+            assert reader.copy(["scaffold5", "scaffold1", "scaffold4"], output)==3
+    kept=[chunk for chunk in FASTA.split(b">")[1:] if chunk.split()[0] in (b"scaffold1", b"scaffold4", b"scaffold5")]
+    assert (tmp_path/"copy.fa").read_bytes()==b"".join(b">"+chunk for chunk in kept)
+    #Reading a file does not write an index next to it.
+    assert not os.path.exists(fasta+".fai")
+
+
+def test_saved_index_is_reused(fasta):
+    "A saved .fai (and .gzi) is read by the next reader and gives the same sequences."
+    with FastaReader(fasta, save_index=True) as reader:
+        indexed=reader.indexed
+        expected=dict(reader)
+    assert os.path.exists(fasta+".fai")==indexed
+    with FastaReader(fasta) as reader:
+        assert reader.sequences(expected)==expected
+
+
+def test_irregular_fasta_is_streamed(tmp_path):
+    "Lines of different lengths have no index, but are still read correctly."
+    data=b">a\nACG\nACGTA\nA\n>b\nTT\n"
+    path=str(tmp_path/"irregular.fa")
+    with open(path, 'wb') as out:
+        out.write(data)
+    with FastaReader(path, save_index=True) as reader:
+        assert not reader.indexed
+        assert reader.sequences(["a", "b"])=={"a": b"ACGACGTAA", "b": b"TT"}
+        with pytest.raises(ValueError):
+            reader.fetch("a")
+    assert not os.path.exists(path+".fai")
+
+
+UNIPROT=b"""ID   HBA_HUMAN               Reviewed;         142 AA.
+AC   P69905; P01922; Q1HDT5;
+AC   Q9UCM0;
+OS   Homo sapiens (Human).
+OC   Eukaryota; Metazoa; Chordata; Mammalia; Primates; Hominidae; Homo.
+OX   NCBI_TaxID=9606;
+SQ   SEQUENCE   142 AA;  15258 MW;  15E13666573BBBAE CRC64;
+     MVLSPADKTN VKAAWGKVGA
+//
+ID   HBA_CHICK               Reviewed;         142 AA.
+AC   P01994;
+OS   Gallus gallus (Chicken).
+OC   Eukaryota; Metazoa; Chordata; Aves; Galliformes; Phasianidae; Gallus.
+OX   NCBI_TaxID=9031 {ECO:0000312|EMBL:CAA23748.1};
+//
+ID   LONG_ACCESSION          Reviewed;          10 AA.
+AC   A0A023GPI8; B1;
+OS   Lotus japonicus.
+OX   NCBI_TaxID=34305;
+//
+"""
+
+
+def test_uniprot_lookups(tmp_path):
+    "Primary and secondary accessions (also of a second AC line) find their entry."
+    dat_file=str(tmp_path/"uniprot_sprot.dat")
+    with open(dat_file, 'wb') as dat:
+        dat.write(UNIPROT)
+    with UniprotIndex(dat_file) as uniprot:
+        for accession in ("P69905", "P01922", "Q1HDT5", "Q9UCM0", "P69905.2"):
+            entry=uniprot.entry(accession)
+            assert entry["AC"]==["P69905", "P01922", "Q1HDT5", "Q9UCM0"]
+            assert entry["OX"]==9606
+            assert entry["OS"]=="Homo sapiens (Human)."
+        assert uniprot.entry("P01994")["OX"]==9031
+        assert uniprot.entry("P01994")["OC"][-1]=="Gallus"
+        assert uniprot.entry("A0A023GPI8")["OX"]==34305
+        assert uniprot.entry("B1")["AC"]==["A0A023GPI8", "B1"]
+        assert uniprot.entry("P12345") is None
+    assert os.path.exists(dat_file+".acidx")
+    #A changed flat file is indexed again.
+    with open(dat_file, 'ab') as dat:
+        dat.write(b"ID   NEW_ENTRY  Reviewed;  1 AA.\nAC   P99999;\nOX   NCBI_TaxID=1;\n//\n")
+    with UniprotIndex(dat_file) as uniprot:
+        assert uniprot.entry("P99999")["OX"]==1
+        assert uniprot.entry("Q9UCM0")["OX"]==9606
+
+
+def test_tabular_fields(tmp_path):
+    "outfmt 7 columns are found over the # Fields line, a missing one is named."
+    path=str(tmp_path/"blast.tsv")
+    with open(path, 'w') as blast:
+        blast.write("# BLASTP 2.12.0+\n# Fields: query acc.ver, evalue, bit score, subject acc.ver\n"
+                    "g1\t1e-50\t200\tsp|P01994.1|HBA_CHICK\n")
+    hits=list(read_tabular(path))
+    assert [(hit.query, hit.accession, hit.evalue, hit.bitscore) for hit in hits]==[("g1", "P01994", 1e-50, 200.0)]
+    with open(path, 'w') as blast:
+        blast.write("# Fields: query acc.ver, subject acc.ver, evalue\ng1\tsp|P01994.1|HBA_CHICK\t1e-50\n")
+    with pytest.raises(ValueError, match="bit score"):
+        list(read_tabular(path))
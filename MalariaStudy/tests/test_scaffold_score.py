@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the scaffold scores: genes are placed on their scaffold from the
+gffParse headers, and the sums per scaffold are the same with and without
+numpy.
+"""
+
+import pytest
+
+import ScaffoldScore
+from ScaffoldScore import gene_locations, score_scaffolds, write_table
+
+
+def test_gene_locations(tmp_path):
+    "The scaffold is a whole word of the header, its coordinates follow it."
+    path=str(tmp_path/"gffParse.faa")
+    with open(path, 'w') as fasta:
+        fasta.write(">1_g  gene=1_g  scaffold01477:21-1216\nMA\n"
+                    #s1 is also part of an earlier word, with numbers that are not the coordinates.
+                    ">2_g id=s1.1-2 s1 30..40\nMA\n"
+                    ">3_g s2\nMA\n"
+                    ">4_g unknown:1-5\nMA\n")
+    assert gene_locations(path, {"scaffold01477", "s1", "s2"})=={"1_g": ("scaffold01477", 21, 1216),
+                                                                 "2_g": ("s1", 30, 40),
+                                                                 "3_g": ("s2", None, None)}
+
+
+@pytest.mark.parametrize("with_numpy", [True, False])
+def test_score_scaffolds(tmp_path, monkeypatch, with_numpy):
+    "Counts, fractions and decisions per scaffold, with and without numpy."
+    if not with_numpy:
+        monkeypatch.setattr(ScaffoldScore, "numpy", None)
+    elif ScaffoldScore.numpy is None:
+        pytest.skip("numpy is not installed")
+    locations={"a1": ("a", 10, 20), "a2": ("a", 50, 30), "a3": ("a", 100, 200),
+               "b1": ("b", 1, 5), "b2": ("b", 9, 12), "c1": ("c", 1, 2)}
+    bitscores={"a1": 100.0, "a2": 50.0, "a3": 50.0, "b1": 10.0, "b2": 90.0}
+    contaminants={"a1": "Aves", "a2": "Aves", "b1": "Aves", "c1": "Aves"}
+    scores=score_scaffolds(locations, bitscores, contaminants, ["a", "b", "c", "d"], min_hits=2, min_fraction=0.5)
+    assert scores["scaffold"]==["a", "b", "c", "d"]
+    assert scores["genes"]==[3, 2, 1, 0]
+    assert scores["hits"]==[3, 2, 0, 0]
+    #c1 has no hit, it does not count as contaminant.
+    assert scores["contaminant_hits"]==[2, 1, 0, 0]
+    assert scores["bitscore"]==[200.0, 100.0, 0.0, 0.0]
+    assert scores["contaminant_bitscore"]==[150.0, 10.0, 0.0, 0.0]
+    assert scores["clades"]==["Aves:2", "Aves:1", "", ""]
+    assert scores["span"]==["10-50", "1-5", "", ""]
+    assert scores["fraction"][:2]==[2/3, 0.5]
+    #b has too few contaminant genes, d no genes at all.
+    assert scores["excluded"]==[True, False, False, True]
+    assert write_table(scores, str(tmp_path/"scores.tsv"))==["b", "c"]
+    kept=score_scaffolds(locations, bitscores, contaminants, ["a", "b", "c", "d"], min_hits=2, keep_geneless=True)
+    assert kept["excluded"]==[True, False, False, False]
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Title: Taxa_Benchmark.py
+Date: 2026-10-18
+Author: Mirjam Karlsson-Müller
+
+Description: Benchmarks Taxa_Finder on a synthetic taxonomy, so its speed can
+be measured without downloading the ncbi taxdump, and compared between
+versions. Writes names.dmp, nodes.dmp, merged.dmp and delnodes.dmp of a
+configurable size, depth and fan-out, times index build, cold start, single
+and batch lookups, last common nodes and the webinterface, and reports the
+results as json.
+
+
+List of functions:
+    generate_taxdump: Writes a synthetic taxdump of a given size and shape.
+    timed: Runs a function repeatedly and summarizes its run times.
+    bench_build: Times building (and updating) the index.
+    bench_cold_start: Times loading the index in a fresh python process.
+    bench_lookups: Times single lookups and batch (streamed) lookups.
+    bench_lca: Times last common nodes of pairs and of a matrix.
+    bench_web: Times requests to the webinterface (needs Flask).
+    compare: Compares results against an earlier run.
+    main: Command line entry point.
+
+Procedure:
+    1. A random tree is grown from the root: every new taxon is attached to a
+    random node that still has fewer than --fanout children and lies above
+    --depth. Each taxon gets a made-up scientific name, some also a common
+    name or synonym. A few taxids are listed as merged or deleted.
+    2. Every benchmark is run --repeat times (lookups on --queries random
+    names), the median, minimum and 95th percentile are reported in seconds,
+    with the rate per second where it applies.
+    3. The results, together with the parameters, python version and git
+    revision, are written as json. With --compare, every timing is set against
+    the same timing of an earlier json file, and the script exits with 1 if one
+    of them got slower by more than --tolerance.
+
+
+Usage:
+    python Taxa_Benchmark.py [--size SIZE] [--depth DEPTH] [--fanout FANOUT]
+                             [--queries QUERIES] [--repeat REPEAT] [--workers WORKERS]
+                             [--dir DIR] [-o OUT] [--compare OLD] [--tolerance TOLERANCE]
+
+    f.e. before and after a change:
+
+    python Taxa_Benchmark.py --size 500000 -o before.json
+    python Taxa_Benchmark.py --size 500000 -o after.json --compare before.json
+
+Possible Bugs:
+    1. The timings depend on the machine and its load, compare runs done on the
+       same machine only.
+    2. The cold start reads the index through the page cache, right after it was
+       written, as cold as a second run of Taxa_Finder.py, not as a first run
+       after a reboot.
+    3. The web benchmark uses the Flask test client, so it measures the app
+       without network and server overhead, and is skipped without Flask.
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from Taxa_Finder import TaxonomyDB
+from Taxa_Index import build_index, update_index
+
+#Ranks given to the synthetic taxa, from the top of the tree down.
+RANKS=["superkingdom", "kingdom", "phylum", "class", "order", "family", "genus", "species"]
+#Syllables the made-up names are built from.
+SYLLABLES=["ba", "ci", "do", "fa", "ge", "hi", "lo", "ma", "ne", "pi", "ra", "si", "tu", "vo", "xa", "ze",
+           "cor", "dra", "phy", "lus", "tor", "mis", "gan", "sep"]
+
+
+def _name(rng):
+    "A made-up latin looking name."
+    return "".join(rng.choice(SYLLABLES) for i in range(rng.randint(2, 4))).capitalize()
+
+
+def generate_taxdump(directory, size=100000, depth=30, fanout=6, seed=1):
+    """
+    Writes a synthetic names.dmp, nodes.dmp, merged.dmp and delnodes.dmp in the
+    format of the ncbi taxdump.
+
+    Parameters
+    ----------
+    directory : string
+        where the dump files are written, created if missing.
+    size : int
+        number of taxa, including the root.
+    depth : int
+        largest depth of a taxon below the root.
+    fanout : int
+        largest number of children of a taxon.
+    seed : int
+        seed of the random generator, the same seed writes the same files.
+
+    Returns
+    -------
+    names: list
+        scientific names of the taxa (without the root), as queries.
+
+    """
+    if size<2 or depth<1 or fanout<1:
+        raise ValueError("size must be at least 2, depth and fanout at least 1.")
+    if fanout>1 and (fanout**(depth+1)-1)//(fanout-1)<size or fanout==1 and depth+1<size:
+        raise ValueError("A tree of depth {} and fan-out {} can not hold {} taxa.".format(depth, fanout, size))
+    rng=random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    #Nodes that can still take children, as [taxid, depth, children].
+    open_nodes=[[1, 0, 0]]
+    scientific=[]
+    taxid=1
+    with open(os.path.join(directory, "nodes.dmp"), 'w') as nodes, open(os.path.join(directory, "names.dmp"), 'w') as names:
+        nodes.write("1\t|\t1\t|\tno rank\t|\t\t|\t8\t|\t0\t|\t1\t|\t0\t|\t0\t|\t0\t|\t0\t|\t0\t|\t\t|\n")
+        names.write("1\t|\troot\t|\t\t|\tscientific name\t|\n")
+        for i in range(size-1):
+            #Sparse taxids, as in the real taxonomy.
+            taxid+=rng.randint(1, 3)
+            slot=rng.randrange(len(open_nodes))
+            parent=open_nodes[slot]
+            parent[2]+=1
+            if parent[2]==fanout:
+                open_nodes[slot]=open_nodes[-1]
+                open_nodes.pop()
+            level=parent[1]+1
+            if level<depth:
+                open_nodes.append([taxid, level, 0])
+            rank=RANKS[min(level*len(RANKS)//depth, len(RANKS)-1)] if rng.random()<0.7 else "no rank"
+            hidden=1 if rank=="no rank" and rng.random()<0.5 else 0
+            nodes.write("{}\t|\t{}\t|\t{}\t|\t\t|\t0\t|\t1\t|\t11\t|\t1\t|\t1\t|\t1\t|\t{}\t|\t0\t|\t\t|\n".format(
+                taxid, parent[0], rank, hidden))
+            name="{} {}".format(_name(rng), _name(rng).lower())
+            #Made-up names can repeat, the unique name tells them apart like in names.dmp.
+            names.write("{}\t|\t{}\t|\t{}\t|\tscientific name\t|\n".format(taxid, name, "{} <{}>".format(name, taxid)))
+            scientific.append(name)
+            if rng.random()<0.1:
+                names.write("{}\t|\t{}\t|\t\t|\tcommon name\t|\n".format(taxid, _name(rng)))
+            if rng.random()<0.2:
+                names.write("{}\t|\t{} {}\t|\t\t|\tsynonym\t|\n".format(taxid, _name(rng), _name(rng).lower()))
+    with open(os.path.join(directory, "merged.dmp"), 'w') as merged:
+        merged.write("{}\t|\t{}\t|\n".format(taxid+1, taxid))
+    with open(os.path.join(directory, "delnodes.dmp"), 'w') as delnodes:
+        delnodes.write("{}\t|\n".format(taxid+2))
+    return scientific
+
+
+def timed(function, repeat=5, operations=1):
+    """
+    Runs function repeat times and summarizes the run times.
+
+    Parameters
+    ----------
+    function : callable
+        run without arguments.
+    repeat : int
+        number of runs.
+    operations : int
+        number of operations (f.e. lookups) done by one run, for the rate.
+
+    Returns
+    -------
+    result: dictionary
+        median, min and p95 run time in seconds, the number of operations per
+        run, and the operations per second at the median.
+
+    """
+    times=[]
+    for i in range(repeat):
+        start=time.perf_counter()
+        function()
+        times.append(time.perf_counter()-start)
+    return _summary(times, operations)
+
+
+def _summary(times, operations=1):
+    "Median, min and p95 of run times, see timed."
+    times=sorted(times)
+    median=statistics.median(times)
+    return {"median": median, "min": times[0], "p95": times[min(len(times)-1, int(0.95*len(times)))],
+            "operations": operations, "per_second": operations/median if median else None}
+
+
+def bench_build(directory, workers=None, repeat=3):
+    "Times a full build of the index, and an update of the index with unchanged dump files."
+    paths=[os.path.join(directory, name) for name in ("names.dmp", "nodes.dmp", "taxonomy.idx", "merged.dmp", "delnodes.dmp")]
+    names, nodes, index, merged, delnodes=paths
+    results=dict()
+    results["build"]=timed(lambda: build_index(names, nodes, index, workers, merged, delnodes), repeat)
+    results["update"]=timed(lambda: update_index(index, names, nodes, merged, delnodes, workers), repeat)
+    results["index_bytes"]=os.path.getsize(index)
+    return results
+
+
+def bench_cold_start(directory, query, repeat=5):
+    """
+    Times a fresh python process that loads the index and looks up one query,
+    the start of the interpreter itself is timed separately and left out.
+
+    """
+    here=os.path.dirname(os.path.abspath(__file__))
+    script=("import time; start=time.perf_counter(); from Taxa_Index import load_index; "
+            "index=load_index({!r}); index.cache.lineage(index.find({!r})); print(time.perf_counter()-start)"
+            ).format(os.path.join(directory, "taxonomy.idx"), query)
+    times=[]
+    for i in range(repeat):
+        start=time.perf_counter()
+        inner=float(subprocess.run([sys.executable, "-c", script], cwd=here, check=True,
+                                   stdout=subprocess.PIPE, universal_newlines=True).stdout)
+        times.append((time.perf_counter()-start, inner))
+    return {"process": _summary([t for t, inner in times]),
+            "load_and_lookup": _summary([inner for t, inner in times])}
+
+
+def bench_lookups(db, queries, repeat=5):
+    "Times find_lineage one query at a time, and stream_lineages on the whole batch."
+    results=dict()
+
+    def single():
+        db.index.cache.clear()
+        for query in queries:
+            db.find_lineage(query)
+
+    def batch():
+        db.index.cache.clear()
+        with open(os.devnull, 'w') as devnull:
+            db.stream_lineages(queries, "-", False, "tsv", 10000, stdout=devnull, log=devnull)
+
+    results["single"]=timed(single, repeat, len(queries))
+    results["batch"]=timed(batch, repeat, len(queries))
+    return results
+
+
+def bench_lca(db, taxids, repeat=5):
+    "Times the last common node of pairs of taxids, and a matrix of up to 1000 taxids."
+    index=db.index
+    pairs=list(zip(taxids, reversed(taxids)))
+    matrix=taxids[:1000]
+    results=dict()
+    results["pairs"]=timed(lambda: [index.lca(a, b) for a, b in pairs], repeat, len(pairs))
+    results["matrix"]=timed(lambda: [row for row in index.lca_matrix(matrix)], repeat, len(matrix)**2)
+    return results
+
+
+def bench_web(directory, queries, repeat=5):
+    """
+    Times the webinterface over the Flask test client: the form on /, and a
+    batch posted to /api/lineage. Returns None if Flask is not installed.
+
+    """
+    try:
+        import flask
+    except ImportError:
+        return None
+    cwd=os.getcwd()
+    #The app loads taxonomy.idx and the dump files of its working directory.
+    os.chdir(directory)
+    try:
+        import Taxa_Finder_web
+        client=Taxa_Finder_web.app.test_client()
+        sample=queries[:100]
+        results=dict()
+        form=lambda query: client.post("/", data={"query": query})
+        results["form"]=timed(lambda: [form(query) for query in sample], repeat, len(sample))
+        batch={"queries": queries[:Taxa_Finder_web.MAX_QUERIES], "common": True}
+        results["api_batch"]=timed(lambda: client.post("/api/lineage", json=batch), repeat,
+                                   len(batch["queries"]))
+        return results
+    finally:
+        os.chdir(cwd)
+
+
+def _flatten(results, prefix=""):
+    "Yields (path, median) of all timings of a nested result dictionary."
+    for key, value in results.items():
+        if isinstance(value, dict):
+            if "median" in value:
+                yield prefix+key, value["median"]
+            else:
+                yield from _flatten(value, prefix+key+".")
+
+
+def compare(results, old, tolerance=0.2, log=None):
+    """
+    Sets the timings of results against those of an earlier run.
+
+    Parameters
+    ----------
+    results, old : dictionary
+        benchmark results, as written by main.
+    tolerance : float
+        accepted slowdown, 0.2 is 20 % slower.
+    log : file, optional
+        where the comparison is written to, stderr by default.
+
+    Returns
+    -------
+    regressions: list
+        names of the timings that got slower than the tolerance.
+
+    """
+    log=log or sys.stderr
+    before=dict(_flatten(old["results"]))
+    regressions=[]
+    for key, median in _flatten(results["results"]):
+        if key not in before:
+            continue
+        ratio=median/before[key] if before[key] else float("inf")
+        flag=""
+        if ratio>1+tolerance:
+            regressions.append(key)
+            flag="  <- slower"
+        log.write("{:<24} {:>10.4f} s {:>10.4f} s {:>7.2f}x{}\n".format(key, before[key], median, ratio, flag))
+    return regressions
+
+
+def _revision():
+    "Git revision of the working tree, None outside of git."
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    "Command line entry point."
+    parser=argparse.ArgumentParser(prog="Taxa_Benchmark",
+                                   description="Benchmarks Taxa_Finder on a synthetic taxonomy, results as json.")
+    parser.add_argument('--size', type=int, default=100000, help='Number of taxa. Default: 100000')
+    parser.add_argument('--depth', type=int, default=30, help='Largest depth of the tree. Default: 30')
+    parser.add_argument('--fanout', type=int, default=6, help='Largest number of children per taxon. Default: 6')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the generated taxonomy. Default: 1')
+    parser.add_argument('--queries', type=int, default=10000, help='Number of queries of the lookup benchmarks. Default: 10000')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per benchmark. Default: 5')
+    parser.add_argument('--workers', type=int, default=None, help='Processes building the index. Default: number of CPUs')
+    parser.add_argument('--dir', default=None, help='Directory of the synthetic taxdump, kept after the run. Default: temporary directory')
+    parser.add_argument('--out', '-o', default="-", help='Json results file ("-" for stdout). Default: -')
+    parser.add_argument('--compare', default=None, help='Json results of an earlier run to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Accepted slowdown against --compare. Default: 0.2 (20 %%)')
+    args=parser.parse_args(argv)
+
+    temporary=None
+    directory=args.dir
+    if directory is None:
+        temporary=tempfile.TemporaryDirectory(prefix="taxa_benchmark")
+        directory=temporary.name
+    directory=os.path.abspath(directory)
+
+    sys.stderr.write("Generating {} taxa in {}\n".format(args.size, directory))
+    start=time.perf_counter()
+    try:
+        scientific=generate_taxdump(directory, args.size, args.depth, args.fanout, args.seed)
+    except ValueError as error:
+        parser.error(str(error))
+    generated=time.perf_counter()-start
+    rng=random.Random(args.seed)
+    queries=[rng.choice(scientific) for i in range(args.queries)]
+
+    results=dict()
+    sys.stderr.write("Index build\n")
+    results["index"]=bench_build(directory, args.workers, min(args.repeat, 3))
+    sys.stderr.write("Cold start\n")
+    results["cold_start"]=bench_cold_start(directory, queries[0], args.repeat)
+    db=TaxonomyDB(*(os.path.join(directory, name) for name in ("taxonomy.idx", "names.dmp", "nodes.dmp", "merged.dmp", "delnodes.dmp")))
+    sys.stderr.write("Lookups\n")
+    results["lookup"]=bench_lookups(db, queries, args.repeat)
+    sys.stderr.write("Last common nodes\n")
+    results["lca"]=bench_lca(db, [db.resolve(query) for query in queries], args.repeat)
+    sys.stderr.write("Webinterface\n")
+    results["web"]=bench_web(directory, queries, args.repeat)
+    if results["web"] is None:
+        sys.stderr.write("Flask is not installed, the webinterface is not benchmarked.\n")
+
+    report={"revision": _revision(), "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "generate_seconds": generated,
+            "parameters": {key: getattr(args, key) for key in ("size", "depth", "fanout", "seed", "queries", "repeat", "workers")},
+            "results": results}
+    text=json.dumps(report, indent=2)+"\n"
+    if args.out=="-":
+        sys.stdout.write(text)
+    else:
+        with open(args.out, 'w') as out:
+            out.write(text)
+    if temporary is not None:
+        temporary.cleanup()
+
+    if args.compare:
+        with open(args.compare, 'r') as old_file:
+            old=json.load(old_file)
+        if old.get("parameters")!=report["parameters"]:
+            sys.stderr.write("Warning: the runs were made with different parameters.\n")
+        regressions=compare(report, old, args.tolerance)
+        if regressions:
+            sys.stderr.write("Slower than {}: {}\n".format(args.compare, ", ".join(regressions)))
+            sys.exit(1)
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Title: Taxa_Client.py
+Date: 2026-10-18
+Author: Mirjam Karlsson-Müller
+
+Description: Thin client of the Taxa_Finder daemon. Takes the same options as
+Taxa_Finder.py and forwards the command line to the daemon, which keeps the
+taxonomy loaded, so a call only costs the start of a small python script and
+a round trip over a Unix socket. Without a running daemon, the command line is
+run locally by Taxa_Finder.py instead.
+
+
+List of functions:
+    default_socket: Path of the daemon socket, unless --socket is given.
+    daemon_running: Tests whether a daemon answers on a socket.
+    forward: Sends a command line to the daemon and relays its output.
+
+Procedure:
+    1. The socket path is taken from --socket, $TAXA_FINDER_SOCKET or the
+    default path in the temporary directory.
+    2. Command lines that build or update the index, start the daemon or use
+    another index (--index, --taxdump) are always run locally.
+    3. Otherwise the command line and working directory are sent as one json
+    line, the daemon answers with json lines carrying stdout and stderr text,
+    and finally the exit code.
+
+
+Usage:
+    Start the daemon once (f.e. in the background, or as a service):
+
+    python Taxa_Finder.py --daemon &
+
+    Then use the client like Taxa_Finder.py:
+
+    python Taxa_Client.py -i Human Cat -p -c
+
+    for query in Human Cat Chicken; do python Taxa_Client.py -i "$query" -p; done
+
+Possible Bugs:
+    1. Output files are written by the daemon process, with its permissions.
+    2. The daemon answers from the taxonomy it was started with, --index and
+       --taxdump therefore make the client run locally.
+
+"""
+
+import json
+import os
+import socket
+import sys
+import tempfile
+
+#Options that are never forwarded to the daemon.
+LOCAL_OPTIONS={"--build-index", "--update-index", "--daemon", "--index", "--taxdump", "--workers", "-h", "--help"}
+
+
+def default_socket():
+    "Path of the daemon socket: $TAXA_FINDER_SOCKET, or one socket per user in the temporary directory."
+    return os.environ.get("TAXA_FINDER_SOCKET") or os.path.join(tempfile.gettempdir(), "taxa_finder-{}.sock".format(os.getuid()))
+
+
+def _connect(socket_path):
+    "Connected socket, None if no daemon is listening."
+    connection=socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except OSError:
+        connection.close()
+        return None
+    return connection
+
+
+def daemon_running(socket_path):
+    "Tests whether a daemon answers on socket_path."
+    connection=_connect(socket_path)
+    if connection is None:
+        return False
+    connection.close()
+    return True
+
+
+def forward(argv, socket_path, stdout=None, stderr=None):
+    """
+    Sends a command line to the daemon and relays its output.
+
+    Parameters
+    ----------
+    argv : list
+        command line options, as for Taxa_Finder.py.
+    socket_path : string
+        socket the daemon listens on.
+    stdout, stderr : file, optional
+        where the output of the daemon is written to.
+
+    Returns
+    -------
+    code: int
+        exit code of the request, None if no daemon is listening.
+
+    """
+    stdout=stdout or sys.stdout
+    stderr=stderr or sys.stderr
+    connection=_connect(socket_path)
+    if connection is None:
+        return None
+    with connection, connection.makefile('rwb') as stream:
+        stream.write((json.dumps({"argv": argv, "cwd": os.getcwd()})+"\n").encode("utf-8"))
+        stream.flush()
+        for line in stream:
+            message=json.loads(line)
+            if "out" in message:
+                stdout.write(message["out"])
+            elif "err" in message:
+                stderr.write(message["err"])
+            elif "exit" in message:
+                return message["exit"]
+    stderr.write("The daemon closed the connection.\n")
+    return 1
+
+
+def main(argv=None):
+    "Forwards the command line to the daemon, or runs it locally."
+    argv=sys.argv[1:] if argv is None else argv
+    socket_path=default_socket()
+    for i, option in enumerate(argv):
+        if option=="--socket" and i+1<len(argv):
+            socket_path=argv[i+1]
+        elif option.startswith("--socket="):
+            socket_path=option.split("=", 1)[1]
+    local=any(option.split("=", 1)[0] in LOCAL_OPTIONS for option in argv)
+    code=None if local else forward(argv, socket_path)
+    if code is None:
+        #No daemon: the whole taxonomy is loaded by this process.
+        import Taxa_Finder
+        Taxa_Finder.main(argv)
+        code=0
+    sys.exit(code)
+
+
+if __name__=='__main__':
+    main()
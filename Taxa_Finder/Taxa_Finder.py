@@ -11,27 +11,71 @@ taxonomic node.
     
     
 List of functions:
-    find_lineage: Finds lineage corresponding to a single query (string).
-    Find_common: Finds last common taxonomic node between queries.
+    build_parser: Command line options.
+    taxdump_files: Locates the dump files (working directory, --taxdump).
+    read_queries: Lazily reads the queries of a csv file.
+    read_taxid_map: Reads subject id to taxid mappings for --taxid-map.
+    run: Answers one command line, locally or for the daemon.
+    serve: Daemon mode, answers command lines sent over a Unix socket.
+    main: Command line entry point.
+
+List of classes:
+    TaxonomyDB: Importable interface, keeps the taxonomy loaded. Methods:
+        find_lineage: Finds lineage corresponding to a single query (string).
+        Find_common: Finds last common taxonomic node between queries.
+        write_matrix: Writes last common nodes and distances between all query pairs.
+        ambiguity_note: Describes the other taxa an ambiguous query also matches.
+        redirect_note: Describes a taxid query that was merged into another taxid.
+        stream_lineages: Writes one lineage row per query, chunk by chunk.
+        write_descendants: Writes all taxa below a clade.
+        annotate_blast: Appends taxonomy columns to BLAST tabular output.
+    QueryError: Raised when a query can not be found.
     
 Procedure:
+    0. names.dmp and nodes.dmp are compiled once into a binary index (see
+    Taxa_Index.py), which is memory-mapped. It is rebuilt automatically when the
+    dump files are newer than the index. The dump files can be read straight
+    from taxdump.tar.gz with --taxdump. With --update-index, a new taxdump is
+    applied to the existing index as a diff instead.
     1. Iterate through the queries, for each:
-        a. The query is looked for in the file names.dmp, its corresponding ID
-        is extracted. The scientific names and their corresponding IDs from names.dmp
-        are saved.
-        b. The script then looks for the query ID in the file nodes.dmp, finds the 
-        corresponding parent ID, looks for that one in nodes.dmp, finds its parent
-        ID etc until reaching the root of the taxonomic tree. The IDs are saved
-        in a list.
+        a. The query is looked up in the name table of the index (names of all
+        classes, ignoring case), its corresponding ID is extracted. If the name
+        belongs to several taxa, the one where it is the scientific name is
+        preferred and the others are reported. Queries can also be taxids,
+        old taxids listed in merged.dmp are redirected to their new taxid.
+        b. The script then reads the parent ID of the query ID from the parent
+        array of the index, then the parent of the parent etc until reaching
+        the root of the taxonomic tree, or an ancestor whose lineage is in the
+        lineage cache. The IDs are saved in a list.
         c. By going through the path list, the corresponding lineage is assembled
         into a string, one ID at the time. If input parameter -s or --short is given,
         then only nodes who are not marked as hidden by ncbi will be added to
         lineage. Additionally saved as dictionary together with query(-ies).
-    2. If -c is set, then the resultng dictionary containing queries and lineages
-    will be used to determine the last common node. And this is also added to the output.
+    2. If -c is set, then the resultng dictionary containing queries and taxids
+    will be used to determine the last common node over the lca engine of the
+    index (binary lifting over the depth of the taxids). And this is also added
+    to the output. If -m is set, the last common nodes and distances between
+    all pairs of queries are written into two tables.
     3. Output is printed in output file and/or console. The result is labelled with the query,
     to be able to distinguish the lineage. All results get printed in the same file.
     
+    With --stream, steps 1-3 are instead done on chunks of --chunk-size queries read
+    lazily from the input file: the chunk is resolved, its lineages are taken from
+    the lineage cache, and one row per query is written (tsv or jsonl) before the
+    next chunk is read. Queries that can not be found are written as rows with status
+    "not found" ("deleted" for taxids listed in delnodes.dmp, "merged" for
+    redirected ones). Queries can be names or taxids.
+    
+    With --descendants CLADE, all taxa below CLADE are written instead, one row
+    per taxon. They are read as one contiguous range of the pre-order of the
+    taxonomy stored in the index, without walking the tree.
+    
+    With --blast, BLAST tabular output (outfmt 6 or 7) is streamed line by line
+    and taxid, rank, name, lineage, the taxa at the ranks of --levels, and the
+    last common node of all hits of the query are appended to every hit. The
+    taxids are read from the staxids column (or looked up over --taxid-map), only
+    the hits of the current query are kept in memory.
+    
 
 Usage:
     Run in command line with:
@@ -53,12 +97,77 @@ Usage:
     
     --common, -c:                   If several queries given, returns the last common
                                     taxonomic node between them.
+    
+    --fuzzy, -z:                    If a query can not be found, the closest scientific
+                                    and common names are suggested ("did you mean").
+    
+    --matrix [MATRIX], -m [MATRIX]: Last common nodes and distances between all pairs
+                                    of queries, written to MATRIX_lca.tsv and
+                                    MATRIX_distance.tsv. Default: Common
+    
+    --stream:                       Streams the queries of the input file in chunks, one
+                                    lineage row per query is written to the output file
+                                    ("-" for stdout). For input files with millions of queries.
+    
+    --format {tsv,jsonl}:           Row format of --stream. Default: tsv
+    
+    --chunk-size CHUNK_SIZE:        Queries resolved at once by --stream. Default: 10000
+    
+    --descendants CLADE:            Writes taxid, rank, name and depth of all taxa below
+                                    CLADE (name or taxid) to the output file ("-" for
+                                    stdout). With -s, hidden taxa are left out.
+    
+    --blast BLAST:                  BLAST tabular output (outfmt 6 or 7, "-" for stdin),
+                                    written with taxonomy columns to the output file
+                                    ("-" for stdout).
+    
+    --taxid-column N:               1-based column of the staxids in --blast. Default: found
+                                    over the "# Fields:" line of outfmt 7.
+    
+    --taxid-map FILE:               Subject id to taxid mapping (two columns, or ncbi
+                                    accession2taxid) for BLAST files without staxids.
+    
+    --subject-column N:             1-based column of the subject ids. Default: 2
+    
+    --levels LEVELS:                Comma separated ranks added as columns by --blast,
+                                    f.e. class,order.
+    
+    --index INDEX:                  Compiled taxonomy index. Default: taxonomy.idx
+    
+    --build-index:                  (Re)builds the index from names.dmp and nodes.dmp.
+    
+    --update-index:                 Applies new dump files (names.dmp, nodes.dmp, merged.dmp,
+                                    delnodes.dmp) to the existing index, recomputing
+                                    only what changed.
+    
+    --taxdump TAXDUMP:              taxdump.tar.gz, read without extracting it, or directory
+                                    containing the dump files. Default: working directory
+    
+    --workers WORKERS:              Processes parsing the dump files. Default: number of CPUs
+    
+    --daemon:                       Keeps the taxonomy loaded and answers the command lines
+                                    of Taxa_Client.py over a Unix socket.
+    
+    --socket SOCKET:                Socket of the daemon. Default: $TAXA_FINDER_SOCKET or
+                                    taxa_finder-UID.sock in the temporary directory
                                     
     Note that printing to console and printing to outfile are not mutually exclusive.
     Both can be done, or neither.
     
+    For many short calls (f.e. in a shell loop), start the daemon once and call
+    Taxa_Client.py with the same options, which forwards them to the daemon:
+    
+    python Taxa_Finder.py --daemon &
+    python Taxa_Client.py -i Human -p
+    
+    From python:
+        from Taxa_Finder import TaxonomyDB
+        db=TaxonomyDB("taxonomy.idx")
+        db.find_lineage("Human", short=True)
+    
 Possible Bugs:
-    1. Requires files names.dmp and nodes.dmp in working directory.
+    1. Requires files names.dmp and nodes.dmp (or an index built from them) in
+       working directory, unless --taxdump is given.
     2. If neither -p or -o are given, the script runs, but no output is given.
     3. If both, an input file and a query as string, are given, then the script will only process
        one of the two.
@@ -66,200 +175,855 @@ Possible Bugs:
 """
 
 import argparse
+import functools
+import itertools
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
 
+from Taxa_Client import daemon_running, default_socket
+from Taxa_Index import SharedIndex, build_index, is_taxid, update_index
 
-parser = argparse.ArgumentParser(prog='Taxa_Finder',
-                                 usage='%(prog)s -i INPUT [-s] [-p] -[o] [OUTPUT] ',
-                                 description='Returns lineage of query based on ncbi`s taxonomy database.')
 
-parser.add_argument('--infile', '-f', 
-                    help='csv file, containing queries.')
-parser.add_argument('--input', '-i', nargs="+", 
-                    help='Query name, either single string, or severl strings seperated by space.')
-parser.add_argument('--out', '-o', nargs="?", default="Lineage.txt",
-                    help='Lineage printed in specified output file. Default: Lineage.txt')
-parser.add_argument('--short', '-s', action='store_true',
-                    help='The lineage returned will only include entries not flagged as hidden by ncbi.')
-parser.add_argument('--print', '-p', action='store_true',
-                    help='The lineage is printed to console.')
-parser.add_argument('--common', '-c', action='store_true',
-                    help='Additionally returns the last common taxonomic node of the queries lineage.')
+def build_parser(parser_class=argparse.ArgumentParser):
+    "Command line options of Taxa_Finder, also used to parse requests of the daemon."
+    parser = parser_class(prog='Taxa_Finder',
+                          usage='%(prog)s -i INPUT [-s] [-p] -[o] [OUTPUT] ',
+                          description='Returns lineage of query based on ncbi`s taxonomy database.')
 
+    parser.add_argument('--infile', '-f', 
+                        help='csv file, containing queries.')
+    parser.add_argument('--input', '-i', nargs="+", 
+                        help='Query name, either single string, or severl strings seperated by space.')
+    parser.add_argument('--out', '-o', nargs="?", default="Lineage.txt",
+                        help='Lineage printed in specified output file. Default: Lineage.txt')
+    parser.add_argument('--short', '-s', action='store_true',
+                        help='The lineage returned will only include entries not flagged as hidden by ncbi.')
+    parser.add_argument('--print', '-p', action='store_true',
+                        help='The lineage is printed to console.')
+    parser.add_argument('--common', '-c', action='store_true',
+                        help='Additionally returns the last common taxonomic node of the queries lineage.')
+    parser.add_argument('--fuzzy', '-z', action='store_true',
+                        help='If a query can not be found, suggests the closest names of the taxonomy.')
+    parser.add_argument('--matrix', '-m', nargs="?", const="Common",
+                        help='Writes last common nodes and distances between all pairs of queries to MATRIX_lca.tsv and MATRIX_distance.tsv. Default: Common')
+    parser.add_argument('--stream', action='store_true',
+                        help='Streams the queries of --infile in chunks and writes one lineage row per query into the output file, for very large input files.')
+    parser.add_argument('--format', choices=["tsv", "jsonl"], default="tsv",
+                        help='Row format of --stream. Default: tsv')
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                        help='Number of queries resolved at once by --stream. Default: 10000')
+    parser.add_argument('--descendants', default=None, metavar="CLADE",
+                        help='Writes all taxa below CLADE (name or taxid) to the output file ("-" for stdout).')
+    parser.add_argument('--blast', default=None,
+                        help='BLAST tabular output (outfmt 6 or 7, "-" for stdin) to annotate with taxonomy columns, written to the output file ("-" for stdout).')
+    parser.add_argument('--taxid-column', type=int, default=None,
+                        help='1-based column of the subject taxids (staxids) in --blast. Default: taken from the "# Fields:" line of outfmt 7')
+    parser.add_argument('--taxid-map', default=None,
+                        help='Mapping of subject ids to taxids (two columns, or ncbi accession2taxid), for --blast files without taxid column.')
+    parser.add_argument('--subject-column', type=int, default=2,
+                        help='1-based column of the subject ids in --blast, looked up in --taxid-map. Default: 2')
+    parser.add_argument('--levels', default="",
+                        help='Comma separated ranks reported as extra columns by --blast, f.e. class,order. Default: none')
+    parser.add_argument('--index', default="taxonomy.idx",
+                        help='Compiled taxonomy index, built from names.dmp and nodes.dmp if missing or outdated. Default: taxonomy.idx')
+    parser.add_argument('--build-index', action='store_true',
+                        help='(Re)builds the taxonomy index from names.dmp and nodes.dmp.')
+    parser.add_argument('--update-index', action='store_true',
+                        help='Applies new dump files to the existing index, recomputing only what changed.')
+    parser.add_argument('--taxdump', default=None,
+                        help='taxdump.tar.gz (read without extracting it) or directory containing the dump files. Default: working directory')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of processes parsing the dump files when building the index. Default: number of CPUs')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Keeps the taxonomy loaded and answers the requests of Taxa_Client.py over a Unix socket.')
+    parser.add_argument('--socket', default=default_socket(),
+                        help='Unix socket of the daemon. Default: $TAXA_FINDER_SOCKET or taxa_finder-UID.sock in the temporary directory')
+    return parser
 
-args=parser.parse_args()
 
-"Parsing input:"
-if args.infile:
-    with open (args.infile, 'r') as infile:
-        for line in infile:
-            query=line.strip("\n").split(",")
-elif args.input:
-    query=args.input
-else:
-    print("No query has been input.")
-    quit()
-outfile=args.out
-    
-    
-    
-#%%    
-def Find_common(taxonomy):
+def taxdump_files(taxdump):
+    """
+    Locates the dump files: in the working directory, in the --taxdump
+    directory, or streamed straight out of the --taxdump archive.
+
+    Returns
+    -------
+    dumps: dictionary
+        keyword arguments of build_index, update_index and open_index.
+
+    """
+    dumps=dict(names_file="names.dmp", nodes_file="nodes.dmp", merged_file="merged.dmp",
+               delnodes_file="delnodes.dmp", taxdump_file=None)
+    if taxdump and os.path.isdir(taxdump):
+        for key in ("names", "nodes", "merged", "delnodes"):
+            dumps[key+"_file"]=os.path.join(taxdump, key+".dmp")
+    elif taxdump:
+        dumps["taxdump_file"]=taxdump
+    return dumps
+
+
+class QueryError(Exception):
+    "Raised when a query can not be found, the message is meant for the user."
+
+
+#%%
+class TaxonomyDB:
+    """
+    Importable interface of Taxa_Finder. The compiled taxonomy is loaded on
+    first use and kept resident, and is swapped for a new one when the dump
+    files change, so one TaxonomyDB can answer any number of requests (the
+    daemon keeps one for its whole lifetime).
+
+    Usage:
+        db=TaxonomyDB("taxonomy.idx")
+        db.find_lineage("Human")
+        taxonomy={query: db.resolve(query) for query in ["Human", "Cat"]}
+        db.Find_common(taxonomy)
+
     """
-    Finds the last common node in the taxonomic tree for all input queries.
+
+    def __init__(self, index_file="taxonomy.idx", names_file="names.dmp", nodes_file="nodes.dmp",
+                 merged_file="merged.dmp", delnodes_file="delnodes.dmp", taxdump_file=None):
+        self.shared=SharedIndex(index_file, names_file, nodes_file, merged_file=merged_file,
+                                delnodes_file=delnodes_file, taxdump_file=taxdump_file)
+        #Index pinned by the current thread, see pinned().
+        self._local=threading.local()
+
+    @property
+    def index(self):
+        "The current TaxonomyIndex, loaded (or built) on first use."
+        if getattr(self._local, "pinning", False):
+            if self._local.index is None:
+                self._local.index=self.shared.acquire()
+            return self._local.index
+        return self.shared.get()
+
+    @contextmanager
+    def pinned(self):
+        """
+        Uses one index for everything done in the block by this thread (one
+        daemon request, one command line run). It is acquired on first use
+        and released at the end, so a swap meanwhile does not close it.
+        """
+        self._local.pinning=True
+        self._local.index=None
+        try:
+            yield self
+        finally:
+            index=self._local.index
+            self._local.pinning=False
+            self._local.index=None
+            if index is not None:
+                self.shared.release(index)
+
+    def resolve(self, query):
+        "Taxid of a name or taxid query, None if it can not be found."
+        return self.index.resolve(query)
+
+    def Find_common(self, taxonomy, short=False):
+        """
+        Finds the last common node in the taxonomic tree for all input queries.
+        The comparison is done on taxids with the lca engine of the index, so
+        queries with the same display name in their lineages do not get mixed up.
+
+        Parameters
+        ----------
+        taxonomy : dictionary
+            contains queries as keys and taxids as values.
+        short : bool
+            the last common node has to be visible in the shortened lineage.
+
+        Returns
+        -------
+        node: string
+
+        """
+        index=self.index
+        last_node=index.lca_many(list(taxonomy.values()))
+        #For the shortened lineage, the last common node also has to be visible.
+        if short:
+            while last_node>1 and index.hidden[last_node]==1:
+                last_node=index.parent[last_node]
+        return(index.name(last_node))
+
+    def write_matrix(self, taxonomy, prefix):
+        """
+        Writes the last common nodes and the distances (number of edges in the
+        tree) between all pairs of queries into two tab separated tables,
+        PREFIX_lca.tsv and PREFIX_distance.tsv. Rows are written as they are
+        computed, so thousands of queries can be compared.
+
+        Parameters
+        ----------
+        taxonomy : dictionary
+            contains queries as keys and taxids as values.
+        prefix : string
+            prefix of the two output files.
+
+        Returns
+        -------
+        None.
+
+        """
+        index=self.index
+        queries=list(taxonomy.keys())
+        with open(prefix+"_lca.tsv", 'w') as lca_out, open(prefix+"_distance.tsv", 'w') as distance_out:
+            lca_out.write("\t"+"\t".join(queries)+"\n")
+            distance_out.write("\t"+"\t".join(queries)+"\n")
+            rows=index.lca_matrix(list(taxonomy.values()))
+            for query, (taxid, lca_row, distance_row) in zip(queries, rows):
+                lca_out.write(query+"\t"+"\t".join(index.name(node) for node in lca_row)+"\n")
+                distance_out.write(query+"\t"+"\t".join(str(distance) for distance in distance_row)+"\n")
+
+    def find_lineage(self, query, short=False, fuzzy=False):
+        """
+        Finds the taxonomic lineage corresponding to a query.
+
+        Parameters
+        ----------
+        query : string
+            f.e. Human, Homo Sapiens, Mammalia etc.
+        short : bool
+            only include entries not flagged as hidden.
+        fuzzy : bool
+            suggest the closest names if the query can not be found.
+
+        Returns
+        -------
+        Lineage: string
+            taxonomic lineage leading from root to query.
+
+        Raises
+        ------
+        QueryError
+            if the query can not be found.
+
+        """
+        index=self.index
+        "a. Find Query ID in the name table of the index."
+        #Taxids are accepted too, merged taxids are redirected to their new taxid.
+        query_ID=index.resolve(query)
+
+        #If the query is not found in the file
+        if query_ID is None:
+            if is_taxid(query) and index.redirect(int(query))[1]=="deleted":
+                raise QueryError("The taxid {} has been deleted from the ncbi taxonomy.".format(query))
+            message="The query could not be found. Please check your spelling or try with a different query. When using an informal name, it can help to use the scientific name instead."
+            #With -z, close names are looked up in the trigram index.
+            if fuzzy:
+                candidates=["{} ({}, taxid {})".format(c["name"], c["scientific_name"], c["taxid"]) for c in index.fuzzy(query)]
+                if candidates:
+                    message+="\nDid you mean: {}?".format("; ".join(candidates))
+            raise QueryError(message)
+        
+        "b. Trace the path from the parent of the query ID back to root."
+        #The lineage cache of the index reuses the cached lineage of the first
+        #cached ancestor, so siblings of earlier queries only need a step or two.
+        #With short, nodes flagged as hidden are already left out.
+        path=index.cache.lineage(index.parent[query_ID], short)
+
+        "3. Assemble Output."
+        #The path goes from below the root to the parent of the query.
+        lineage=", ".join(index.name(ID) for ID in path)
+        if lineage:
+            lineage+="."
+        return(lineage)        
+
+    def ambiguity_note(self, query):
+        """
+        Describes the other taxa a query name also belongs to.
+
+        Parameters
+        ----------
+        query : string
+
+        Returns
+        -------
+        note: string
+            empty if the name belongs to a single taxon.
+
+        """
+        index=self.index
+        matches=index.lookup(query)
+        if len(matches)<2:
+            return ""
+        others=["{} ({}, taxid {})".format(index.name(taxid), name_class, taxid) for taxid, name_class in matches[1:]]
+        return "Note: query {} is ambiguous, it is used for {} ({}), but also matches: {}.\n".format(
+            query, index.name(matches[0][0]), matches[0][1], "; ".join(others))
+
+    def redirect_note(self, query):
+        """
+        Describes a taxid query that was merged into another taxid.
+
+        Parameters
+        ----------
+        query : string
+
+        Returns
+        -------
+        note: string
+            empty if the query is not a merged taxid.
+
+        """
+        if not is_taxid(query):
+            return ""
+        index=self.index
+        taxid, status=index.redirect(int(query))
+        if status!="merged":
+            return ""
+        return "Note: taxid {} has been merged into taxid {} ({}).\n".format(query, taxid, index.name(taxid))
+
+    def stream_lineages(self, queries, outfile, short, out_format, chunk_size, stdout=None, log=None):
+        """
+        Resolves queries chunk by chunk against the loaded taxonomy and writes one
+        row per query as soon as its chunk is done, so memory stays bounded by the
+        chunk size. Queries that cannot be found are written as rows with status
+        "not found" instead of ending the run. The throughput is reported on
+        log every few seconds.
+
+        Parameters
+        ----------
+        queries : iterable
+            queries as strings, names or taxids.
+        outfile : string
+            output file, "-" for stdout.
+        short : bool
+            only include entries not flagged as hidden.
+        out_format : string
+            "tsv" or "jsonl".
+        chunk_size : int
+            number of queries resolved at once.
+        stdout, log : file, optional
+            streams standing in for stdout and stderr.
+
+        Returns
+        -------
+        None.
+
+        """
+        index=self.index
+        stdout=stdout or sys.stdout
+        log=log or sys.stderr
+        out=stdout if outfile=="-" else open(outfile, 'w')
+        if out_format=="tsv":
+            out.write("query\tstatus\ttaxid\trank\tname\tlineage\n")
+        start=last_report=time.time()
+        processed=unresolved=0
+        queries=iter(queries)
+        while True:
+            chunk=list(itertools.islice(queries, chunk_size))
+            if not chunk:
+                break
+            taxids=[index.resolve(q) for q in chunk]
+            for q, taxid in zip(chunk, taxids):
+                #Taxids of merged.dmp are resolved to their new taxid, and flagged.
+                status=index.redirect(int(q))[1] if is_taxid(q.strip()) else None
+                if taxid is None:
+                    unresolved+=1
+                    row={"query": q, "status": status or "not found", "taxid": None, "rank": None, "name": None, "lineage": []}
+                else:
+                    #Repeated taxids and siblings are served by the lineage cache.
+                    lineage=[index.name(ID) for ID in index.cache.lineage(index.parent[taxid], short)]
+                    row={"query": q, "status": status or "ok", "taxid": taxid, "rank": index.rank_of(taxid),
+                         "name": index.name(taxid), "lineage": lineage}
+                if out_format=="jsonl":
+                    out.write(json.dumps(row)+"\n")
+                else:
+                    out.write("{}\t{}\t{}\t{}\t{}\t{}\n".format(q, row["status"], taxid or "", row["rank"] or "",
+                                                              row["name"] or "", ", ".join(row["lineage"])))
+            processed+=len(chunk)
+            now=time.time()
+            if now-last_report>=5:
+                last_report=now
+                log.write("{} queries processed ({:.0f} queries/s)\n".format(processed, processed/(now-start)))
+        if out is not stdout:
+            out.close()
+        elapsed=max(time.time()-start, 1e-9)
+        log.write("Done: {} queries, {} not found, {:.1f} s ({:.0f} queries/s)\n".format(processed, unresolved, elapsed, processed/elapsed))
+        log.write("Lineage cache: {hits} hits, {misses} misses, {evictions} evictions\n".format(**index.cache.stats()))
+
+    def write_descendants(self, clade, outfile, short, stdout=None, log=None):
+        """
+        Writes all taxa below a clade, one row per taxon (taxid, rank, name and
+        depth below the clade), in pre-order: every taxon is followed by its own
+        subtree.
+
+        Parameters
+        ----------
+        clade : string
+            name or taxid of the clade.
+        outfile : string
+            output file, "-" for stdout.
+        short : bool
+            leave out taxa flagged as hidden.
+        stdout, log : file, optional
+            streams standing in for stdout and stderr.
+
+        Returns
+        -------
+        None.
+
+        """
+        index=self.index
+        taxid=index.resolve(clade)
+        if taxid is None:
+            raise QueryError("The clade {} could not be found.".format(clade))
+        subtree=index.descendants(taxid, short)
+        stdout=stdout or sys.stdout
+        log=log or sys.stderr
+        out=stdout if outfile=="-" else open(outfile, 'w')
+        out.write("taxid\trank\tname\tdepth\n")
+        for node in subtree:
+            out.write("{}\t{}\t{}\t{}\n".format(node, index.rank_of(node), index.name(node), index.depth[node]-index.depth[taxid]))
+        if out is not stdout:
+            out.close()
+        log.write("{} taxa below {} ({}).\n".format(len(subtree), index.name(taxid), taxid))
+
+    def annotate_blast(self, blast_file, outfile, taxid_column=None, subject_column=2, taxid_map=None,
+                       levels=(), short=False, stdout=None, log=None):
+        """
+        Streams a BLAST tabular file (outfmt 6 or 7) and appends taxonomy
+        columns to every hit: taxid, rank, name, lineage, the name of the
+        ancestor at each rank of levels, and taxid and name of the last common
+        node of all hits of the query. The hits of a query are consecutive in
+        BLAST output, so only the hits of the current query are held in memory.
+        Hits with several taxids (f.e. "9606;9598") are placed at their last
+        common node.
+
+        Parameters
+        ----------
+        blast_file : string
+            BLAST tabular output, "-" for stdin.
+        outfile : string
+            output file, "-" for stdout.
+        taxid_column : int, optional
+            1-based column holding the subject taxids (staxids). Found over
+            the "# Fields:" line of outfmt 7 if not given.
+        subject_column : int
+            1-based column holding the subject id, looked up in taxid_map.
+        taxid_map : dictionary, optional
+            subject id to taxid, used instead of (or where there is no) taxid
+            column, see read_taxid_map.
+        levels : list
+            ranks to report a column for, f.e. ["class", "order"].
+        short : bool
+            leave nodes flagged as hidden out of the lineage.
+        stdout, log : file, optional
+            streams standing in for stdout and stderr.
+
+        Returns
+        -------
+        None.
+
+        """
+        index=self.index
+        stdout=stdout or sys.stdout
+        log=log or sys.stderr
+        if taxid_column is None and taxid_map is None:
+            taxid_column=0
+        taxid_map=taxid_map or dict()
+        extra=["taxid", "rank", "name", "lineage"]+list(levels)+["query lca taxid", "query lca name"]
+
+        def hit_taxid(fields):
+            "Taxid of a hit, over the taxid column or the subject id."
+            taxids=[]
+            if taxid_column and len(fields)>=taxid_column:
+                taxids=[index.resolve(t) for t in fields[taxid_column-1].split(";") if is_taxid(t.strip())]
+            if not taxids and len(fields)>=subject_column and fields[subject_column-1] in taxid_map:
+                taxids=[index.resolve(taxid_map[fields[subject_column-1]])]
+            taxids=[t for t in taxids if t is not None]
+            if not taxids:
+                return None
+            return taxids[0] if len(taxids)==1 else index.lca_many(taxids)
+
+        @functools.lru_cache(maxsize=65536)
+        def columns(taxid):
+            "Taxonomy columns of a taxid, the lineage comes from the lineage cache."
+            if taxid is None:
+                return [""]*(len(extra)-2)
+            path=index.cache.lineage(index.parent[taxid], short)
+            at_rank=dict()
+            for node in index.cache.lineage(taxid):
+                at_rank[index.rank_of(node)]=index.name(node)
+            return ([str(taxid), index.rank_of(taxid), index.name(taxid), ", ".join(index.name(node) for node in path)]
+                    +[at_rank.get(level, "") for level in levels])
+
+        def write_query(hits):
+            "Writes the buffered hits of one query, with their last common node."
+            taxids=[taxid for fields, taxid in hits if taxid is not None]
+            common=index.lca_many(taxids) if taxids else None
+            tail=[str(common), index.name(common)] if common is not None else ["", ""]
+            for fields, taxid in hits:
+                out.write("\t".join(fields+columns(taxid)+tail)+"\n")
+
+        source=sys.stdin if blast_file=="-" else open(blast_file, 'r')
+        out=stdout if outfile=="-" else open(outfile, 'w')
+        start=last_report=time.time()
+        hits=[]
+        query=None
+        processed=unresolved=0
+        for line in source:
+            if line.startswith("#"):
+                #outfmt 7 comments. The field names locate the taxid column.
+                if line.startswith("# Fields:"):
+                    fields=[field.strip() for field in line[len("# Fields:"):].split(",")]
+                    if not taxid_column:
+                        for i, field in enumerate(fields, 1):
+                            if field in ("subject tax ids", "subject tax id", "staxids", "staxid"):
+                                taxid_column=i
+                    line=line.rstrip("\n")+", "+", ".join(extra)+"\n"
+                if hits:
+                    write_query(hits)
+                    hits=[]
+                out.write(line)
+                continue
+            fields=line.rstrip("\n").split("\t")
+            if not fields[0]:
+                continue
+            if fields[0]!=query and hits:
+                write_query(hits)
+                hits=[]
+            query=fields[0]
+            taxid=hit_taxid(fields)
+            unresolved+=taxid is None
+            hits.append((fields, taxid))
+            processed+=1
+            now=time.time()
+            if now-last_report>=5:
+                last_report=now
+                log.write("{} hits annotated ({:.0f} hits/s)\n".format(processed, processed/(now-start)))
+        if hits:
+            write_query(hits)
+        if source is not sys.stdin:
+            source.close()
+        if out is not stdout:
+            out.close()
+        if not taxid_column and not taxid_map:
+            log.write("No taxid column found, use --taxid-column or --taxid-map.\n")
+        elapsed=max(time.time()-start, 1e-9)
+        log.write("Done: {} hits, {} without taxid, {:.1f} s ({:.0f} hits/s)\n".format(processed, unresolved, elapsed, processed/elapsed))
+        log.write("Lineage cache: {hits} hits, {misses} misses, {evictions} evictions\n".format(**index.cache.stats()))
+
+
+def read_taxid_map(map_file):
+    """
+    Reads a mapping of subject ids to taxids: either two columns (id and
+    taxid) or an ncbi accession2taxid file (accession, accession.version,
+    taxid, gi), where both accession forms are mapped.
 
     Parameters
     ----------
-    taxonomy : dictionary
-        contains queries as keys and lineage as values (list).
+    map_file : string
+        tab (or space) separated mapping file.
 
     Returns
     -------
-    node: string
+    taxid_map: dictionary
+        subject id as key, taxid (string) as value.
 
     """
-    #Change values of taxonomy dictionary to sets
-    taxonomy_set=dict()
-    for key in taxonomy:
-        taxonomy_set[key]=set(taxonomy[key])
-    
-    values=list(taxonomy_set.values())
-    #intersection between sets allows unknown number of queries.
-    intersection=list(set.intersection(*values))
-    #But it changes the order, so we need to go through one query to find "last"
-    for element in taxonomy[list(taxonomy.keys())[0]]:
-        #If the element is in the intersection, we update last node
-        if element in intersection:
-            last_node=element
-        #If it is not, then the previous element was the last node.
-        else:
-            return(last_node)            
-            
+    taxid_map=dict()
+    with open(map_file, 'r') as mapping:
+        for line in mapping:
+            fields=line.split()
+            if len(fields)<2 or fields[0]=="accession":
+                continue
+            if len(fields)>=3 and is_taxid(fields[2]):
+                taxid_map[fields[0]]=taxid_map[fields[1]]=fields[2]
+            else:
+                taxid_map[fields[0]]=fields[1]
+    return taxid_map
 
 
-def find_lineage(query):
+def read_queries(infile):
     """
-    Finds the taxonomic lineage corresponding to a query.
+    Lazily yields the queries of a csv file, one at a time, so the file never
+    has to be held in memory.
 
     Parameters
     ----------
-    query : string
-        f.e. Human, Homo Sapiens, Mammalia etc.
+    infile : string
+        csv file, containing queries (names or taxids).
+
+    Yields
+    ------
+    query: string
+
+    """
+    with open(infile, 'r') as queries:
+        for line in queries:
+            for field in line.strip("\n").split(","):
+                field=field.strip(" ")
+                if field:
+                    yield field
+
+
+#%%
+def run(args, db, stdout=None, log=None):
+    """
+    Answers one command line: builds or updates the index if asked for, then
+    resolves the queries and writes the output.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        parsed command line.
+    db : TaxonomyDB
+        taxonomy to answer from.
+    stdout, log : file, optional
+        streams standing in for stdout and stderr (the client connection,
+        when run by the daemon).
 
     Returns
     -------
-    Lineage: string
-        taxonomic lineage leading from root to query.
+    None.
 
     """
-    "a. Find Query ID in names.dmp"
-    #Initialize dictionary containing scientific names and corresponding ID
-    names_dic=dict()
-
-    with open("names.dmp", 'r') as names:
-        for entry in names:
-            #find query:
-            any_name=entry.split("\t|\t")[1]
-            if any_name.upper().strip(" ")==query.upper().strip(" "):
-                query_ID =entry.split("\t|\t")[0].strip(" ")
-            #make name dictionary:
-            #make sure to only use names flagged as scientific.
-            if entry.split("\t|\t")[3][0:15]=="scientific name":  
-                names_dic[entry.split("\t|\t")[0]]=entry.split("\t|\t")[1]            
-
-    #If the query is not found in the file
-    try: query_ID
-    except NameError: query_ID=None
-
-    if query_ID is None:
-        print("The query could not be found. Please check your spelling or try with a different query. When using an informal name, it can help to use the scientific name instead.")
-        quit()
-    
-    "b. Find Id in nodes.dmp, trace the path over parent ID back to root."
-
-    #For additional information, s.a. rank or whether its included in shortened lineage.
-    nodes_info=dict()
-    #For ID/parent ID pairs.
-    nodes_path=dict()
-
-    #save nodes.dmp as dictionary
-    with open("nodes.dmp",'r') as nodes:
-        for entry in nodes:
-            ID=entry.strip(" ").split("\t|\t")[0]
-            parent_ID=entry.strip(" ").split("\t|\t")[1]
-            rank=entry.strip(" ").split("\t|\t")[2]
-            hidden_flag=entry.strip(" ").split("\t|\t")[10]
-            nodes_info[ID]=[rank, hidden_flag]
-            nodes_path[ID]=parent_ID
-            
-    #Find query ID, make path:
-    root_found=False
-    path=[]
-    current_ID=query_ID
-    while root_found==False:
-        for ID in nodes_path:
-            if current_ID==ID:
-                #append the parent ID to path
-                parent_ID=nodes_path[current_ID]
-                #update current_ID
-                current_ID=parent_ID
-                if current_ID=="1":
-                    root_found=True
-                    break
-                #If we are not at the root, append parent ID to path.
-                path.append(parent_ID)
-                
-    "3. Assemble Output."
-
-    lineage=""
-    #right now the path goes from query back to root, we want the output reversed.
-    for ID in reversed(path):
-        #check if we want shortened path or the entire path:
-        if args.short:
-            #for the shortened path, we exclude the hidden_flags=1
-            if path.index(ID)==0:
-                if nodes_info[ID][1]=='0':
-                    lineage+="{}.".format(names_dic[ID])
-                    break
-            if nodes_info[ID][1]=='0':
-                lineage+="{}, ".format(names_dic[ID])
-        #for the full path, we do not need to sort by hidden flags.
+    stdout=stdout or sys.stdout
+    log=log or sys.stderr
+    dumps=taxdump_files(args.taxdump)
+
+    "Parsing input:"
+    if args.build_index:
+        build_index(index_file=args.index, workers=args.workers, **dumps)
+        print("Taxonomy index written to {}.".format(args.index), file=stdout)
+        if not (args.infile or args.input or args.descendants or args.blast):
+            return
+    elif args.update_index:
+        changes=update_index(args.index, workers=args.workers, **dumps)
+        if changes is None:
+            print("No usable index found, taxonomy index built from scratch into {}.".format(args.index), file=stdout)
         else:
-            if path.index(ID)==0:
-                lineage+="{}.".format(names_dic[ID])
-                break
-            else:
-                lineage+="{}, ".format(names_dic[ID])
-        
-    return(lineage)        
+            print("Taxonomy index {} updated: {added} added, {removed} removed, {moved} moved taxids "
+                  "({affected} taxids recomputed), {new_names} new names, {merged} merged and {deleted} deleted taxids.".format(args.index, **changes), file=stdout)
+        if not (args.infile or args.input or args.descendants or args.blast):
+            return
+    if args.descendants or args.blast:
+        #The clade, or the hits of the BLAST file, are the only queries.
+        query=[]
+    elif args.infile and args.stream:
+        #Streamed queries are read lazily further down, while they are processed.
+        query=[]
+    elif args.infile:
+        query=[]
+        with open (args.infile, 'r') as infile:
+            for line in infile:
+                query+=[q.strip(" ") for q in line.strip("\n").split(",") if q.strip(" ")]
+    elif args.input:
+        query=args.input
+    else:
+        print("No query has been input.", file=stdout)
+        return
+    outfile=args.out
+
+    #Load the compiled taxonomy once for all queries.
+    if not os.path.exists(args.index) and not os.path.exists(dumps["taxdump_file"] or dumps["nodes_file"]):
+        print("Neither the index {} nor names.dmp and nodes.dmp (or --taxdump) could be found.".format(args.index), file=stdout)
+        return
+    try:
+        #BLAST mode: every hit with its taxonomy, straight into the output file.
+        if args.blast:
+            taxid_map=read_taxid_map(args.taxid_map) if args.taxid_map else None
+            levels=[level.strip() for level in args.levels.split(",") if level.strip()]
+            db.annotate_blast(args.blast, args.out, args.taxid_column, args.subject_column, taxid_map,
+                              levels, args.short, stdout, log)
+            return
+
+        #Subtree mode: all taxa below the clade, straight into the output file.
+        if args.descendants:
+            db.write_descendants(args.descendants, args.out, args.short, stdout, log)
+            return
+
+        #Stream mode: one row per query, straight into the output file.
+        if args.stream:
+            db.stream_lineages(read_queries(args.infile) if args.infile else query, args.out, args.short,
+                               args.format, args.chunk_size, stdout, log)
+            return
+
+        #Initialize taxonomy dictioanry needed for common node.
+        taxonomy=dict()
+        output=""
+        for i in query:
+            lineage=db.find_lineage(i, args.short, args.fuzzy)
+            #Also save the taxid together with query in dictionary.
+            taxonomy[i]=db.resolve(i)
+            output+="Lineage for query {}: {}\n".format(i,lineage)
+            #Names shared by several taxa are reported, the preferred one is used.
+            output+=db.ambiguity_note(i)+db.redirect_note(i)+"\n"
+    except QueryError as error:
+        print(error, file=stdout)
+        return
+
+    #If -c is set, find last common node.
+    if args.common:
+        #Needs to have two or more queries.
+        if len(query)==1:
+            print("Error finding common node: To find the last common taxonomic node between queries, two or more queries need to be given.\n", file=stdout)
+        else:
+            last_node=db.Find_common(taxonomy, args.short)
+            output+="Last common node between queries: "+last_node+"\n"
+
+    #If -m is set, write the all-pairs tables.
+    if args.matrix:
+        db.write_matrix(taxonomy, args.matrix)
+
+    "Output."
+    #If output file is wished for:
+    if args.out:
+        with open(outfile,'w') as out:
+            out.write(output)
+    #If console output is wished for:           
+    if args.print:
+        print(output, file=stdout)
+
 
 #%%
-#Initialize taxonomy dictioanry needed for common node.
-taxonomy=dict()
-if isinstance(query, list)==True:
-    output=""
-    for i in query:
-        lineage=find_lineage(i)
-        #Also save lineage together with query in dictionary.
-        taxonomy[i]=lineage.split(",")
-        output+="Lineage for query {}: {}\n\n".format(i,lineage)
-else:
-    print("Query format not correct, use strings enclosed by \"\" or '', queries seperated by space. ")
-    quit()
-
-#If -c is set, find last common node.
-if args.common:
-    #Needs to have two or more queries.
-    if len(query)==1:
-        print("Error finding common node: To find the last common taxonomic node between queries, two or more queries need to be given.\n")
-    else:
-        last_node=Find_common(taxonomy)
-        output+="Last common node between queries:"+last_node+"\n"
-
-"Output."
-#If output file is wished for:
-if args.out:
-    with open(outfile,'w') as out:
-        out.write(output)
-#If console output is wished for:           
-if args.print:
-    print(output)  
\ No newline at end of file
+class _Channel:
+    "Text stream forwarding what is written to a client, as json lines."
+
+    def __init__(self, wfile, key):
+        self.wfile=wfile
+        self.key=key
+        self.parts=[]
+        self.size=0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size+=len(text)
+        if self.size>=(1 << 16):
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self.parts:
+            self.wfile.write((json.dumps({self.key: "".join(self.parts)})+"\n").encode("utf-8"))
+            self.parts=[]
+            self.size=0
+
+
+class _RequestParser(argparse.ArgumentParser):
+    "Parses the command lines sent to the daemon, errors go back to the client."
+
+    def error(self, message):
+        raise ValueError(message)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Answers one request of Taxa_Client.py: a json line with the command line
+    and working directory of the client. Output is sent back as json lines
+    {"out": text} and {"err": text}, followed by {"exit": code}.
+    """
+
+    def handle(self):
+        stdout=_Channel(self.wfile, "out")
+        log=_Channel(self.wfile, "err")
+        code=0
+        try:
+            request=json.loads(self.rfile.readline())
+            args=self.server.parser.parse_args(request["argv"])
+            if args.build_index or args.update_index or args.daemon:
+                raise ValueError("--build-index, --update-index and --daemon are not run by the daemon.")
+            if args.blast=="-":
+                raise ValueError("--blast - reads stdin, which the daemon does not have: give the file name instead.")
+            #Files are read and written relative to the working directory of the client.
+            for key in ("infile", "out", "matrix", "blast", "taxid_map"):
+                path=getattr(args, key)
+                if path and path!="-":
+                    setattr(args, key, os.path.join(request["cwd"], path))
+            with self.server.db.pinned():
+                run(args, self.server.db, stdout, log)
+        except ConnectionError:
+            #The client went away, f.e. piped into head.
+            return
+        except (ValueError, KeyError, OSError) as error:
+            log.write("Error: {}\n".format(error))
+            code=1
+        except Exception as error:
+            #Anything else is a bug: logged by the daemon, reported to the client,
+            #which still gets its exit code.
+            traceback.print_exc()
+            log.write("Internal error: {}: {}\n".format(type(error).__name__, error))
+            code=1
+        try:
+            stdout.flush()
+            log.flush()
+            self.wfile.write((json.dumps({"exit": code})+"\n").encode("utf-8"))
+        except ConnectionError:
+            pass
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads=True
+
+
+def _stop(signum, frame):
+    "Stops the daemon on SIGTERM, like on Ctrl-C."
+    raise KeyboardInterrupt
+
+
+def serve(args):
+    """
+    Daemon mode: keeps the taxonomy loaded and answers the command lines sent
+    by Taxa_Client.py over a Unix socket, one thread per request. The socket is
+    only accessible to the user running the daemon.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        parsed command line, --index, --taxdump and --socket are used.
+
+    Returns
+    -------
+    None.
+
+    """
+    if os.path.exists(args.socket):
+        #A socket nobody answers on is left over from a daemon that crashed.
+        if daemon_running(args.socket):
+            print("A daemon is already listening on {}.".format(args.socket))
+            return
+        os.remove(args.socket)
+    db=TaxonomyDB(args.index, **taxdump_files(args.taxdump))
+    #Load before serving, so the first request does not wait for it.
+    db.index
+    server=_Server(args.socket, _RequestHandler, bind_and_activate=False)
+    mask=os.umask(0o177)
+    try:
+        server.server_bind()
+    finally:
+        os.umask(mask)
+    server.server_activate()
+    server.db=db
+    server.parser=build_parser(_RequestParser)
+    print("Taxa_Finder daemon listening on {}.".format(args.socket))
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+
+
+def main(argv=None):
+    "Command line entry point, see the module docstring."
+    args=build_parser().parse_args(argv)
+    if args.daemon:
+        serve(args)
+        return
+    db=TaxonomyDB(args.index, **taxdump_files(args.taxdump))
+    with db.pinned():
+        run(args, db)
+
+
+if __name__=='__main__':
+    main()
@@ -12,16 +12,32 @@ taxonomic node. Uses Flask to create a webinterface.
 List of functions:
     find_lineage: Finds lineage corresponding to a single query (string).
     Find_common: Finds last common taxonomic node between queries.
+    suggest: /suggest?q= endpoint, completions of a name prefix as json.
+    api_lineage: /api/lineage endpoint, json batch of queries to json or ndjson.
+    api_cache: /api/cache endpoint, counters of the lineage cache as json.
+    metrics: /metrics endpoint, latencies, cache, index and memory for Prometheus.
+    save_metrics: Saves the metrics of the worker to TAXA_METRICS_DIR.
+    collect_metrics: Metrics of all workers, for /metrics.
+    stage: Times one stage of a request.
+    resident_memory: Resident memory of the process in bytes.
+
+List of classes:
+    Histogram: Latency histogram per label, in the Prometheus format.
     
 Procedure:
+    0. names.dmp and nodes.dmp are compiled once into a binary index (see
+    Taxa_Index.py), which is memory-mapped. It is rebuilt automatically when the
+    dump files are newer than the index.
     1. Iterate through the queries, entered on the website, for each:
-        a. The query is looked for in the file names.dmp, its corresponding ID
-        is extracted. The scientific names and their corresponding IDs from names.dmp
-        are saved.
-        b. The script then looks for the query ID in the file nodes.dmp, finds the 
-        corresponding parent ID, looks for that one in nodes.dmp, finds its parent
-        ID etc until reaching the root of the taxonomic tree. The IDs are saved
-        in a list.
+        a. The query is looked up in the name table of the index (names of all
+        classes, ignoring case), its corresponding ID is extracted. If the name
+        belongs to several taxa, the one where it is the scientific name is
+        preferred and the others are reported. Queries can also be taxids,
+        old taxids listed in merged.dmp are redirected to their new taxid.
+        b. The script then reads the parent ID of the query ID from the parent
+        array of the index, then the parent of the parent etc until reaching
+        the root of the taxonomic tree, or an ancestor whose lineage is in the
+        lineage cache. The IDs are saved in a list.
         c. By going through the path list, the corresponding lineage is assembled
         into a string, one ID at the time. If input parameter -s or --short is given,
         then only nodes who are not marked as hidden by ncbi will be added to
@@ -38,15 +54,292 @@ Usage:
                                     
     Then open test-environment url.
     
+    Or with several worker processes, f.e. with gunicorn:
+        gunicorn -w 4 --preload Taxa_Finder_web:app
+    
+    Pipelines can post a json batch of names or taxids to /api/lineage:
+        curl -H "Content-Type: application/json" -d '{"queries": ["Human", 9685], "common": true}' http://127.0.0.1:5000/api/lineage
+    and add ?stream=1 to receive ndjson, one line per query, as results come in.
+    Requests are limited to 1 MB and 10000 queries.
+    
+    The taxonomy index is loaded once per process (at startup, or on the first
+    request), all workers share it over the page cache as it is memory-mapped.
+    When the dump files change on disk, the changes are applied to the index in
+    the background and it is swapped in once ready, without restarting the server.
+    
+    Every request is timed by stage (index, parse, match, fuzzy, path, assemble,
+    common, render). Requests sent with the header X-Taxa-Trace: 1 get their
+    stage timings back in a Server-Timing header, and logged as json:
+        curl -H "X-Taxa-Trace: 1" -d "query=Human" -D - http://127.0.0.1:5000/
+    /metrics reports the latency histograms of endpoints and stages, the
+    counters of the lineage cache, the index load time and the resident memory
+    in the Prometheus text format.
+    
 Possible Bugs:
-    1. Requires files names.dmp and nodes.dmp in working directory.
+    1. Requires files names.dmp and nodes.dmp (or an index built from them) in
+       working directory.
     2. If neither -p or -o are given, the script runs, but no output is given.
     3. Requires Flask environment
+    4. The metrics are kept per worker process, with several workers every
+       scrape of /metrics reports the worker that answered it, unless
+       TAXA_METRICS_DIR names a directory shared by the workers.
+    5. Streamed /api/lineage responses are timed until the response starts,
+       not until the last line is sent.
     
 """
 
-from flask import Flask, render_template, request
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Flask, Response, g, has_request_context, jsonify, render_template, request, stream_with_context
+
+from Taxa_Index import SharedIndex, is_taxid
+
 app = Flask(__name__)
+#Largest accepted request body (form or json) in bytes.
+app.config['MAX_CONTENT_LENGTH']=1024*1024
+#Largest number of queries accepted by /api/lineage in one request.
+MAX_QUERIES=10000
+#Queries resolved at once, and streamed out together, by /api/lineage.
+API_CHUNK=200
+#Number of lineages kept in the lineage cache of each worker, see /api/cache.
+CACHE_SIZE=200000
+
+#The taxonomy is loaded once per process (on the first request) and shared
+#read-only over the memory-mapped index, it is swapped when the dumps change.
+taxonomy_index=SharedIndex("taxonomy.idx", "names.dmp", "nodes.dmp", cache_size=CACHE_SIZE)
+
+#Upper bounds in seconds of the buckets of the latency histograms.
+LATENCY_BUCKETS=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+#Request header asking for the stage timings of the request.
+TRACE_HEADER='X-Taxa-Trace'
+#Directory shared by all worker processes (f.e. of gunicorn -w 4), set over the
+#environment. Every worker saves its metrics there at most once per
+#SNAPSHOT_INTERVAL seconds, and /metrics adds up the metrics of all workers.
+#Without it, /metrics only reports the worker that answers the scrape.
+METRICS_DIR=os.environ.get('TAXA_METRICS_DIR')
+SNAPSHOT_INTERVAL=1.0
+
+
+class Histogram:
+    """
+    Latency histogram in the Prometheus format, one series per label value
+    (f.e. per endpoint). Thread safe, the counters are kept per process (see
+    METRICS_DIR to add up the histograms of several worker processes).
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets=buckets
+        #label: [count per bucket, sum, count]
+        self._series=dict()
+        self._lock=threading.Lock()
+
+    def observe(self, label, seconds):
+        "Adds one duration to the series of label."
+        with self._lock:
+            series=self._series.setdefault(label, [[0]*len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if seconds<=bound:
+                    series[0][i]+=1
+                    break
+            series[1]+=seconds
+            series[2]+=1
+
+    def snapshot(self):
+        "Copy of the series, label: [count per bucket, sum, count]."
+        with self._lock:
+            return dict((label, [list(counts), total, count]) for label, (counts, total, count) in self._series.items())
+
+    def lines(self, name, label_name, description, series=None):
+        """
+        Returns the histogram in the Prometheus text format, as list of lines.
+        series (f.e. added up from snapshots of several workers) is written
+        instead of the counters of this histogram, if given.
+        """
+        lines=["# HELP {} {}".format(name, description), "# TYPE {} histogram".format(name)]
+        if series is None:
+            series=self.snapshot()
+        for label, (counts, total, count) in sorted(series.items()):
+            cumulative=0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative+=bucket
+                lines.append('{}_bucket{{{}="{}",le="{}"}} {}'.format(name, label_name, label, bound, cumulative))
+            lines.append('{}_bucket{{{}="{}",le="+Inf"}} {}'.format(name, label_name, label, count))
+            lines.append('{}_sum{{{}="{}"}} {}'.format(name, label_name, label, total))
+            lines.append('{}_count{{{}="{}"}} {}'.format(name, label_name, label, count))
+        return lines
+
+
+def add_series(snapshots):
+    "Adds up histogram snapshots of several processes, see Histogram.snapshot."
+    merged=dict()
+    for series in snapshots:
+        for label, (counts, total, count) in series.items():
+            if label not in merged:
+                merged[label]=[list(counts), total, count]
+                continue
+            target=merged[label]
+            target[0]=[a+b for a, b in zip(target[0], counts)]
+            target[1]+=total
+            target[2]+=count
+    return merged
+
+
+#Latencies of whole requests (per endpoint) and of their stages (per stage).
+request_latency=Histogram()
+stage_latency=Histogram()
+
+
+@contextmanager
+def stage(name):
+    """
+    Times the enclosed stage of the current request. The duration is added to
+    the stage histogram, and to the timings of the request (g.timings).
+    """
+    start=time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed=time.perf_counter()-start
+        stage_latency.observe(name, elapsed)
+        if has_request_context():
+            timings=g.setdefault('timings', dict())
+            timings[name]=timings.get(name, 0.0)+elapsed
+
+
+def process_metrics():
+    "Metrics of this process, as saved in METRICS_DIR."
+    snapshot={"pid": os.getpid(), "requests": request_latency.snapshot(), "stages": stage_latency.snapshot(),
+              "memory": resident_memory(), "cache": None, "index": None}
+    #The index is not loaded just to report on it.
+    if taxonomy_index.loaded:
+        snapshot["cache"]=taxonomy_index.get().cache.stats()
+        snapshot["index"]={"load_seconds": taxonomy_index.load_seconds, "loads": taxonomy_index.loads}
+    return snapshot
+
+
+#When this process last saved its metrics.
+_saved_at=0.0
+
+
+def save_metrics(force=False):
+    """
+    Saves the metrics of this process to METRICS_DIR/<pid>.json (written
+    aside and renamed, so a scrape never reads half a file), at most once
+    per SNAPSHOT_INTERVAL unless forced.
+    """
+    global _saved_at
+    now=time.monotonic()
+    if not METRICS_DIR or (not force and now-_saved_at<SNAPSHOT_INTERVAL):
+        return
+    _saved_at=now
+    path=os.path.join(METRICS_DIR, "{}.json".format(os.getpid()))
+    try:
+        with open(path+".tmp", 'w') as out:
+            json.dump(process_metrics(), out)
+        os.replace(path+".tmp", path)
+    except OSError:
+        pass
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def collect_metrics():
+    """
+    Metrics of all worker processes: the saved metrics in METRICS_DIR (this
+    worker saved first), or only this process without METRICS_DIR. Workers
+    that exited still count for the counters and histograms, their gauges
+    are left out.
+    """
+    if not METRICS_DIR:
+        return [process_metrics()]
+    save_metrics(force=True)
+    snapshots=[]
+    for file_name in sorted(os.listdir(METRICS_DIR)):
+        if not file_name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, file_name), 'r') as saved:
+                snapshot=json.load(saved)
+        except (OSError, ValueError):
+            continue
+        snapshot["running"]=_running(snapshot["pid"])
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def resident_memory():
+    "Resident memory of this process in bytes, None where /proc is missing."
+    try:
+        with open("/proc/self/statm", 'r') as statm:
+            return int(statm.read().split()[1])*os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def request_index():
+    """
+    Index used by the current request: acquired on first use and released
+    when the request ends, so a swap meanwhile does not close it under the
+    request. Streamed responses take it over with stream_index.
+    """
+    if 'index' not in g:
+        g.index=taxonomy_index.acquire()
+    return g.index
+
+
+def stream_index(response):
+    """
+    Hands the index of the request over to a streamed response, which
+    releases it when it is closed after the last line. The teardown of the
+    request already runs when the view returns, before anything is streamed.
+    """
+    index=g.pop('index', None)
+    if index is not None:
+        response.call_on_close(lambda: taxonomy_index.release(index))
+    return response
+
+
+@app.teardown_request
+def release_index(error=None):
+    "Releases the index of the request, see request_index."
+    index=g.pop('index', None)
+    if index is not None:
+        taxonomy_index.release(index)
+
+
+@app.before_request
+def start_timer():
+    "Starts the timer and the stage timings of a request."
+    g.start=time.perf_counter()
+    g.timings=dict()
+
+
+@app.after_request
+def record_timings(response):
+    "Records the request latency, and returns the stage timings if traced."
+    elapsed=time.perf_counter()-g.get('start', time.perf_counter())
+    request_latency.observe(request.endpoint or "unknown", elapsed)
+    save_metrics()
+    if request.headers.get(TRACE_HEADER, "").lower() in ("1", "true", "yes"):
+        timings=g.get('timings', dict())
+        response.headers['Server-Timing']=", ".join(
+            "{};dur={:.3f}".format(name, seconds*1000) for name, seconds in list(timings.items())+[("total", elapsed)])
+        app.logger.info(json.dumps({"trace": request.path, "endpoint": request.endpoint, "total": elapsed,
+                                    "stages": timings}))
+    return response
+
 
 #Link html file
 @app.route('/')
@@ -58,42 +351,200 @@ def taxa():
 #main function
 def show_lineage():
     "Returns a string with the results from all functions/queries."
-    query=request.form['query']
-    query=query.split(",")
-    #if the abbreviated sequence box is ticked
-    if request.form.get('short-sequence')=="1":
-        #set the flag accordingly
-        short=True
-    else:
-        short=False
+    with stage("parse"):
+        query=request.form['query']
+        query=query.split(",")
+        #if the abbreviated sequence box is ticked
+        if request.form.get('short-sequence')=="1":
+            #set the flag accordingly
+            short=True
+        else:
+            short=False
     result=""
+    #The same index is used for the whole request, even if it is swapped meanwhile.
+    #Loading (or building) the index on the first request is timed as its own stage.
+    with stage("index"):
+        index=request_index()
     #Retrieve lineage for all queries
     taxonomy=dict()
     for q in query:
-        lineage=find_lineage(q.strip(" "), short)
+        lineage=find_lineage(q.strip(" "), short, index)
         if lineage.startswith("The query"):
             result+=lineage
         else:
             result+="The lineage for query <i>{}</i> is: {}</br></br>".format(q, lineage)
-        taxonomy[q]=lineage
+            with stage("match"):
+                #Names shared by several taxa are reported, the preferred one is used.
+                matches=index.lookup(q)
+                if len(matches)>1:
+                    others=["{} ({}, taxid {})".format(index.name(taxid), name_class, taxid) for taxid, name_class in matches[1:]]
+                    result+="<i>{}</i> is ambiguous, it also matches: {}.</br></br>".format(q, "; ".join(others))
+                if is_taxid(q.strip(" ")):
+                    taxid, status=index.redirect(int(q.strip(" ")))
+                    if status=="merged":
+                        result+="Taxid <i>{}</i> has been merged into taxid {} ({}).</br></br>".format(q, taxid, index.name(taxid))
+        with stage("match"):
+            taxonomy[q]=index.resolve(q.strip(" "))
     #If last common node is asked for
     if request.form.get('find-last-common-node')=="1":
-        last_node=Find_common(taxonomy)
+        with stage("common"):
+            last_node=Find_common(taxonomy, index, short)
         if last_node==None:
             result+="</br> Cannot determine last node for a single query."
         else:
             result+="</br>The last common node between queries <i>{}</i> is: {}.".format(','.join(query), last_node)
     #Return all the results
-    return render_template('Taxa_Finder_Out_v04.html', result=result)
+    with stage("render"):
+        return render_template('Taxa_Finder_Out_v04.html', result=result)
+
+@app.route('/suggest')
+def suggest():
+    """
+    Autocompletion for the query box: returns the top k names (of any class)
+    starting with the text given in q, as json.
+    """
+    prefix=request.args.get('q', "")
+    k=max(1, min(request.args.get('k', 10, type=int), 50))
+    return jsonify(query=prefix, suggestions=request_index().suggest(prefix, k))
 
-def Find_common(taxonomy):
+@app.route('/api/lineage', methods=['POST'])
+def api_lineage():
+    """
+    Json batch endpoint for pipelines. Expects a json object with
+
+        queries: list of names and/or taxids
+        short: bool, optional, leave out nodes flagged as hidden
+        common: bool, optional, also return the last common node
+
+    and returns for every query its taxid, rank, name and lineage (one object
+    with taxid, rank and name per node, from below the root down to the query
+    itself), plus the last common node if asked for. With ?stream=1 (or
+    Accept: application/x-ndjson) the results are streamed as one json object
+    per line (ndjson), chunk by chunk, the last common node being the last line.
+    Queries that are neither a name nor a taxid (f.e. true, null or a list)
+    get the status "invalid".
+    """
+    payload=request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('queries'), list):
+        return jsonify(error="Expected a json object with a list of queries."), 400
+    queries=payload['queries']
+    if len(queries)>MAX_QUERIES:
+        return jsonify(error="At most {} queries per request.".format(MAX_QUERIES)), 413
+    short=bool(payload.get('short', False))
+    common=bool(payload.get('common', False))
+    #The same index is used for the whole request, even if it is swapped meanwhile.
+    index=request_index()
+
+    def results():
+        "Yields one result per query, then the last common node if asked for."
+        taxids=[]
+        for start in range(0, len(queries), API_CHUNK):
+            chunk=queries[start:start+API_CHUNK]
+            #Only names and taxids are queries; json true/false are ints to python, and true would be taxid 1.
+            valid=[isinstance(q, (int, str)) and not isinstance(q, bool) for q in chunk]
+            resolved=[index.resolve(q) if ok else None for q, ok in zip(chunk, valid)]
+            for q, ok, taxid in zip(chunk, valid, resolved):
+                if not ok:
+                    yield {"query": q, "status": "invalid"}
+                    continue
+                #Taxids of merged.dmp are resolved to their new taxid, and flagged.
+                status=None
+                if isinstance(q, int) or (isinstance(q, str) and is_taxid(q.strip())):
+                    status=index.redirect(int(q))[1]
+                if taxid is None:
+                    yield {"query": q, "status": status or "not found"}
+                    continue
+                taxids.append(taxid)
+                lineage=[{"taxid": ID, "rank": index.rank_of(ID), "name": index.name(ID)}
+                         for ID in index.cache.lineage(taxid, short)]
+                yield {"query": q, "status": status or "ok", "taxid": taxid, "rank": index.rank_of(taxid),
+                       "name": index.name(taxid), "lineage": lineage}
+        if common:
+            last_node=index.lca_many(taxids) if len(taxids)>1 else None
+            if last_node is not None and short:
+                while last_node>1 and index.hidden[last_node]==1:
+                    last_node=index.parent[last_node]
+            if last_node is None:
+                yield {"lca": None}
+            else:
+                yield {"lca": {"taxid": last_node, "rank": index.rank_of(last_node), "name": index.name(last_node)}}
+
+    if request.args.get('stream')=="1" or request.accept_mimetypes.best=="application/x-ndjson":
+        lines=(json.dumps(result)+"\n" for result in results())
+        return stream_index(Response(stream_with_context(lines), mimetype="application/x-ndjson"))
+    response={"results": []}
+    for result in results():
+        if "lca" in result:
+            response["lca"]=result["lca"]
+        else:
+            response["results"].append(result)
+    return jsonify(response)
+
+@app.route('/api/cache')
+def api_cache():
+    """
+    Hit, miss and eviction counters of the lineage cache of this worker, to
+    size CACHE_SIZE for the traffic of the server.
+    """
+    return jsonify(taxonomy_index.get().cache.stats())
+
+@app.route('/metrics')
+def metrics():
+    """
+    Metrics in the Prometheus text format: latency histograms per endpoint
+    and per stage, counters of the lineage cache, duration of the last index
+    load and resident memory. They are kept per worker process: with several
+    workers, set TAXA_METRICS_DIR to a directory shared by the workers, then
+    counters and histograms are added up over all workers (saved at most
+    SNAPSHOT_INTERVAL seconds ago) and gauges are reported per worker (pid
+    label). Otherwise a scrape only reports the worker that answered it.
+    """
+    snapshots=collect_metrics()
+    lines=request_latency.lines("taxa_request_duration_seconds", "endpoint", "Latency of requests per endpoint.",
+                                add_series(snapshot["requests"] for snapshot in snapshots))
+    lines+=stage_latency.lines("taxa_stage_duration_seconds", "stage", "Time spent per stage of the requests.",
+                               add_series(snapshot["stages"] for snapshot in snapshots))
+    loaded=[snapshot for snapshot in snapshots if snapshot["cache"] is not None]
+    if loaded:
+        for key in ("hits", "misses", "evictions"):
+            lines+=["# TYPE taxa_lineage_cache_{}_total counter".format(key),
+                    "taxa_lineage_cache_{}_total {}".format(key, sum(snapshot["cache"][key] for snapshot in loaded))]
+        lines+=["# TYPE taxa_index_loads_total counter",
+                "taxa_index_loads_total {}".format(sum(snapshot["index"]["loads"] for snapshot in loaded))]
+    #Gauges of every running worker, labelled by pid when several are collected.
+    gauges=[("taxa_lineage_cache_size", None, lambda snapshot: snapshot["cache"] and snapshot["cache"]["size"]),
+            ("taxa_lineage_cache_capacity", None, lambda snapshot: snapshot["cache"] and snapshot["cache"]["capacity"]),
+            ("taxa_index_load_seconds", "Duration of the last load (or build) of the index.",
+             lambda snapshot: snapshot["index"] and snapshot["index"]["load_seconds"]),
+            ("process_resident_memory_bytes", None, lambda snapshot: snapshot["memory"])]
+    running=[snapshot for snapshot in snapshots if snapshot.get("running", True)]
+    for name, description, value in gauges:
+        values=[(snapshot["pid"], value(snapshot)) for snapshot in running if value(snapshot) is not None]
+        if not values:
+            continue
+        if description:
+            lines.append("# HELP {} {}".format(name, description))
+        lines.append("# TYPE {} gauge".format(name))
+        if METRICS_DIR:
+            lines+=['{}{{pid="{}"}} {}'.format(name, pid, number) for pid, number in values]
+        else:
+            lines.append("{} {}".format(name, values[0][1]))
+    return Response("\n".join(lines)+"\n", mimetype="text/plain; version=0.0.4")
+
+def Find_common(taxonomy, index, short=False):
     """
     Finds the last common node in the taxonomic tree for all input queries.
+    The comparison is done on taxids with the lca engine of the index, so
+    queries with the same display name in their lineages do not get mixed up.
 
     Parameters
     ----------
     taxonomy : dictionary
-        contains queries as keys and lineage as values (list).
+        contains queries as keys and taxids as values (None if not found).
+    index : TaxonomyIndex
+        loaded taxonomy.
+    short : bool
+        the last common node has to be visible in the shortened lineage.
 
     Returns
     -------
@@ -102,29 +553,18 @@ def Find_common(taxonomy):
     """
     #If one of the lineages could not be found:
     for key in taxonomy:
-        if taxonomy[key].startswith("The query"):
+        if taxonomy[key] is None:
             return("No last node has been searched for, as one of the queries could not be found.")
-    #Need taxonomy values to be lists:
-    for key in taxonomy:
-        taxonomy[key]=taxonomy[key].split(",")
-    #Change values of taxonomy dictionary to sets
-    taxonomy_set=dict()
-    for key in taxonomy:
-        taxonomy_set[key]=set(taxonomy[key])  
-    
-    values=list(taxonomy_set.values())
-    #intersection between sets allows unknown number of queries.
-    intersection=list(set.intersection(*values))
-    #But it changes the order, so we need to go through one query to find "last"
-    for element in taxonomy[list(taxonomy.keys())[0]]:
-        #If the element is in the intersection, we update last node
-        if element in intersection:
-            last_node=element
-        #If it is not, then the previous element was the last node.
-        else:
-            return(last_node)  
+    #A single query has no common node.
+    if len(taxonomy)<2:
+        return(None)
+    last_node=index.lca_many(list(taxonomy.values()))
+    if short==True:
+        while last_node>1 and index.hidden[last_node]==1:
+            last_node=index.parent[last_node]
+    return(index.name(last_node))
 
-def find_lineage(query, short):
+def find_lineage(query, short, index):
     """
     Finds the taxonomic lineage corresponding to a query.
 
@@ -132,6 +572,10 @@ def find_lineage(query, short):
     ----------
     query : string
         f.e. Human, Homo Sapiens, Mammalia etc.
+    short : bool
+        only include entries not flagged as hidden.
+    index : TaxonomyIndex
+        loaded taxonomy.
 
     Returns
     -------
@@ -139,84 +583,39 @@ def find_lineage(query, short):
         taxonomic lineage leading from root to query.
 
     """
-    "a. Find Query ID in names.dmp"
-    #Initialize dictionary containing scientific names and corresponding ID
-    names_dic=dict()
-
-    with open("names.dmp", 'r') as names:
-        for entry in names:
-            #find query
-            any_name=entry.split("\t|\t")[1]
-            if any_name.upper().strip(" ")==query.upper().strip(" "):
-                query_ID =entry.split("\t|\t")[0].strip(" ")
-            #make name dictionary:
-            #make sure to only use names flagged as scientific.
-            if entry.split("\t|\t")[3][0:15]=="scientific name":  
-                names_dic[entry.split("\t|\t")[0]]=entry.split("\t|\t")[1]            
+    "a. Find Query ID in the name table of the index."
+    #Taxids are accepted too, merged taxids are redirected to their new taxid.
+    with stage("match"):
+        query_ID=index.resolve(query)
 
     #If the query is not found in the file
-    try: query_ID
-    except NameError: query_ID=None
-
     if query_ID is None:
-        return("The query <i>{}</i> could not be found. Please check your spelling or try with a different query. When using an informal name, it can help to use the scientific name instead.".format(query))
+        if is_taxid(query) and index.redirect(int(query))[1]=="deleted":
+            return("The query <i>{}</i> is a taxid that has been deleted from the ncbi taxonomy.</br></br>".format(query))
+        message="The query <i>{}</i> could not be found. Please check your spelling or try with a different query. When using an informal name, it can help to use the scientific name instead.".format(query)
+        #Close names from the trigram index of the taxonomy.
+        with stage("fuzzy"):
+            candidates=["<i>{}</i> ({})".format(c["name"], c["scientific_name"]) for c in index.fuzzy(query)]
+        if candidates:
+            message+=" Did you mean: {}?".format(", ".join(candidates))
+        return(message+"</br></br>")
     
-    "b. Find Id in nodes.dmp, trace the path over parent ID back to root."
-
-    #For additional information, s.a. rank or whether its included in shortened lineage.
-    nodes_info=dict()
-    #For ID/parent ID pairs.
-    nodes_path=dict()
-
-    #save nodes.dmp as dictionary
-    with open("nodes.dmp",'r') as nodes:
-        for entry in nodes:
-            ID=entry.strip(" ").split("\t|\t")[0]
-            parent_ID=entry.strip(" ").split("\t|\t")[1]
-            rank=entry.strip(" ").split("\t|\t")[2]
-            hidden_flag=entry.strip(" ").split("\t|\t")[10]
-            nodes_info[ID]=[rank, hidden_flag]
-            nodes_path[ID]=parent_ID
-            
-    #Find query ID, make path:
-    root_found=False
-    path=[]
-    current_ID=query_ID
-    while root_found==False:
-        for ID in nodes_path:
-            if current_ID==ID:
-                #append the parent ID to path
-                parent_ID=nodes_path[current_ID]
-                #update current_ID
-                current_ID=parent_ID
-                if current_ID=="1":
-                    root_found=True
-                    break
-                #If we are not at the root, append parent ID to path.
-                path.append(parent_ID)
-                
-    "c. Assemble Output."
+    "b. Trace the path from the parent of the query ID back to root."
+    #The lineage cache of the index reuses the cached lineage of the first
+    #cached ancestor, so siblings of earlier queries only need a step or two.
+    #With short, nodes flagged as hidden are already left out.
+    with stage("path"):
+        path=index.cache.lineage(index.parent[query_ID], short)
 
-    lineage=""
-    #right now the path goes from query back to root, we want the output reversed.
-    for ID in reversed(path):
-        #check if we want shortened path or the entire path:
-        if short==True:
-            #for the shortened path, we exclude the hidden_flags=1
-            if path.index(ID)==0:
-                if nodes_info[ID][1]=='0':
-                    lineage+="{}.".format(names_dic[ID])
-                    break
-            if nodes_info[ID][1]=='0':
-                lineage+="{}, ".format(names_dic[ID])
-        #for the full path, we do not need to sort by hidden flags.
-        else:
-            if path.index(ID)==0:
-                lineage+="{}.".format(names_dic[ID])
-                break
-            else:
-                lineage+="{}, ".format(names_dic[ID])
+    "c. Assemble Output."
+    #The path goes from below the root to the parent of the query.
+    with stage("assemble"):
+        lineage=", ".join(index.name(ID) for ID in path)
+        if lineage:
+            lineage+="."
     return(lineage)
 
 if __name__== '__main__':
+	#Load before serving, so the first request does not wait for it.
+	taxonomy_index.get()
 	app.run()
\ No newline at end of file
@@ -0,0 +1,2080 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Title: Taxa_Index.py
+Date: 2026-10-18
+Author: Mirjam Karlsson-Müller
+
+Description: Compiles the ncbi taxonomy files names.dmp and nodes.dmp once into
+a compact binary index, which Taxa_Finder.py and Taxa_Finder_web.py memory-map
+instead of parsing the dump files for every query.
+
+
+List of functions:
+    build_index: Parses names.dmp and nodes.dmp and writes the index file.
+    update_index: Applies new dump files to an index, recomputing only changes.
+    load_index: Memory-maps an index file and returns a TaxonomyIndex.
+    open_index: Loads the index, (re)building it first if missing or stale.
+    dump_fingerprint: Size and modification time of a dump file.
+
+List of classes:
+    TaxonomyIndex: Read-only view of the arrays stored in the index.
+    LineageCache: LRU cache of resolved lineages, reusing cached ancestors.
+    SharedIndex: Loads an index once per process and hot-swaps it on changes.
+    StaleIndexError: Raised when the index does not match the dump files.
+
+Procedure:
+    0. Both dump files are split into byte ranges ending at line boundaries,
+    which are parsed in parallel by a pool of worker processes. The partial
+    arrays (and the sorted partial name tables) are merged afterwards, in the
+    main process. The trigrams of the names are also indexed by the workers,
+    in runs that are concatenated per trigram. The tree arrays (depths, binary
+    lifting table, pre-order labels) are computed in the main process, as
+    whole-array numpy operations when numpy is installed. The
+    dump files can also be streamed out of taxdump.tar.gz (decompressed by
+    pigz if installed), without extracting them: the decompressed stream is
+    cut into blocks of whole lines, which are handed to the same workers.
+    1. nodes.dmp is read once, every row is split once. Parent ID, rank and
+    hidden flag are stored in arrays indexed by taxid, so the parent of taxid t
+    is simply parent[t]. Ranks are stored as small integer codes. The depth of
+    every taxid and a binary lifting table (the 2**k-th ancestor of every taxid)
+    are computed as well, for last common ancestor queries.
+    2. names.dmp is read once. The scientific names are written into one name
+    blob in taxid order, name_off[t] points to the start of the name of t.
+    Every name (scientific, common, synonym, ...) is also added to a name table
+    sorted by normalized name (case-insensitive, whitespace collapsed) and then
+    by name class, used to look up the taxid of a query by binary search. Names
+    shared by several taxids are kept, so ambiguous queries can be reported, and
+    all names starting with a prefix form one contiguous run of the table,
+    which is used for autocompletion. For approximate matching, the trigrams
+    of all scientific and common names are indexed as well (trigram code ->
+    sorted list of name table entries).
+    1b. Every taxid is also numbered in depth-first pre-order (pre), together
+    with the last number of its subtree (end) and the inverse array (order).
+    taxid a lies below b if pre[b]<=pre[a]<=end[b], and the subtree of b is the
+    run order[pre[b]+1:end[b]+1].
+    2b. merged.dmp and delnodes.dmp (if present) are stored as taxid indexed
+    arrays as well: merged[t] is the taxid t was merged into, deleted[t] flags
+    deleted taxids. Old taxids are therefore redirected in O(1).
+    2c. update_index applies a new taxdump to an existing index: taxids that
+    were added, removed or moved to another parent are found by comparing the
+    parent arrays, and only their depths and binary lifting entries (and those
+    of the taxids below them, found as pre-order ranges of the old index) are
+    recomputed. The pre-order labels are renumbered. Names already in the trigram
+    index keep their trigrams, only new names are split. The result is the
+    same file build_index would write.
+    3. The file starts with a small json header containing the format version,
+    a fingerprint (size, modification time and crc32) of both dump files and
+    the position of every array. The arrays follow, each aligned to 8 bytes.
+    4. Loading maps the file read-only, the arrays are zero-copy memoryviews
+    into the mapping. Startup is therefore near-instant and the pages are shared
+    through the OS page cache between all processes using the same index.
+
+
+Usage:
+    Build the index once (Taxa_Finder.py also does this automatically when the
+    index is missing or stale):
+
+    python Taxa_Finder.py --build-index
+
+    From python:
+        index=open_index("taxonomy.idx", "names.dmp", "nodes.dmp")
+        taxid=index.find("Human")
+        index.name(index.parent[taxid])
+        index.lookup("Cat")
+        index.resolve("9606")
+        index.redirect(12345)
+        index.suggest("hom", k=10)
+        index.fuzzy("Homo sapeins", k=5)
+        index.ancestors(taxid)
+        index.cache.lineage(taxid, short=True)
+        index.ancestors_batch([9606, 9685])
+        index.lca(9606, 9685)
+        index.lca_many([9606, 9685, 9031])
+        index.is_descendant(9606, 40674)
+        index.descendants(index.find("Aves"))
+        for taxid, lca_row, distance_row in index.lca_matrix([9606, 9685, 9031]):
+            ...
+
+    Build it straight from the downloaded archive:
+        build_index(None, None, "taxonomy.idx", taxdump_file="taxdump.tar.gz")
+
+    Apply a new taxdump to an existing index:
+        update_index("taxonomy.idx", "names.dmp", "nodes.dmp", "merged.dmp", "delnodes.dmp")
+
+Possible Bugs:
+    1. numpy is optional. Without it ancestors_batch, lca_matrix and the tree
+       arrays of a build fall back to pure python loops over the same arrays.
+    2. The index uses the native byte order, it cannot be copied between
+       machines of different endianness (it is detected and rebuilt).
+    3. Staleness is detected over size and modification time of the dump files,
+       use load_index(..., verify=True) to also compare the crc32 checksums.
+
+"""
+
+import bisect
+import heapq
+import json
+import mmap
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+import zlib
+from array import array
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import accumulate
+
+#numpy is optional, it speeds up ancestors_batch, lca_matrix, update_index and the tree arrays of a build.
+try:
+    import numpy
+except ImportError:
+    numpy=None
+
+
+#File layout: magic, format version, length of the json header, json header.
+MAGIC=b"TAXAIDX\0"
+FORMAT_VERSION=6
+_PREFIX=struct.Struct("<8sII")
+#Sections are aligned so the casted memoryviews never straddle words.
+_ALIGN=8
+#Size of the blocks a streamed dump file is parsed in.
+_BLOCK=8 << 20
+
+#Name classes of names.dmp, in order of preference when a name matches
+#several taxids. Classes not listed here are ranked after these.
+NAME_CLASSES=["scientific name", "genbank common name", "common name", "equivalent name",
+              "genbank synonym", "synonym", "includes", "genbank acronym", "acronym",
+              "blast name", "in-part", "type material", "authority"]
+
+
+class StaleIndexError(Exception):
+    "Raised when an index file is outdated or was built from other dump files."
+
+
+def dump_fingerprint(path):
+    """
+    Returns size and modification time of a dump file.
+
+    Parameters
+    ----------
+    path : string
+        path to names.dmp or nodes.dmp.
+
+    Returns
+    -------
+    list
+        [size in bytes, modification time in ns].
+
+    """
+    stat=os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def normalize_name(name):
+    """
+    Returns the form under which names are looked up: case-insensitive, with
+    surrounding spaces removed and inner runs of whitespace collapsed.
+    """
+    return " ".join(name.split()).casefold()
+
+
+def is_taxid(text):
+    """
+    Whether a query is a taxid: ASCII digits only. str.isdigit alone also
+    accepts digits like "²", which int() rejects.
+    """
+    return text.isascii() and text.isdigit()
+
+
+def _trigram_codes(key):
+    """
+    Trigrams of a normalized name, padded so that the beginning and the end
+    of the name count as well, as 32 bit codes.
+    """
+    padded="  "+key+" "
+    return set(zlib.crc32(padded[j:j+3].encode("utf-8")) for j in range(len(padded)-2))
+
+
+def _edit_distance(a, b):
+    "Levenshtein distance between two strings."
+    if len(a)<len(b):
+        a, b=b, a
+    previous=list(range(len(b)+1))
+    for i, char_a in enumerate(a, 1):
+        current=[i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j]+1, current[j-1]+1, previous[j-1]+(char_a!=char_b)))
+        previous=current
+    return previous[-1]
+
+
+def _crc32(path):
+    "crc32 of a whole file, read in blocks."
+    crc=0
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(1 << 20), b""):
+            crc=zlib.crc32(block, crc)
+    return crc
+
+
+def _chunks(path, count):
+    """
+    Splits a file into count byte ranges, each ending at a line boundary.
+
+    Returns
+    -------
+    list
+        (path, start, end) tuples covering the whole file.
+
+    """
+    size=os.path.getsize(path)
+    bounds=[0]
+    with open(path, 'rb') as handle:
+        for i in range(1, count):
+            handle.seek(max(size*i//count, bounds[-1]))
+            #Move on to the start of the next line.
+            handle.readline()
+            bounds.append(min(handle.tell(), size))
+    bounds.append(size)
+    return [(path, start, end) for start, end in zip(bounds, bounds[1:]) if end>start]
+
+
+def _read_lines(chunk):
+    """
+    Lines of a (path, start, end) byte range, or of a block of whole lines
+    (bytes) read from a stream.
+    """
+    if isinstance(chunk, bytes):
+        data=chunk
+    else:
+        path, start, end=chunk
+        with open(path, 'rb') as handle:
+            handle.seek(start)
+            data=handle.read(end-start)
+    lines=data.decode("utf-8").split("\n")
+    if lines and not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def _parse_nodes_chunk(chunk):
+    """
+    Parses a byte range (or block) of nodes.dmp, every row is split once.
+
+    Returns
+    -------
+    taxids, parents, ranks, hidden : arrays
+        one entry per row, ranks as codes into rank_names.
+    rank_names : list
+        ranks found in this chunk.
+
+    """
+    rank_codes=dict()
+    rank_names=[]
+    taxids=array('I')
+    parents=array('I')
+    ranks=array('B')
+    hidden=array('B')
+    for entry in _read_lines(chunk):
+        fields=entry.split("\t|\t")
+        rank=fields[2]
+        if rank not in rank_codes:
+            rank_codes[rank]=len(rank_names)
+            rank_names.append(rank)
+        taxids.append(int(fields[0]))
+        parents.append(int(fields[1]))
+        ranks.append(rank_codes[rank])
+        hidden.append(fields[10]=="1")
+    return taxids, parents, ranks, hidden, rank_names
+
+
+def _parse_names_chunk(chunk):
+    """
+    Parses a byte range (or block) of names.dmp, every row is split once.
+
+    Returns
+    -------
+    lookup : list
+        (normalized name, class code, taxid, utf-8 encoded name) tuples,
+        sorted. Names are encoded here, in the worker, not in the merge.
+    name_classes : list
+        name classes of the codes, NAME_CLASSES followed by unknown ones.
+    scientific : list
+        (taxid, utf-8 encoded scientific name) tuples.
+
+    """
+    class_codes=dict((name_class, code) for code, name_class in enumerate(NAME_CLASSES))
+    name_classes=list(NAME_CLASSES)
+    scientific=[]
+    lookup=[]
+    for entry in _read_lines(chunk):
+        fields=entry.split("\t|\t")
+        taxid=int(fields[0])
+        name_class=fields[3].rstrip("\t|")
+        if name_class not in class_codes:
+            class_codes[name_class]=len(name_classes)
+            name_classes.append(name_class)
+        name=fields[1].encode("utf-8")
+        lookup.append((normalize_name(fields[1]), class_codes[name_class], taxid, name))
+        if name_class=="scientific name":
+            scientific.append((taxid, name))
+    lookup.sort()
+    return lookup, name_classes, scientific
+
+
+def _map_chunks(function, path, workers):
+    """
+    Parses a dump file in byte ranges with function, in a process pool when
+    more than one worker is used. Results are returned in file order.
+    """
+    #Small files are not worth starting processes for.
+    if workers<=1 or os.path.getsize(path)<(8 << 20):
+        return [function(chunk) for chunk in _chunks(path, 1)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(function, _chunks(path, 4*workers)))
+
+
+def _blocks(stream, size=_BLOCK):
+    "Reads a binary stream in blocks of about size bytes, ending at line boundaries."
+    rest=b""
+    for block in iter(lambda: stream.read(size), b""):
+        block=rest+block
+        end=block.rfind(b"\n")+1
+        if end==0:
+            rest=block
+            continue
+        rest=block[end:]
+        yield block[:end]
+    if rest:
+        yield rest
+
+
+def _map_blocks(function, stream, workers):
+    """
+    Parses a dump file read from a stream (f.e. a member of a compressed
+    archive) block by block with function, in a process pool when more than
+    one worker is used. At most 2*workers blocks are in flight, so the
+    decompressed file is never held in memory as a whole. Results are
+    returned in file order.
+    """
+    if workers<=1:
+        return [function(block) for block in _blocks(stream)]
+    results=[]
+    pending=deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for block in _blocks(stream):
+            if len(pending)>=2*workers:
+                results.append(pending.popleft().result())
+            pending.append(pool.submit(function, block))
+        results.extend(future.result() for future in pending)
+    return results
+
+
+def _merge_nodes(parts):
+    """
+    Merges the parsed chunks of nodes.dmp into taxid indexed arrays.
+
+    Returns
+    -------
+    parent, rank, hidden : arrays
+        indexed by taxid, 0 in parent means the taxid does not exist.
+    rank_names : list
+        rank_names[code] is the rank as written in nodes.dmp.
+
+    """
+    max_taxid=max([max(taxids) for taxids, parents, ranks, hidden, names in parts if taxids]+[1])
+
+    rank_codes=dict()
+    rank_names=[]
+    parent=array('I', bytes(4*(max_taxid+1)))
+    rank=array('B', bytes(max_taxid+1))
+    hidden=array('B', bytes(max_taxid+1))
+    for taxids, parents, ranks, hidden_flags, names in parts:
+        #Chunk rank codes to global rank codes.
+        for name in names:
+            if name not in rank_codes:
+                rank_codes[name]=len(rank_names)
+                rank_names.append(name)
+        recode=[rank_codes[name] for name in names]
+        for taxid, parent_ID, rank_code, hidden_flag in zip(taxids, parents, ranks, hidden_flags):
+            parent[taxid]=parent_ID
+            rank[taxid]=recode[rank_code]
+            hidden[taxid]=hidden_flag
+    return parent, rank, hidden, rank_names
+
+
+def _merge_names(parts, max_taxid):
+    """
+    Merges the parsed (and sorted) chunks of names.dmp into the scientific
+    name blob and the sorted name table.
+
+    Returns
+    -------
+    name_off, names : arrays
+        scientific name of t is names[name_off[t]:name_off[t+1]].
+    key_off, keys, key_taxid, key_class : arrays
+        names of all classes, sorted by normalized name and then by class
+        preference, with their taxids and name class codes.
+    name_classes : list
+        name_classes[code] is the name class as written in names.dmp.
+    fuzzy_entries : list
+        (entry number, normalized name) of the names for the trigram index.
+
+    """
+    name_classes=list(NAME_CLASSES)
+    scientific=dict()
+    lookups=[]
+    for lookup, classes, names in parts:
+        #Classes unknown to NAME_CLASSES get global codes, the chunk is resorted.
+        if len(classes)>len(NAME_CLASSES):
+            for name_class in classes[len(NAME_CLASSES):]:
+                if name_class not in name_classes:
+                    name_classes.append(name_class)
+            recode=[name_classes.index(name_class) for name_class in classes]
+            lookup=sorted((key, recode[code], taxid, name) for key, code, taxid, name in lookup)
+        lookups.append(lookup)
+        scientific.update(names)
+
+    #name_off is the running sum of the name lengths in taxid order.
+    lengths=array('Q', bytes(8*(max_taxid+2)))
+    for taxid, name in scientific.items():
+        if taxid<=max_taxid:
+            lengths[taxid+1]=len(name)
+    name_off=array('Q', accumulate(lengths))
+    blob=bytearray(b"".join(scientific[taxid] for taxid in sorted(scientific) if taxid<=max_taxid))
+
+    #The same name can be listed for a taxid under several classes (or in
+    #several chunks), the most preferred one is kept. Duplicates can only be
+    #in the run of one normalized name, seen only holds the taxids of that run.
+    seen=set()
+    taxids=[]
+    codes=[]
+    names=[]
+    #First entry of every normalized name, if it is a scientific or common
+    #name, which are the names worth suggesting for misspelled queries.
+    fuzzy_entries=[]
+    common=NAME_CLASSES.index("common name")
+    previous=None
+    #A single chunk is already sorted.
+    merged=lookups[0] if len(lookups)==1 else heapq.merge(*lookups)
+    for key, code, taxid, name in merged:
+        if key!=previous:
+            seen=set()
+            if code<=common:
+                fuzzy_entries.append((len(taxids), key))
+            previous=key
+        elif taxid in seen:
+            continue
+        seen.add(taxid)
+        taxids.append(taxid)
+        codes.append(code)
+        names.append(name)
+    key_off=array('Q', [0])
+    key_off.extend(accumulate(map(len, names)))
+    key_taxid=array('I', taxids)
+    key_class=array('B', codes)
+    keys=bytearray(b"".join(names))
+    return name_off, blob, key_off, keys, key_taxid, key_class, name_classes, fuzzy_entries
+
+
+def _trigram_chunk(entries):
+    """
+    Trigram postings of a contiguous run of name table entries.
+
+    Parameters
+    ----------
+    entries : list
+        (entry number, normalized name) tuples, by increasing entry number.
+
+    Returns
+    -------
+    postings : dictionary
+        trigram code as key, array of entry numbers as value.
+
+    """
+    postings=defaultdict(lambda: array('I'))
+    for i, key in entries:
+        for code in _trigram_codes(key):
+            postings[code].append(i)
+    return dict(postings)
+
+
+def _trigram_run(entries):
+    """
+    Trigram index of a contiguous run of name table entries, in the layout of
+    the final index (see _trigram_index), built in a worker process.
+    """
+    postings=_trigram_chunk(entries)
+    tri_code=array('I', sorted(postings))
+    tri_off=array('Q', [0])
+    tri_off.extend(accumulate(len(postings[code]) for code in tri_code))
+    tri_post=array('I')
+    for code in tri_code:
+        tri_post.extend(postings[code])
+    return tri_code, tri_off, tri_post
+
+
+def _merge_trigram_runs(runs):
+    """
+    Merges the trigram indexes of consecutive runs of entries. The postings of
+    a trigram are concatenated in run order, which keeps every list sorted.
+    There are far fewer trigrams than postings, so this is a few slice copies
+    per trigram.
+    """
+    if len(runs)==1:
+        return runs[0]
+    positions=[dict((code, j) for j, code in enumerate(tri_code)) for tri_code, tri_off, tri_post in runs]
+    tri_code=array('I', sorted(set().union(*positions)))
+    tri_off=array('Q')
+    tri_post=array('I')
+    for code in tri_code:
+        tri_off.append(len(tri_post))
+        for (run_code, run_off, run_post), position in zip(runs, positions):
+            j=position.get(code)
+            if j is not None:
+                tri_post.extend(run_post[run_off[j]:run_off[j+1]])
+    tri_off.append(len(tri_post))
+    return tri_code, tri_off, tri_post
+
+
+def _trigram_index(entries, workers=1):
+    """
+    Trigram index over the name table, for approximate matching. The entries
+    are split into contiguous runs, which are split into trigrams and indexed
+    in parallel, and the run indexes are merged (see _merge_trigram_runs).
+
+    Parameters
+    ----------
+    entries : list
+        (entry number, normalized name) tuples of the names to index.
+    workers : int
+        number of worker processes.
+
+    Returns
+    -------
+    tri_code, tri_off, tri_post : arrays
+        sorted trigram codes, postings of tri_code[j] are
+        tri_post[tri_off[j]:tri_off[j+1]] (entry numbers of the name table).
+
+    """
+    if workers<=1 or len(entries)<100000:
+        return _trigram_run(entries)
+    size=-(-len(entries)//(4*workers))
+    runs=[entries[start:start+size] for start in range(0, len(entries), size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return _merge_trigram_runs(list(pool.map(_trigram_run, runs)))
+
+
+def _ancestry(parent):
+    """
+    Depth of every taxid and the topmost ancestor it reaches, with numpy, by
+    pointer jumping: every round adds the distance to the current ancestor of
+    the current ancestor and jumps there, so about log2(max depth) whole-array
+    rounds replace the walks of every taxid. Taxids without parent and the
+    root point to themselves at distance 0.
+
+    Returns
+    -------
+    depth, top : numpy arrays
+        taxid indexed, top is 1 for all taxids below the root.
+
+    """
+    parent=numpy.frombuffer(parent, dtype=numpy.uint32).astype(numpy.int64)
+    taxids=numpy.arange(len(parent))
+    fixed=(parent==0)|(taxids==1)
+    top=numpy.where(fixed, taxids, parent)
+    depth=(~fixed).astype(numpy.int64)
+    #A parent loop outside the root would never settle, the rounds are bounded.
+    for _ in range(len(parent).bit_length()+1):
+        if fixed[top].all():
+            break
+        depth=depth+depth[top]
+        top=top[top]
+    return depth, top
+
+
+def _depths(parent, depth=None, known=None):
+    """
+    Computes the depth of every taxid below the root (root has depth 0).
+    Each walk stops at the first ancestor whose depth is already known, so
+    every node is visited once. When updating an index, depth holds the old
+    depths and known flags the taxids whose depth is still valid. A full
+    build uses _ancestry instead when numpy is installed.
+    """
+    size=len(parent)
+    if depth is None and numpy is not None:
+        return array('H', _ancestry(parent)[0].astype(numpy.uint16).tobytes())
+    if depth is None:
+        depth=array('H', bytes(2*size))
+        known=bytearray(size)
+    known[1]=1
+    for taxid in range(size):
+        if known[taxid] or parent[taxid]==0:
+            continue
+        chain=[]
+        node=taxid
+        while not known[node] and parent[node]!=0:
+            chain.append(node)
+            node=parent[node]
+        current=depth[node]
+        for node in reversed(chain):
+            current+=1
+            depth[node]=current
+            known[node]=1
+    return depth
+
+
+def _jumps(parent, depth):
+    """
+    Binary lifting table: level k holds the 2**k-th ancestor of every taxid.
+    Level 0 is the parent array itself and is not repeated, the returned
+    array holds levels 1 to levels-1 one after the other.
+    """
+    levels=max(depth).bit_length()
+    jump=array('I')
+    if numpy is not None:
+        previous=numpy.frombuffer(parent, dtype=numpy.uint32)
+        for k in range(1, levels):
+            previous=previous[previous]
+            jump.frombytes(previous.tobytes())
+        return jump, levels
+    previous=parent
+    for k in range(1, levels):
+        previous=array('I', [previous[up] for up in previous])
+        jump.extend(previous)
+    return jump, levels
+
+
+def _intervals(parent):
+    """
+    Pre-order interval labels of the tree: taxids are numbered in depth-first
+    pre-order from the root (1, 2, ...), children by increasing taxid. The
+    taxids below t then carry exactly the numbers pre[t]+1 to end[t], so
+    descendant tests are two comparisons and a subtree is a contiguous run of
+    order. end[t] is the last pre-order number of the subtree of t, which
+    plays the role of a post-order number.
+
+    Returns
+    -------
+    pre, end : arrays
+        taxid indexed, 0 for taxids that do not exist.
+    order : array
+        order[n] is the taxid with pre-order number n (order[0] is 0).
+
+    """
+    size=len(parent)
+    if numpy is not None and size>=2 and parent[1]!=0:
+        return _numpy_intervals(parent)
+    #Children of every taxid in one array, child_off[t] to child_off[t+1].
+    child_off=array('I', bytes(4*(size+1)))
+    for taxid in range(2, size):
+        if parent[taxid]:
+            child_off[parent[taxid]+1]+=1
+    for taxid in range(size):
+        child_off[taxid+1]+=child_off[taxid]
+    children=array('I', bytes(4*child_off[size]))
+    fill=array('I', child_off)
+    for taxid in range(2, size):
+        if parent[taxid]:
+            children[fill[parent[taxid]]]=taxid
+            fill[parent[taxid]]+=1
+
+    pre=array('I', bytes(4*size))
+    end=array('I', bytes(4*size))
+    order=array('I', [0])
+    if size<2 or parent[1]==0:
+        return pre, end, order
+    stack=[1]
+    while stack:
+        taxid=stack.pop()
+        pre[taxid]=len(order)
+        order.append(taxid)
+        #Reversed, so the smallest child is numbered first.
+        stack.extend(reversed(children[child_off[taxid]:child_off[taxid+1]]))
+    #Every subtree ends where the subtree of its last descendant ends.
+    for number in range(len(order)-1, 0, -1):
+        taxid=order[number]
+        if not end[taxid]:
+            end[taxid]=number
+        if taxid!=1 and end[parent[taxid]]<end[taxid]:
+            end[parent[taxid]]=end[taxid]
+    return pre, end, order
+
+
+def _numpy_intervals(parent):
+    """
+    _intervals with numpy, level by level instead of a depth-first walk: the
+    subtree sizes are summed up from the deepest level to the root, then every
+    taxid gets the number of its parent, plus one, plus the sizes of the
+    subtrees of its smaller siblings.
+    """
+    depth, top=_ancestry(parent)
+    parent=numpy.frombuffer(parent, dtype=numpy.uint32).astype(numpy.int64)
+    size=len(parent)
+    #Taxids below the root, by increasing depth and taxid (the root comes first).
+    inside=numpy.flatnonzero((top==1)&(parent!=0))
+    inside=inside[numpy.argsort(depth[inside], kind="stable")]
+    bounds=numpy.searchsorted(depth[inside], numpy.arange(depth[inside][-1]+2))
+    levels=[inside[bounds[d]:bounds[d+1]] for d in range(1, len(bounds)-1)]
+
+    subtree=numpy.zeros(size, dtype=numpy.int64)
+    subtree[inside]=1
+    for level in reversed(levels):
+        numpy.add.at(subtree, parent[level], subtree[level])
+
+    #Sizes of the subtrees of the smaller siblings, within each group of siblings.
+    children=numpy.sort(inside[1:])
+    children=children[numpy.argsort(parent[children], kind="stable")]
+    before=numpy.cumsum(subtree[children])-subtree[children]
+    first=numpy.ones(len(children), dtype=bool)
+    first[1:]=parent[children[1:]]!=parent[children[:-1]]
+    offset=numpy.zeros(size, dtype=numpy.int64)
+    offset[children]=before-before[first][numpy.cumsum(first)-1]
+
+    pre=numpy.zeros(size, dtype=numpy.int64)
+    pre[1]=1
+    for level in levels:
+        pre[level]=pre[parent[level]]+1+offset[level]
+    end=numpy.zeros(size, dtype=numpy.int64)
+    end[inside]=pre[inside]+subtree[inside]-1
+    order=numpy.zeros(len(inside)+1, dtype=numpy.int64)
+    order[pre[inside]]=inside
+    return (array('I', pre.astype(numpy.uint32).tobytes()), array('I', end.astype(numpy.uint32).tobytes()),
+            array('I', order.astype(numpy.uint32).tobytes()))
+
+
+def _update_jumps(old, parent, depth, levels, affected):
+    """
+    Updates the binary lifting table of the index old for the taxids in
+    affected, the other taxids keep their ancestors and their old entries.
+    Affected taxids are processed from the root down, so the ancestors they
+    jump through are already up to date.
+    """
+    size=len(parent)
+    old_size=old.max_taxid+1
+    blocks=[]
+    for k in range(levels-1):
+        block=array('I', old.jump[k*old_size:k*old_size+min(old_size, size)])
+        block.extend(array('I', bytes(4*(size-len(block)))))
+        blocks.append(block)
+    for taxid in sorted(affected, key=depth.__getitem__):
+        previous=parent
+        for block in blocks:
+            block[taxid]=previous[previous[taxid]]
+            previous=block
+    jump=array('I')
+    for block in blocks:
+        jump.extend(block)
+    return jump
+
+
+def _update_trigram_index(old, entries, keys, key_off):
+    """
+    Updates the trigram index of the index old to a new name table. Names
+    already indexed (with the same spelling) keep their trigram codes, only
+    their entry numbers are mapped to the new table; only new names are split
+    into trigrams. With numpy, the postings are remapped and merged as whole
+    arrays.
+
+    Parameters
+    ----------
+    old : TaxonomyIndex
+        index before the update.
+    entries : list
+        (entry number, normalized name) tuples of the new name table.
+    keys, key_off : arrays
+        names of the new name table.
+
+    Returns
+    -------
+    tri_code, tri_off, tri_post : arrays
+        see _trigram_index.
+    added : int
+        number of names that were not indexed before.
+
+    """
+    old_keys=old.keys.tobytes()
+    old_off=old.key_off
+    indexed=dict((old_keys[old_off[i]:old_off[i+1]], i) for i in set(old.tri_post))
+    missing=0xFFFFFFFF
+    mapping=array('I', [missing])*len(old.key_taxid)
+    new_entries=[]
+    for i, key in entries:
+        j=indexed.get(bytes(keys[key_off[i]:key_off[i+1]]))
+        if j is None:
+            new_entries.append((i, key))
+        else:
+            mapping[j]=i
+    postings=_trigram_chunk(new_entries)
+
+    if numpy is not None:
+        #(code, entry) pairs of the remapped old postings and the new ones,
+        #sorted by code and entry.
+        counts=numpy.diff(numpy.frombuffer(old.tri_off, dtype=numpy.uint64).astype(numpy.int64))
+        codes=numpy.repeat(numpy.frombuffer(old.tri_code, dtype=numpy.uint32), counts)
+        posts=numpy.frombuffer(mapping, dtype=numpy.uint32)[numpy.frombuffer(old.tri_post, dtype=numpy.uint32)]
+        kept=posts!=missing
+        codes=numpy.concatenate([codes[kept]]+[numpy.full(len(post), code, dtype=numpy.uint32) for code, post in postings.items()])
+        posts=numpy.concatenate([posts[kept]]+[numpy.frombuffer(post, dtype=numpy.uint32) for post in postings.values()])
+        order=numpy.lexsort((posts, codes))
+        codes, starts=numpy.unique(codes[order], return_index=True)
+        tri_code=array('I', codes.astype(numpy.uint32).tobytes())
+        tri_off=array('Q', starts.astype(numpy.uint64).tobytes())
+        tri_off.append(len(order))
+        tri_post=array('I', posts[order].tobytes())
+        return tri_code, tri_off, tri_post, len(new_entries)
+
+    tri_code=array('I')
+    tri_off=array('Q')
+    tri_post=array('I')
+    old_codes=dict((code, j) for j, code in enumerate(old.tri_code))
+    for code in sorted(set(old_codes).union(postings)):
+        merged=[]
+        if code in old_codes:
+            j=old_codes[code]
+            #The mapping keeps the order of the entries, remapped lists stay sorted.
+            merged=[i for i in (mapping[e] for e in old.tri_post[old.tri_off[j]:old.tri_off[j+1]]) if i!=missing]
+        if code in postings:
+            merged.extend(postings[code])
+            merged.sort()
+        if merged:
+            tri_code.append(code)
+            tri_off.append(len(tri_post))
+            tri_post.extend(merged)
+    tri_off.append(len(tri_post))
+    return tri_code, tri_off, tri_post, len(new_entries)
+
+
+def _dump_lines(path):
+    "Lines of a small dump file, none if the file does not exist."
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, 'r') as dump:
+        return dump.read().splitlines()
+
+
+def _redirects(merged_lines, delnodes_lines, parent):
+    """
+    Reads the rows of merged.dmp and delnodes.dmp into taxid indexed arrays,
+    so old taxids are redirected in O(1).
+
+    Returns
+    -------
+    merged : array
+        merged[t] is the taxid t was merged into, 0 if t was not merged.
+    deleted : array
+        deleted[t] is 1 if taxid t was deleted.
+
+    """
+    pairs=dict()
+    for entry in merged_lines:
+        fields=entry.split("\t|")
+        pairs[int(fields[0])]=int(fields[1])
+    merged=array('I', bytes(4*(max(pairs, default=-1)+1)))
+    for old_ID, new_ID in pairs.items():
+        #Follow chains of merges to a taxid that still exists.
+        seen=0
+        while not (0<new_ID<len(parent) and parent[new_ID]!=0) and new_ID in pairs and seen<len(pairs):
+            new_ID=pairs[new_ID]
+            seen+=1
+        if 0<new_ID<len(parent) and parent[new_ID]!=0:
+            merged[old_ID]=new_ID
+
+    removed=[int(entry.split("\t|")[0]) for entry in delnodes_lines if entry.strip()]
+    deleted=array('B', bytes(max(removed, default=-1)+1))
+    for taxid in removed:
+        deleted[taxid]=1
+    return merged, deleted
+
+
+def _archive_members(taxdump_file):
+    """
+    Streams the members of a taxdump archive (.tar.gz, .tar.bz2, .tar, ...),
+    without extracting them to disk. Gzip archives are decompressed by pigz
+    in a separate process when it is installed.
+
+    Yields
+    ------
+    name, stream
+        file name (without directories) and binary stream of every member.
+
+    """
+    process=None
+    if taxdump_file.endswith((".gz", ".tgz")) and shutil.which("pigz"):
+        process=subprocess.Popen(["pigz", "-dc", taxdump_file], stdout=subprocess.PIPE)
+        archive=tarfile.open(fileobj=process.stdout, mode='r|')
+    else:
+        archive=tarfile.open(taxdump_file, mode='r|*')
+    try:
+        for member in archive:
+            if member.isfile():
+                yield os.path.basename(member.name), archive.extractfile(member)
+    finally:
+        archive.close()
+        if process is not None:
+            process.stdout.close()
+            process.wait()
+
+
+def _read_dumps(names_file, nodes_file, merged_file, delnodes_file, taxdump_file, workers):
+    """
+    Parses the dump files, or the members of the archive taxdump_file, and
+    merges the parsed chunks.
+
+    Returns
+    -------
+    parent, rank, hidden, rank_names
+        see _merge_nodes.
+    names : tuple
+        see _merge_names.
+    merged, deleted : arrays
+        see _redirects.
+
+    """
+    if taxdump_file:
+        parts=dict()
+        lines=dict()
+        #Members come in archive order, names.dmp usually before nodes.dmp.
+        for name, stream in _archive_members(taxdump_file):
+            if name=="nodes.dmp":
+                parts[name]=_map_blocks(_parse_nodes_chunk, stream, workers)
+            elif name=="names.dmp":
+                parts[name]=_map_blocks(_parse_names_chunk, stream, workers)
+            elif name in ("merged.dmp", "delnodes.dmp"):
+                lines[name]=stream.read().decode("utf-8").splitlines()
+        if len(parts)<2:
+            raise ValueError("{} does not contain names.dmp and nodes.dmp.".format(taxdump_file))
+        nodes_parts, names_parts=parts["nodes.dmp"], parts["names.dmp"]
+        merged_lines, delnodes_lines=lines.get("merged.dmp", []), lines.get("delnodes.dmp", [])
+    else:
+        nodes_parts=_map_chunks(_parse_nodes_chunk, nodes_file, workers)
+        names_parts=_map_chunks(_parse_names_chunk, names_file, workers)
+        merged_lines, delnodes_lines=_dump_lines(merged_file), _dump_lines(delnodes_file)
+    parent, rank, hidden, rank_names=_merge_nodes(nodes_parts)
+    names=_merge_names(names_parts, len(parent)-1)
+    merged, deleted=_redirects(merged_lines, delnodes_lines, parent)
+    return parent, rank, hidden, rank_names, names, merged, deleted
+
+
+def _sources(names_file, nodes_file, merged_file, delnodes_file, taxdump_file=None):
+    "Fingerprints of the dump files (or the archive) an index is built from."
+    if taxdump_file:
+        return {"taxdump": dump_fingerprint(taxdump_file)+[_crc32(taxdump_file)]}
+    sources={"names": dump_fingerprint(names_file)+[_crc32(names_file)],
+             "nodes": dump_fingerprint(nodes_file)+[_crc32(nodes_file)]}
+    for key, path in (("merged", merged_file), ("delnodes", delnodes_file)):
+        if path and os.path.exists(path):
+            sources[key]=dump_fingerprint(path)+[_crc32(path)]
+    return sources
+
+
+def _write_sections(index_file, header, sections):
+    """
+    Writes header and arrays to index_file. The file is first written next to
+    the target and then renamed, so readers never see a half written index.
+    """
+    layout=dict()
+    offset=0
+    for name, data in sections:
+        typecode=data.typecode if isinstance(data, array) else 'B'
+        layout[name]=[offset, typecode, len(data)]
+        nbytes=len(data)*(data.itemsize if isinstance(data, array) else 1)
+        offset+=nbytes+(-nbytes % _ALIGN)
+    header=dict(header, sections=layout, byteorder=sys.byteorder)
+    header_bytes=json.dumps(header).encode("utf-8")
+    start=_PREFIX.size+len(header_bytes)
+    start+=-start % _ALIGN
+    header_bytes+=b" "*(start-_PREFIX.size-len(header_bytes))
+
+    tmp_file="{}.tmp{}".format(index_file, os.getpid())
+    with open(tmp_file, 'wb') as out:
+        out.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        out.write(header_bytes)
+        for name, data in sections:
+            raw=data.tobytes() if isinstance(data, array) else bytes(data)
+            out.write(raw)
+            out.write(b"\0"*(-len(raw) % _ALIGN))
+    os.replace(tmp_file, index_file)
+
+
+def build_index(names_file, nodes_file, index_file, workers=None, merged_file=None, delnodes_file=None,
+                taxdump_file=None):
+    """
+    Compiles names.dmp and nodes.dmp into an index file. Both dump files are
+    split into byte ranges at line boundaries, which are parsed in a pool of
+    worker processes and then merged. Only parsing and the trigram index use
+    the workers, the merges and tree arrays run in this process. The dump files can also be read straight
+    from the (compressed) taxdump archive, block by block as it is decompressed.
+
+    Parameters
+    ----------
+    names_file : string
+        path to names.dmp.
+    nodes_file : string
+        path to nodes.dmp.
+    index_file : string
+        path of the index to (over)write.
+    workers : int, optional
+        number of worker processes for parsing and the trigram index,
+        default: number of cores.
+    merged_file, delnodes_file : string, optional
+        path to merged.dmp and delnodes.dmp, to redirect old taxids.
+    taxdump_file : string, optional
+        path to taxdump.tar.gz, read instead of the dump files.
+
+    Returns
+    -------
+    None.
+
+    """
+    if workers is None:
+        workers=os.cpu_count() or 1
+    parent, rank, hidden, rank_names, names, merged, deleted=_read_dumps(
+        names_file, nodes_file, merged_file, delnodes_file, taxdump_file, workers)
+    max_taxid=len(parent)-1
+    name_off, names, key_off, keys, key_taxid, key_class, name_classes, fuzzy_entries=names
+    tri_code, tri_off, tri_post=_trigram_index(fuzzy_entries, workers)
+    depth=_depths(parent)
+    jump, levels=_jumps(parent, depth)
+    pre, end, order=_intervals(parent)
+
+    header={"version": FORMAT_VERSION,
+            "max_taxid": max_taxid,
+            "levels": levels,
+            "ranks": rank_names,
+            "name_classes": name_classes,
+            "sources": _sources(names_file, nodes_file, merged_file, delnodes_file, taxdump_file)}
+    _write_sections(index_file, header, [("parent", parent),
+                                         ("rank", rank),
+                                         ("hidden", hidden),
+                                         ("depth", depth),
+                                         ("jump", jump),
+                                         ("pre", pre),
+                                         ("end", end),
+                                         ("order", order),
+                                         ("name_off", name_off),
+                                         ("names", names),
+                                         ("key_off", key_off),
+                                         ("keys", keys),
+                                         ("key_taxid", key_taxid),
+                                         ("key_class", key_class),
+                                         ("tri_code", tri_code),
+                                         ("tri_off", tri_off),
+                                         ("tri_post", tri_post),
+                                         ("merged", merged),
+                                         ("deleted", deleted)])
+
+
+def update_index(index_file, names_file, nodes_file, merged_file=None, delnodes_file=None, workers=None,
+                 taxdump_file=None):
+    """
+    Applies a new taxdump to an existing index as a diff, instead of compiling
+    it from scratch. The new dump files still have to be parsed, but only the
+    derived arrays of changed taxids are recomputed: depth and binary lifting
+    entries of taxids that were added, removed or moved (and of everything
+    below them), and the trigrams of names that were not indexed before. The
+    result is identical to build_index on the new dump files. Without a
+    usable index, the index is built from scratch.
+
+    Parameters
+    ----------
+    index_file : string
+        path of the index to update.
+    names_file, nodes_file : string
+        path to the new names.dmp and nodes.dmp.
+    merged_file, delnodes_file : string, optional
+        path to the new merged.dmp and delnodes.dmp.
+    workers : int, optional
+        number of worker processes, default: number of cores.
+    taxdump_file : string, optional
+        path to the new taxdump.tar.gz, read instead of the dump files.
+
+    Returns
+    -------
+    changes: dictionary
+        number of added, removed and moved taxids, of taxids below them
+        (affected), of newly indexed names and of merged and deleted taxids.
+        None if the index had to be built from scratch.
+
+    """
+    if workers is None:
+        workers=os.cpu_count() or 1
+    try:
+        old=load_index(index_file)
+    except (OSError, ValueError, StaleIndexError):
+        build_index(names_file, nodes_file, index_file, workers, merged_file, delnodes_file, taxdump_file)
+        return None
+    try:
+        parent, rank, hidden, rank_names, names, merged, deleted=_read_dumps(
+            names_file, nodes_file, merged_file, delnodes_file, taxdump_file, workers)
+        size=len(parent)
+        old_size=old.max_taxid+1
+        added=removed=moved=0
+        changed=[]
+        for taxid in range(max(size, old_size)):
+            new_parent=parent[taxid] if taxid<size else 0
+            old_parent=old.parent[taxid] if taxid<old_size else 0
+            if new_parent!=old_parent:
+                changed.append(taxid)
+                if old_parent==0:
+                    added+=1
+                elif new_parent==0:
+                    removed+=1
+                else:
+                    moved+=1
+        #The ancestors of a taxid only change if it, or one of its old
+        #ancestors, changed parent: the subtrees of the changed taxids are
+        #affected, found as ranges of the old pre-order. Taxids beyond the new
+        #max_taxid are gone, they drop out of the arrays.
+        affected=set()
+        for taxid in changed:
+            if taxid<size:
+                affected.add(taxid)
+                if taxid<old_size and old.pre[taxid]:
+                    affected.update(node for node in old.order[old.pre[taxid]+1:old.end[taxid]+1] if node<size)
+        affected=sorted(affected)
+
+        depth=array('H', old.depth[:min(old_size, size)])
+        depth.extend(array('H', bytes(2*(size-len(depth)))))
+        known=bytearray(b"\1")*size
+        for taxid in affected:
+            depth[taxid]=0
+            known[taxid]=0
+        depth=_depths(parent, depth, known)
+        levels=max(depth).bit_length()
+        if levels==old.levels:
+            jump=_update_jumps(old, parent, depth, levels, affected)
+        else:
+            jump, levels=_jumps(parent, depth)
+
+        name_off, names, key_off, keys, key_taxid, key_class, name_classes, fuzzy_entries=names
+        tri_code, tri_off, tri_post, new_names=_update_trigram_index(old, fuzzy_entries, keys, key_off)
+        #Adding or removing a single taxid shifts the pre-order numbers of all
+        #taxids after it, the labels are always recomputed.
+        pre, end, order=_intervals(parent)
+    finally:
+        old.close()
+
+    header={"version": FORMAT_VERSION,
+            "max_taxid": size-1,
+            "levels": levels,
+            "ranks": rank_names,
+            "name_classes": name_classes,
+            "sources": _sources(names_file, nodes_file, merged_file, delnodes_file, taxdump_file)}
+    _write_sections(index_file, header, [("parent", parent),
+                                         ("rank", rank),
+                                         ("hidden", hidden),
+                                         ("depth", depth),
+                                         ("jump", jump),
+                                         ("pre", pre),
+                                         ("end", end),
+                                         ("order", order),
+                                         ("name_off", name_off),
+                                         ("names", names),
+                                         ("key_off", key_off),
+                                         ("keys", keys),
+                                         ("key_taxid", key_taxid),
+                                         ("key_class", key_class),
+                                         ("tri_code", tri_code),
+                                         ("tri_off", tri_off),
+                                         ("tri_post", tri_post),
+                                         ("merged", merged),
+                                         ("deleted", deleted)])
+    return {"added": added, "removed": removed, "moved": moved, "affected": len(affected),
+            "new_names": new_names, "merged": sum(1 for new_ID in merged if new_ID),
+            "deleted": sum(deleted)}
+
+
+class TaxonomyIndex:
+    """
+    Read-only view of a memory-mapped index file.
+
+    Attributes
+    ----------
+    parent, rank, hidden, depth : memoryview
+        taxid indexed arrays, parent[t]==0 if taxid t does not exist.
+    ranks : list
+        rank names, ranks[rank[t]] is the rank of taxid t.
+    header : dictionary
+        json header of the index file.
+    cache : LineageCache
+        resolved lineages, shared by all users of this index.
+
+    """
+
+    def __init__(self, index_file):
+        self.path=index_file
+        with open(index_file, 'rb') as handle:
+            self._map=mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            stat=os.fstat(handle.fileno())
+        #Identifies the file this mapping was made from, a rebuilt index is a new file.
+        self.identity=(stat.st_ino, stat.st_mtime_ns)
+        magic, version, header_length=_PREFIX.unpack_from(self._map, 0)
+        if magic!=MAGIC:
+            self._map.close()
+            raise StaleIndexError("{} is not a Taxa_Finder index.".format(index_file))
+        header=json.loads(self._map[_PREFIX.size:_PREFIX.size+header_length].decode("utf-8"))
+        if version!=FORMAT_VERSION or header.get("byteorder")!=sys.byteorder:
+            self._map.close()
+            raise StaleIndexError("{} was built by another version of Taxa_Finder.".format(index_file))
+        self.header=header
+        self.ranks=header["ranks"]
+        self.name_classes=header["name_classes"]
+        self.max_taxid=header["max_taxid"]
+        self.levels=header["levels"]
+        #Resolved lineages of this index, see LineageCache.
+        self.cache=LineageCache(self)
+
+        start=_PREFIX.size+header_length
+        view=memoryview(self._map)
+        self._views=[view]
+        for name, (offset, typecode, length) in header["sections"].items():
+            itemsize=array(typecode).itemsize
+            section=view[start+offset:start+offset+length*itemsize].cast(typecode)
+            self._views.append(section)
+            setattr(self, name, section)
+
+    def close(self):
+        "Releases the memory mapping."
+        for view in reversed(self._views):
+            view.release()
+        self._views=[]
+        self._map.close()
+
+    def __contains__(self, taxid):
+        return 0<taxid<=self.max_taxid and self.parent[taxid]!=0
+
+    def redirect(self, taxid):
+        """
+        Follows merged.dmp and delnodes.dmp for taxids that no longer exist,
+        in O(1) (two array lookups).
+
+        Returns
+        -------
+        taxid: int
+            current taxid, None if the taxid was deleted or never existed.
+        status: string
+            "merged" or "deleted", None if the taxid exists or is unknown.
+
+        """
+        if taxid in self:
+            return taxid, None
+        if 0<taxid<len(self.merged) and self.merged[taxid]:
+            return self.merged[taxid], "merged"
+        if 0<taxid<len(self.deleted) and self.deleted[taxid]:
+            return None, "deleted"
+        return None, None
+
+    def name(self, taxid):
+        "Returns the scientific name of taxid."
+        return self.names[self.name_off[taxid]:self.name_off[taxid+1]].tobytes().decode("utf-8")
+
+    def rank_of(self, taxid):
+        "Returns the rank of taxid as written in nodes.dmp."
+        return self.ranks[self.rank[taxid]]
+
+    def is_descendant(self, taxid, ancestor):
+        """
+        Tests whether taxid lies in the subtree of ancestor, in O(1) over the
+        pre-order interval labels. A taxid counts as descendant of itself.
+
+        Returns
+        -------
+        bool
+            False if either taxid does not exist.
+
+        """
+        if taxid not in self or ancestor not in self or not self.pre[ancestor]:
+            return False
+        return self.pre[ancestor]<=self.pre[taxid]<=self.end[ancestor]
+
+    def descendants(self, taxid, short=False):
+        """
+        Lists the subtree below taxid, a contiguous range of the pre-order.
+
+        Parameters
+        ----------
+        taxid : int
+        short : bool
+            leave out taxids flagged as hidden.
+
+        Returns
+        -------
+        taxids: array
+            descendants in pre-order (every taxid is followed by its own
+            subtree), without taxid itself. Empty for unknown taxids.
+
+        """
+        if taxid not in self or not self.pre[taxid]:
+            return array('I')
+        subtree=array('I', self.order[self.pre[taxid]+1:self.end[taxid]+1])
+        if short:
+            subtree=array('I', [node for node in subtree if not self.hidden[node]])
+        return subtree
+
+    def ancestors(self, taxid):
+        """
+        Walks the parent array from taxid up to the root.
+
+        Parameters
+        ----------
+        taxid : int
+
+        Returns
+        -------
+        path: list
+            ancestor taxids, starting with the parent of taxid and ending
+            below the root. Empty for the root and for unknown taxids.
+
+        """
+        if taxid not in self:
+            return []
+        parent=self.parent
+        path=[]
+        current=parent[taxid]
+        #0 marks a taxid missing from nodes.dmp, 1 is the root.
+        while current>1:
+            path.append(current)
+            current=parent[current]
+        return path
+
+    def ancestors_batch(self, taxids):
+        """
+        Walks many taxids up to the root at once. All taxids advance one level
+        per step, so the parent array is read for the whole batch at a time
+        (as a single gather with numpy, if installed).
+
+        Parameters
+        ----------
+        taxids : list
+            taxids as int.
+
+        Returns
+        -------
+        paths: list
+            one list of ancestors per taxid, as returned by ancestors().
+
+        """
+        #Unknown taxids start at 0, which is its own parent and ends the walk.
+        current=[taxid if taxid in self else 0 for taxid in taxids]
+        if numpy is not None:
+            parent=numpy.frombuffer(self.parent, dtype=numpy.uint32)
+            current=parent[numpy.array(current, dtype=numpy.uint32)]
+            levels=[]
+            while True:
+                #Every node at or above the root is mapped to 0.
+                current[current<=1]=0
+                if not current.any():
+                    break
+                levels.append(current)
+                current=parent[current]
+            if not levels:
+                return [[] for taxid in taxids]
+            rows=numpy.stack(levels, axis=1).tolist()
+        else:
+            parent=self.parent
+            current=[parent[taxid] for taxid in current]
+            rows=[[] for taxid in taxids]
+            while any(node>1 for node in current):
+                current=[node if node>1 else 0 for node in current]
+                for row, node in zip(rows, current):
+                    row.append(node)
+                current=[parent[node] for node in current]
+        #Trailing zeros are levels above the root of shallower taxids.
+        paths=[]
+        for row in rows:
+            while row and row[-1]==0:
+                row.pop()
+            paths.append(row)
+        return paths
+
+    def _up(self, k, taxid):
+        "Returns the 2**k-th ancestor of taxid (the root for anything above)."
+        if k==0:
+            return self.parent[taxid]
+        return self.jump[(k-1)*(self.max_taxid+1)+taxid]
+
+    def lca(self, a, b):
+        """
+        Finds the last common ancestor of two taxids by binary lifting, in
+        O(log depth) array reads.
+
+        Parameters
+        ----------
+        a, b : int
+            taxids.
+
+        Returns
+        -------
+        taxid: int
+            None if one of the taxids does not exist. a itself if b is a
+            descendant of a (and the other way around).
+
+        """
+        if a not in self or b not in self:
+            return None
+        depth=self.depth
+        if depth[a]<depth[b]:
+            a, b=b, a
+        #Lift the deeper taxid to the depth of the other one.
+        steps=depth[a]-depth[b]
+        k=0
+        while steps:
+            if steps & 1:
+                a=self._up(k, a)
+            steps>>=1
+            k+=1
+        if a==b:
+            return a
+        #Jump both as far as possible while they stay below the ancestor.
+        for k in reversed(range(self.levels)):
+            up_a=self._up(k, a)
+            up_b=self._up(k, b)
+            if up_a!=up_b:
+                a, b=up_a, up_b
+        return self.parent[a]
+
+    def lca_many(self, taxids):
+        """
+        Finds the last common ancestor of any number of taxids.
+
+        Returns
+        -------
+        taxid: int
+            None if the list is empty or one of the taxids does not exist.
+
+        """
+        common=None
+        for taxid in taxids:
+            common=taxid if common is None else self.lca(common, taxid)
+            if common is None or common==1:
+                break
+        if common is not None and common not in self:
+            return None
+        return common
+
+    def distance(self, a, b):
+        "Number of edges between two taxids in the tree, None if unknown."
+        common=self.lca(a, b)
+        if common is None:
+            return None
+        return self.depth[a]+self.depth[b]-2*self.depth[common]
+
+    def lca_matrix(self, taxids):
+        """
+        All-pairs last common ancestors and distances, for comparison tables
+        over thousands of taxa. The union of the lineages of the taxids is
+        traversed once (Euler tour) and a sparse table over the depths of the
+        tour answers each pair in O(1). Rows are generated one at a time, so
+        only one row of the matrix is held in memory.
+
+        Parameters
+        ----------
+        taxids : list
+            taxids as int.
+
+        Yields
+        ------
+        taxid, lca_row, distance_row
+            for every taxid in order, the last common ancestors with and the
+            distances to all taxids, None where a taxid does not exist.
+
+        """
+        "a. Build the subtree spanned by the taxids and their lineages."
+        children=dict()
+        seen={1}
+        for taxid in taxids:
+            node=taxid
+            #Stop at the first node whose lineage is already in the subtree.
+            while node in self and node not in seen:
+                seen.add(node)
+                parent=self.parent[node]
+                children.setdefault(parent, []).append(node)
+                node=parent
+
+        "b. Euler tour of the subtree, remembering the first visit of each node."
+        tour=[]
+        first=dict()
+        stack=[(1, 0)]
+        while stack:
+            node, child=stack.pop()
+            if child==0:
+                first[node]=len(tour)
+            tour.append(node)
+            if child<len(children.get(node, ())):
+                stack.append((node, child+1))
+                stack.append((children[node][child], 0))
+        tour_depth=[self.depth[node] for node in tour]
+
+        "c. Sparse table: table[k][i] is the position of the shallowest node in tour[i:i+2**k]."
+        table=[list(range(len(tour)))]
+        k=1
+        while (1 << k)<=len(tour):
+            previous=table[-1]
+            half=1 << (k-1)
+            table.append([previous[i] if tour_depth[previous[i]]<=tour_depth[previous[i+half]] else previous[i+half]
+                          for i in range(len(tour)-(1 << k)+1)])
+            k+=1
+
+        "d. Answer all pairs, one row at a time."
+        known=[taxid in self and taxid in first for taxid in taxids]
+        if numpy is not None and taxids:
+            #Same lookups as below, for a whole row at once.
+            np_tour=numpy.array(tour)
+            np_depth=numpy.array(tour_depth)
+            np_table=numpy.zeros((len(table), len(tour)), dtype=numpy.int64)
+            for k, level in enumerate(table):
+                np_table[k, :len(level)]=level
+            log2=numpy.zeros(len(tour)+1, dtype=numpy.int64)
+            log2[1:]=[length.bit_length()-1 for length in range(1, len(tour)+1)]
+            position=numpy.array([first[taxid] if ok else 0 for taxid, ok in zip(taxids, known)])
+            unknown=[i for i, ok in enumerate(known) if not ok]
+        for i, (taxid, row_known) in enumerate(zip(taxids, known)):
+            if not row_known:
+                yield taxid, [None]*len(taxids), [None]*len(taxids)
+                continue
+            if numpy is not None:
+                low=numpy.minimum(position[i], position)
+                high=numpy.maximum(position[i], position)
+                k=log2[high-low+1]
+                left=np_table[k, low]
+                right=np_table[k, high-(1 << k)+1]
+                shallow=numpy.where(np_depth[left]<=np_depth[right], left, right)
+                distance_row=(np_depth[position[i]]+np_depth[position]-2*np_depth[shallow]).tolist()
+                lca_row=np_tour[shallow].tolist()
+                for j in unknown:
+                    lca_row[j]=None
+                    distance_row[j]=None
+                yield taxid, lca_row, distance_row
+                continue
+            lca_row=[]
+            distance_row=[]
+            for other, other_known in zip(taxids, known):
+                if not other_known:
+                    lca_row.append(None)
+                    distance_row.append(None)
+                    continue
+                low, high=sorted((first[taxid], first[other]))
+                k=(high-low+1).bit_length()-1
+                left=table[k][low]
+                right=table[k][high-(1 << k)+1]
+                common=tour[left if tour_depth[left]<=tour_depth[right] else right]
+                lca_row.append(common)
+                distance_row.append(self.depth[taxid]+self.depth[other]-2*self.depth[common])
+            yield taxid, lca_row, distance_row
+
+    def _entry(self, i):
+        "Name of entry i of the name table, as written in names.dmp."
+        return self.keys[self.key_off[i]:self.key_off[i+1]].tobytes().decode("utf-8")
+
+    def _lower_bound(self, key):
+        "Position of the first entry whose normalized name is >= key."
+        low, high=0, len(self.key_taxid)
+        while low<high:
+            middle=(low+high)//2
+            if normalize_name(self._entry(middle))<key:
+                low=middle+1
+            else:
+                high=middle
+        return low
+
+    def find(self, query):
+        """
+        Finds the taxid of a name of any class (scientific, common, synonym,
+        ...), ignoring case and whitespace. If the name belongs to several
+        taxids, the one where it is the scientific name is preferred, then
+        common names, then synonyms (see NAME_CLASSES).
+
+        Parameters
+        ----------
+        query : string
+            f.e. Human, Homo Sapiens, Mammalia etc.
+
+        Returns
+        -------
+        taxid: int
+            None if the name is not in names.dmp.
+
+        """
+        key=normalize_name(query)
+        low=self._lower_bound(key)
+        if low<len(self.key_taxid) and normalize_name(self._entry(low))==key:
+            return self.key_taxid[low]
+        return None
+
+    def resolve(self, query):
+        """
+        Finds the taxid of a query given either as taxid (int or digits) or
+        as name. Taxids merged into another taxid are redirected to it.
+
+        Returns
+        -------
+        taxid: int
+            None if the taxid does not exist (or was deleted) or the name is
+            not found.
+
+        """
+        if isinstance(query, int):
+            return self.redirect(query)[0]
+        query=query.strip()
+        if is_taxid(query):
+            return self.redirect(int(query))[0]
+        return self.find(query)
+
+    def lookup(self, query):
+        """
+        Finds all taxids carrying a name, to report ambiguous queries.
+
+        Returns
+        -------
+        matches: list
+            (taxid, name class) tuples, preferred match first. More than one
+            entry means the query is ambiguous.
+
+        """
+        key=normalize_name(query)
+        matches=[]
+        i=self._lower_bound(key)
+        while i<len(self.key_taxid) and normalize_name(self._entry(i))==key:
+            matches.append((self.key_taxid[i], self.name_classes[self.key_class[i]]))
+            i+=1
+        return matches
+
+    def suggest(self, prefix, k=10, scan=500):
+        """
+        Completions of a prefix for autocompletion. The sorted name table is
+        itself the prefix index: all names starting with the prefix are found
+        in one contiguous run after a binary search. At most scan entries of
+        that run are ranked, so the call stays well under a millisecond even
+        for one letter prefixes.
+
+        Parameters
+        ----------
+        prefix : string
+            beginning of a name, any case.
+        k : int
+            number of completions returned.
+        scan : int
+            number of entries of the matching run that are ranked.
+
+        Returns
+        -------
+        suggestions: list
+            dictionaries with name, taxid, name class and scientific name,
+            exact matches first, then by name class and length.
+
+        """
+        key=normalize_name(prefix)
+        if not key:
+            return []
+        candidates=[]
+        i=self._lower_bound(key)
+        end=min(i+scan, len(self.key_taxid))
+        while i<end:
+            name=self._entry(i)
+            normalized=normalize_name(name)
+            if not normalized.startswith(key):
+                break
+            candidates.append((normalized!=key, self.key_class[i], len(normalized), normalized, i))
+            i+=1
+        candidates.sort()
+        suggestions=[]
+        for exact, code, length, normalized, i in candidates[:k]:
+            taxid=self.key_taxid[i]
+            suggestions.append({"name": self._entry(i),
+                                "taxid": taxid,
+                                "name_class": self.name_classes[code],
+                                "scientific_name": self.name(taxid)})
+        return suggestions
+
+    def fuzzy(self, query, k=5, max_postings=200000, candidates=50):
+        """
+        "Did you mean" candidates for a misspelled name. Names sharing the most
+        trigrams with the query are collected over the trigram index, starting
+        with the rarest trigrams of the query and stopping after max_postings
+        entries, so very common trigrams do not slow the search down. The best
+        candidates are then ranked by edit distance to the query.
+
+        Parameters
+        ----------
+        query : string
+            possibly misspelled name.
+        k : int
+            number of candidates returned.
+        max_postings : int
+            entries of the trigram lists counted at most.
+        candidates : int
+            number of names ranked by edit distance.
+
+        Returns
+        -------
+        suggestions: list
+            dictionaries with name, taxid, name class, scientific name and
+            edit distance, closest first. Only names within an edit distance
+            of a third of the query length (at least 2) are returned.
+
+        """
+        key=normalize_name(query)
+        if not key:
+            return []
+        lists=[]
+        for code in _trigram_codes(key):
+            j=bisect.bisect_left(self.tri_code, code)
+            if j<len(self.tri_code) and self.tri_code[j]==code:
+                lists.append((self.tri_off[j+1]-self.tri_off[j], j))
+        lists.sort()
+        shared=Counter()
+        counted=0
+        for length, j in lists:
+            if counted and counted+length>max_postings:
+                break
+            counted+=length
+            shared.update(self.tri_post[self.tri_off[j]:self.tri_off[j+1]])
+        ranked=[]
+        for i, count in shared.most_common(candidates):
+            name=self._entry(i)
+            ranked.append((_edit_distance(key, normalize_name(name)), -count, self.key_class[i], name, i))
+        ranked.sort()
+        #Names needing more edits than about a third of the query are not typos.
+        max_distance=max(2, len(key)//3)
+        suggestions=[]
+        for distance, count, code, name, i in ranked[:k]:
+            if distance>max_distance:
+                break
+            taxid=self.key_taxid[i]
+            suggestions.append({"name": name,
+                                "taxid": taxid,
+                                "name_class": self.name_classes[code],
+                                "scientific_name": self.name(taxid),
+                                "distance": distance})
+        return suggestions
+
+
+class LineageCache:
+    """
+    Bounded LRU cache of resolved lineages, keyed by (taxid, short). Sibling
+    taxa share almost all of their ancestors, so when a lineage is not cached,
+    the walk towards the root stops at the first ancestor whose lineage is,
+    and the missing nodes are appended to that cached lineage. The lineages of
+    the ancestors passed on the way are cached as well.
+
+    Attributes
+    ----------
+    capacity : int
+        largest number of cached lineages.
+    hits, misses, evictions : int
+        counters, see stats().
+
+    """
+
+    def __init__(self, index, capacity=100000):
+        self.index=index
+        self.capacity=capacity
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+        self._lineages=OrderedDict()
+        self._lock=threading.Lock()
+
+    def lineage(self, taxid, short=False):
+        """
+        Returns the lineage of taxid.
+
+        Parameters
+        ----------
+        taxid : int
+        short : bool
+            leave out nodes flagged as hidden.
+
+        Returns
+        -------
+        lineage: tuple
+            taxids from below the root down to taxid itself (leaving out
+            hidden ones if short), empty for the root and unknown taxids.
+
+        """
+        with self._lock:
+            key=(taxid, short)
+            if key in self._lineages:
+                self.hits+=1
+                self._lineages.move_to_end(key)
+                return self._lineages[key]
+            self.misses+=1
+            if taxid not in self.index:
+                return ()
+            #Walk up to the first ancestor with a cached lineage.
+            parent=self.index.parent
+            hidden=self.index.hidden
+            chain=[]
+            node=taxid
+            while node>1 and (node, short) not in self._lineages:
+                chain.append(node)
+                node=parent[node]
+            lineage=self._lineages[(node, short)] if node>1 else ()
+            for node in reversed(chain):
+                if not (short and hidden[node]==1):
+                    lineage=lineage+(node,)
+                self._lineages[(node, short)]=lineage
+            while len(self._lineages)>self.capacity:
+                self._lineages.popitem(last=False)
+                self.evictions+=1
+            return lineage
+
+    def clear(self):
+        "Empties the cache, the counters are kept."
+        with self._lock:
+            self._lineages.clear()
+
+    def stats(self):
+        "Returns the counters and the fill of the cache as dictionary."
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._lineages),
+                "capacity": self.capacity}
+
+
+def load_index(index_file, names_file=None, nodes_file=None, verify=False, merged_file=None, delnodes_file=None,
+               taxdump_file=None):
+    """
+    Memory-maps an index file.
+
+    Parameters
+    ----------
+    index_file : string
+        path to the index.
+    names_file, nodes_file, merged_file, delnodes_file, taxdump_file : string, optional
+        dump files (or taxdump archive) the index should correspond to. If
+        given and present, the index is checked against them and
+        StaleIndexError is raised on mismatch.
+    verify : bool, optional
+        Additionally compares the crc32 checksums of the dump files.
+
+    Returns
+    -------
+    TaxonomyIndex
+
+    """
+    index=TaxonomyIndex(index_file)
+    if taxdump_file:
+        #The archive replaces the dump files.
+        names_file=nodes_file=merged_file=delnodes_file=None
+    for key, path in (("names", names_file), ("nodes", nodes_file),
+                      ("merged", merged_file), ("delnodes", delnodes_file), ("taxdump", taxdump_file)):
+        if path is None or not os.path.exists(path):
+            continue
+        stored=index.header["sources"].get(key)
+        if stored is None or dump_fingerprint(path)!=stored[:2] or (verify and _crc32(path)!=stored[2]):
+            index.close()
+            raise StaleIndexError("{} is older than {}.".format(index_file, path))
+    return index
+
+
+def open_index(index_file="taxonomy.idx", names_file="names.dmp", nodes_file="nodes.dmp", workers=None,
+               merged_file="merged.dmp", delnodes_file="delnodes.dmp", taxdump_file=None):
+    """
+    Loads the index, building it first (with workers processes) if it is
+    missing or stale. With taxdump_file, the index is built from the taxdump
+    archive instead of the dump files.
+
+    Returns
+    -------
+    TaxonomyIndex
+
+    """
+    dumps=dict(merged_file=merged_file, delnodes_file=delnodes_file, taxdump_file=taxdump_file)
+    try:
+        return load_index(index_file, names_file, nodes_file, **dumps)
+    except (OSError, ValueError, StaleIndexError):
+        #A missing index raises OSError, a truncated one ValueError.
+        pass
+    build_index(names_file, nodes_file, index_file, workers, merged_file, delnodes_file, taxdump_file)
+    return load_index(index_file, names_file, nodes_file, **dumps)
+
+
+class SharedIndex:
+    """
+    Keeps one loaded index for a long running process (webinterface, daemon).
+    The index is loaded on the first call of get() and reused afterwards. Every
+    check_interval seconds, get() also checks whether the dump files or the
+    index file on disk changed. A changed index file (f.e. rebuilt by another
+    worker process) is simply mapped again; changed dump files are compiled
+    into a new index in a background thread, while the old index keeps
+    answering. The new index then replaces the old one in a single assignment,
+    so every request sees either the old or the new taxonomy, never a mix.
+    Requests hold the index with acquire() and release() (or using()): a
+    replaced index is closed when its last user released it, however long
+    that takes (f.e. a streamed response), so swaps do not leak mappings.
+    get() is for immediate use only, it does not keep a replaced index open.
+
+    As the index is memory-mapped read-only, all worker processes (and workers
+    forked after loading) share the same pages of the OS page cache.
+
+    Attributes
+    ----------
+    loads : int
+        number of times an index was loaded (first load and swaps).
+    load_seconds : float
+        duration of the last load, including a build if the index was missing.
+    """
+
+    def __init__(self, index_file="taxonomy.idx", names_file="names.dmp", nodes_file="nodes.dmp",
+                 check_interval=30, cache_size=100000, merged_file="merged.dmp", delnodes_file="delnodes.dmp",
+                 taxdump_file=None):
+        self.index_file=index_file
+        self.cache_size=cache_size
+        self.names_file=names_file
+        self.nodes_file=nodes_file
+        self.merged_file=merged_file
+        self.delnodes_file=delnodes_file
+        self.taxdump_file=taxdump_file
+        self.check_interval=check_interval
+        self._index=None
+        #Replaced indexes, closed once they have no users, and the users per index (by id).
+        self._retired=[]
+        self._users=dict()
+        self._checked=0
+        self._lock=threading.Lock()
+        self._rebuilding=False
+        self.loads=0
+        self.load_seconds=None
+
+    @property
+    def loaded(self):
+        "Whether an index has been loaded yet."
+        return self._index is not None
+
+    def get(self):
+        """
+        Returns the current TaxonomyIndex, loading it first if needed.
+        """
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index=self._load(open_index)
+                    self._checked=time.monotonic()
+        elif time.monotonic()-self._checked>=self.check_interval:
+            self._checked=time.monotonic()
+            self._check()
+        return self._index
+
+    def acquire(self):
+        """
+        Returns the current TaxonomyIndex (see get) and counts the caller as
+        one of its users, until it calls release(index).
+        """
+        self.get()
+        with self._lock:
+            index=self._index
+            self._users[id(index)]=self._users.get(id(index), 0)+1
+        return index
+
+    def release(self, index):
+        "Ends one use of an index returned by acquire, a replaced index is closed after its last use."
+        with self._lock:
+            users=self._users.get(id(index), 0)-1
+            if users>0:
+                self._users[id(index)]=users
+            else:
+                self._users.pop(id(index), None)
+        self._close_retired()
+
+    @contextmanager
+    def using(self):
+        "Context manager around acquire and release."
+        index=self.acquire()
+        try:
+            yield index
+        finally:
+            self.release(index)
+
+    def _load(self, loader):
+        "Loads the index with open_index or load_index and sizes its cache."
+        start=time.perf_counter()
+        index=loader(self.index_file, self.names_file, self.nodes_file,
+                     merged_file=self.merged_file, delnodes_file=self.delnodes_file, taxdump_file=self.taxdump_file)
+        index.cache.capacity=self.cache_size
+        self.load_seconds=time.perf_counter()-start
+        self.loads+=1
+        return index
+
+    def _swap(self, index):
+        "Replaces the current index, the old one is closed once it has no users."
+        with self._lock:
+            if self._index is not None:
+                self._retired.append(self._index)
+            self._index=index
+        self._close_retired()
+
+    def _close_retired(self, force=False):
+        "Closes the replaced indexes that no acquired user holds anymore."
+        with self._lock:
+            unused=[index for index in self._retired if force or id(index) not in self._users]
+            self._retired=[index for index in self._retired if not (force or id(index) not in self._users)]
+        for index in unused:
+            index.close()
+
+    def close(self):
+        "Closes the current index and all replaced ones."
+        self._close_retired(force=True)
+        with self._lock:
+            if self._index is not None:
+                self._index.close()
+                self._index=None
+
+    def _changed_dumps(self):
+        sources=self._index.header["sources"]
+        if self.taxdump_file:
+            dumps=(("taxdump", self.taxdump_file),)
+        else:
+            dumps=(("names", self.names_file), ("nodes", self.nodes_file),
+                   ("merged", self.merged_file), ("delnodes", self.delnodes_file))
+        for key, path in dumps:
+            if os.path.exists(path) and (key not in sources or dump_fingerprint(path)!=sources[key][:2]):
+                return True
+        return False
+
+    def _check(self):
+        "Swaps in a changed index file, or starts a rebuild for changed dump files."
+        try:
+            stat=os.stat(self.index_file)
+            if (stat.st_ino, stat.st_mtime_ns)!=self._index.identity:
+                self._swap(self._load(load_index))
+                return
+        except (OSError, ValueError, StaleIndexError):
+            #Half way through a rebuild by another process, the next check retries.
+            pass
+        if self._changed_dumps() and not self._rebuilding:
+            self._rebuilding=True
+            threading.Thread(target=self._rebuild, daemon=True).start()
+
+    def _rebuild(self):
+        lock_file=self.index_file+".lock"
+        try:
+            #Only one process rebuilds, the others pick up the new file in _check.
+            descriptor=os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            #A lock older than a day is left over from a crashed rebuild.
+            try:
+                if time.time()-os.stat(lock_file).st_mtime>86400:
+                    os.remove(lock_file)
+            except OSError:
+                pass
+            self._rebuilding=False
+            return
+        try:
+            #Only the changes of the new dump files are applied to the index.
+            update_index(self.index_file, self.names_file, self.nodes_file, self.merged_file, self.delnodes_file,
+                         taxdump_file=self.taxdump_file)
+            self._swap(self._load(load_index))
+        finally:
+            os.close(descriptor)
+            os.remove(lock_file)
+            self._rebuilding=False
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""
+Makes the Taxa_Finder modules importable for the tests and provides a small
+synthetic taxdump (see Taxa_Benchmark.generate_taxdump).
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Taxa_Benchmark import generate_taxdump
+
+
+@pytest.fixture
+def taxdump(tmp_path):
+    "Directory with a synthetic taxdump of 3000 taxa."
+    generate_taxdump(str(tmp_path/"dump"), size=3000, depth=12, fanout=6, seed=1)
+    return tmp_path/"dump"
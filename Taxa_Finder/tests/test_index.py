@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Round trip and equivalence tests of the binary taxonomy index: every taxid,
+parent, rank and name of the dump files is found again in the index, and an
+index updated with update_index is the same file as one built from scratch.
+"""
+
+import os
+
+import pytest
+
+import Taxa_Index
+from Taxa_Index import SharedIndex, build_index, load_index, update_index
+
+
+def dump_files(directory):
+    "Paths of names.dmp, nodes.dmp, merged.dmp and delnodes.dmp in directory."
+    return [os.path.join(str(directory), name) for name in ("names.dmp", "nodes.dmp", "merged.dmp", "delnodes.dmp")]
+
+
+def read_dump(directory):
+    """
+    Parses the dump files the plain way.
+
+    Returns
+    -------
+    nodes : dictionary
+        taxid as key, (parent, rank, hidden) as value.
+    scientific : dictionary
+        taxid as key, scientific name as value.
+    merged : dictionary
+        old taxid as key, new taxid as value.
+    deleted : set
+        deleted taxids.
+
+    """
+    names_file, nodes_file, merged_file, delnodes_file=dump_files(directory)
+    nodes=dict()
+    with open(nodes_file) as handle:
+        for line in handle:
+            fields=line.split("\t|\t")
+            nodes[int(fields[0])]=(int(fields[1]), fields[2], int(fields[10]))
+    scientific=dict()
+    with open(names_file) as handle:
+        for line in handle:
+            fields=line.rstrip("\t|\n").split("\t|\t")
+            if fields[3]=="scientific name":
+                scientific[int(fields[0])]=fields[1]
+    with open(merged_file) as handle:
+        merged=dict(tuple(int(field) for field in line.rstrip("\t|\n").split("\t|\t")) for line in handle)
+    with open(delnodes_file) as handle:
+        deleted=set(int(line.rstrip("\t|\n")) for line in handle)
+    return nodes, scientific, merged, deleted
+
+
+def edit_dump(directory):
+    """
+    Changes a dump the way a new taxdump release would: a taxon is moved below
+    the root, another one is renamed, the last taxon is deleted and new taxa
+    are added below the moved one.
+    """
+    names_file, nodes_file, merged_file, delnodes_file=dump_files(directory)
+    with open(nodes_file) as handle:
+        nodes=handle.readlines()
+    with open(names_file) as handle:
+        names=handle.readlines()
+    moved=nodes[10].split("\t|\t")
+    moved[1]="1"
+    nodes[10]="\t|\t".join(moved)
+    renamed=nodes[20].split("\t|\t")[0]
+    names=[("{}\t|\tRenamed taxon\t|\t\t|\tscientific name\t|\n".format(renamed)
+            if line.startswith(renamed+"\t") and "scientific name" in line else line) for line in names]
+    last=nodes.pop().split("\t|\t")[0]
+    names=[line for line in names if not line.startswith(last+"\t")]
+    new=int(last)+10
+    for taxid in range(new, new+5):
+        nodes.append("{}\t|\t{}\t|\tspecies\t|\t\t|\t0\t|\t1\t|\t11\t|\t1\t|\t1\t|\t1\t|\t0\t|\t0\t|\t\t|\n".format(
+            taxid, moved[0]))
+        names.append("{}\t|\tNew taxon {}\t|\t\t|\tscientific name\t|\n".format(taxid, taxid))
+    with open(nodes_file, 'w') as handle:
+        handle.writelines(nodes)
+    with open(names_file, 'w') as handle:
+        handle.writelines(names)
+    with open(delnodes_file, 'a') as handle:
+        handle.write("{}\t|\n".format(last))
+
+
+def test_round_trip(taxdump, tmp_path):
+    "Every taxon of the dump is found in the index with its parent, rank, name and lineage."
+    index_file=str(tmp_path/"taxonomy.idx")
+    build_index(*dump_files(taxdump)[:2], index_file, workers=1, merged_file=dump_files(taxdump)[2],
+                delnodes_file=dump_files(taxdump)[3])
+    nodes, scientific, merged, deleted=read_dump(taxdump)
+    index=load_index(index_file, *dump_files(taxdump)[:2], verify=True)
+    try:
+        assert index.max_taxid==max(nodes)
+        for taxid, (parent, rank, hidden) in nodes.items():
+            assert taxid in index
+            assert index.parent[taxid]==parent
+            assert index.rank_of(taxid)==rank
+            assert index.hidden[taxid]==hidden
+            assert index.name(taxid)==scientific[taxid]
+            assert index.resolve(str(taxid))==taxid
+            #The lineage is the chain of parents up to (without) the root.
+            path=[]
+            current=parent
+            while current>1:
+                path.append(current)
+                current=nodes[current][0]
+            assert index.ancestors(taxid)==path
+        #Made-up names can repeat, a unique name resolves to its taxon.
+        counts=dict()
+        for name in scientific.values():
+            counts[name.lower()]=counts.get(name.lower(), 0)+1
+        for taxid, name in scientific.items():
+            if counts[name.lower()]==1:
+                assert index.resolve(name)==taxid
+                assert index.resolve(name.upper())==taxid
+        for old, new in merged.items():
+            assert index.redirect(old)==(new, "merged")
+        for taxid in deleted:
+            assert index.redirect(taxid)==(None, "deleted")
+        assert index.resolve("No such taxon") is None
+    finally:
+        index.close()
+
+
+def test_workers_build_the_same_index(taxdump, tmp_path):
+    "The index does not depend on the number of worker processes."
+    build_index(*dump_files(taxdump)[:2], str(tmp_path/"one.idx"), workers=1)
+    build_index(*dump_files(taxdump)[:2], str(tmp_path/"two.idx"), workers=2)
+    assert (tmp_path/"one.idx").read_bytes()==(tmp_path/"two.idx").read_bytes()
+
+
+@pytest.mark.parametrize("with_numpy", [True, False])
+def test_update_equals_build(taxdump, tmp_path, monkeypatch, with_numpy):
+    "An index updated to a new dump is the same file as one built from the new dump."
+    if not with_numpy:
+        monkeypatch.setattr(Taxa_Index, "numpy", None)
+    elif Taxa_Index.numpy is None:
+        pytest.skip("numpy is not installed")
+    updated=str(tmp_path/"updated.idx")
+    names_file, nodes_file, merged_file, delnodes_file=dump_files(taxdump)
+    build_index(names_file, nodes_file, updated, workers=1, merged_file=merged_file, delnodes_file=delnodes_file)
+    edit_dump(taxdump)
+    changes=update_index(updated, names_file, nodes_file, merged_file=merged_file, delnodes_file=delnodes_file,
+                         workers=1)
+    #Applied as a diff, not built from scratch.
+    assert changes is not None and changes["added"]==5 and changes["removed"]==1 and changes["moved"]==1
+    built=str(tmp_path/"built.idx")
+    build_index(names_file, nodes_file, built, workers=1, merged_file=merged_file, delnodes_file=delnodes_file)
+    with open(updated, 'rb') as a, open(built, 'rb') as b:
+        assert a.read()==b.read()
+    index=load_index(updated, names_file, nodes_file)
+    try:
+        assert index.resolve("Renamed taxon") is not None
+        assert len(index.descendants(index.resolve("New taxon {}".format(index.max_taxid))))==0
+    finally:
+        index.close()
+
+
+def test_shared_index_keeps_acquired_index_open(taxdump, tmp_path):
+    "A swapped index stays usable until its last user released it, and is closed then."
+    names_file, nodes_file=dump_files(taxdump)[:2]
+    index_file=str(tmp_path/"taxonomy.idx")
+    build_index(names_file, nodes_file, index_file, workers=1)
+    shared=SharedIndex(index_file, names_file, nodes_file, merged_file=None, delnodes_file=None)
+    try:
+        held=shared.acquire()
+        shared._swap(load_index(index_file))
+        assert shared.get() is not held
+        assert held.name(1)=="root"
+        shared.release(held)
+        with pytest.raises(ValueError):
+            held.parent[1]
+        with shared.using() as index:
+            assert index is shared.get()
+    finally:
+        shared.close()